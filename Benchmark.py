@@ -0,0 +1,643 @@
+import argparse
+import contextlib
+import glob
+import itertools
+import os
+import resource
+import tempfile
+import threading
+import time
+import types
+import wave
+
+import numpy as np
+
+import re
+
+import Main
+from Main import (encode_audio, sf, AdaptiveVAD, ThresholdVAD, address_parser, UnitRoster,
+                  Unit, CallSessionManager, EmergencyDispatcher, WavReplaySource, load_wav,
+                  Geocoder, GeocodeCache, GazetteerProvider, StageMetrics, AudioPlayer,
+                  TTS_SAMPLE_RATE, PriorityScheduler, EndpointBudget, CallArchive,
+                  TranscriptIndex, EMERGENCY_TYPES)
+
+# Benchmarks for the dispatcher's hot paths. Run one with e.g.
+#   python Benchmark.py encode --seconds 4 --iterations 200
+#   python Benchmark.py vad --corpus recordings/
+#   python Benchmark.py address --words 500 5000
+#   python Benchmark.py units --units 3000
+#   python Benchmark.py archive --calls 2000
+#   python Benchmark.py search --calls 200000
+#   python Benchmark.py replay --calls 1 10 100 --speed 10
+
+SAMPLE_RATE = 16000
+
+def synthetic_speech(seconds, sample_rate=SAMPLE_RATE, seed=0):
+    """Speech-like int16 audio: a few harmonics under a syllable-rate envelope plus noise."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    pitch = 120 + 30 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None)
+    audio = 6000 * voiced * envelope + rng.normal(0, 200, len(t))
+    return np.clip(audio, -32768, 32767).astype(np.int16)
+
+def report(name, timings, extra=""):
+    timings = np.asarray(timings) * 1000
+    print(f"{name:<28} p50 {np.percentile(timings, 50):8.3f} ms   "
+          f"p95 {np.percentile(timings, 95):8.3f} ms   {extra}")
+
+def bench_encode(args):
+    """Compare the old temp-WAV round trip with in-memory WAV and FLAC encoding."""
+    audio = synthetic_speech(args.seconds)
+    temp_dir = tempfile.mkdtemp()
+
+    def temp_file_upload_body():
+        # What process_recorded_speech used to do before every upload
+        temp_path = os.path.join(temp_dir, f"speech_{time.time()}.wav")
+        with wave.open(temp_path, 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(SAMPLE_RATE)
+            wf.writeframes(audio.tobytes())
+        with open(temp_path, 'rb') as audio_file:
+            body = audio_file.read()
+        os.remove(temp_path)
+        return body
+
+    candidates = [('temp file wav', temp_file_upload_body),
+                  ('in-memory wav', lambda: encode_audio(audio, SAMPLE_RATE, 1, 'wav')[1])]
+    if sf is not None:
+        candidates.append(('in-memory flac', lambda: encode_audio(audio, SAMPLE_RATE, 1, 'flac')[1]))
+    else:
+        print("soundfile not installed - skipping FLAC")
+
+    print(f"Encoding {args.seconds:.1f} s utterance, {args.iterations} iterations")
+    for name, encode in candidates:
+        timings = []
+        for _ in range(args.iterations):
+            start = time.perf_counter()
+            body = encode()
+            timings.append(time.perf_counter() - start)
+        report(name, timings, f"{len(body) / 1024:8.1f} KiB upload")
+    os.rmdir(temp_dir)
+
+def synthetic_call(noise_db, seed, sample_rate=SAMPLE_RATE, n_turns=6):
+    """A caller taking several turns with mid-sentence pauses over background noise.
+
+    Returns the audio and the true (start, end) of every turn in seconds.
+    """
+    rng = np.random.default_rng(seed)
+    pieces, turns, t = [np.zeros(sample_rate)], [], 1.0
+    for turn in range(n_turns):
+        turn_start = t
+        for phrase in range(rng.integers(2, 5)):
+            if phrase:
+                pause = rng.uniform(0.15, 0.6)
+                pieces.append(np.zeros(int(pause * sample_rate)))
+                t += pause
+            length = rng.uniform(0.6, 2.0)
+            pieces.append(synthetic_speech(length, sample_rate, seed=seed * 100 + turn * 10 + phrase))
+            t += length
+        turns.append((turn_start, t))
+        pieces.append(np.zeros(int(2.5 * sample_rate)))
+        t += 2.5
+
+    audio = np.concatenate(pieces).astype(np.float32)
+    # Background noise that drifts louder over the call, like a siren approaching
+    drift = np.linspace(0.5, 1.5, len(audio))
+    audio += rng.normal(0, 10 ** (noise_db / 20), len(audio)) * drift
+    return np.clip(audio, -32768, 32767).astype(np.int16), turns
+
+def load_corpus(directory):
+    """Load `name.wav` files (16 kHz mono int16) with `name.txt` turn labels, one 'start end' per line."""
+    corpus = []
+    for wav_path in sorted(glob.glob(os.path.join(directory, '*.wav'))):
+        label_path = os.path.splitext(wav_path)[0] + '.txt'
+        if not os.path.exists(label_path):
+            print(f"Skipping {wav_path}: no turn labels")
+            continue
+        with wave.open(wav_path, 'rb') as wf:
+            if wf.getframerate() != SAMPLE_RATE or wf.getnchannels() != 1 or wf.getsampwidth() != 2:
+                print(f"Skipping {wav_path}: expected 16 kHz mono 16-bit")
+                continue
+            audio = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+        with open(label_path) as f:
+            turns = [tuple(map(float, line.split()[:2])) for line in f if line.strip()]
+        corpus.append((os.path.basename(wav_path), audio, turns))
+    return corpus
+
+def evaluate_endpoints(vad, audio, turns, frame_duration=0.05):
+    """Run a VAD's streaming state machine over a recording and score its turn ends."""
+    frame_samples = int(frame_duration * SAMPLE_RATE)
+    ends = []
+    for i in range(len(audio) // frame_samples):
+        if vad.update(audio[i * frame_samples:(i + 1) * frame_samples]) == 'end':
+            ends.append((i + 1) * frame_duration)
+
+    latencies, false_cuts, missed = [], 0, 0
+    for index, (start, end) in enumerate(turns):
+        next_start = turns[index + 1][0] if index + 1 < len(turns) else float('inf')
+        false_cuts += sum(1 for e in ends if start < e < end)
+        after = [e for e in ends if end <= e < next_start]
+        if after:
+            latencies.append(after[0] - end)
+        else:
+            missed += 1
+    return latencies, false_cuts, missed
+
+def bench_vad(args):
+    """Compare turn-end latency and false cuts of the threshold and adaptive VADs."""
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    else:
+        corpus = [(f"synthetic {noise_db} dB noise #{seed}", *synthetic_call(noise_db, seed))
+                  for noise_db in (30, 45, 55, 60) for seed in range(3)]
+
+    engines = {
+        'threshold': lambda: ThresholdVAD(0.05, 1.5, 700),
+        'adaptive': lambda: AdaptiveVAD(SAMPLE_RATE, 0.05, 1.5),
+    }
+    print(f"{len(corpus)} recordings, {sum(len(turns) for _, _, turns in corpus)} turns")
+    for name, make_vad in engines.items():
+        latencies, false_cuts, missed = [], 0, 0
+        start = time.perf_counter()
+        for _, audio, turns in corpus:
+            lat, cuts, miss = evaluate_endpoints(make_vad(), audio, turns)
+            latencies += lat
+            false_cuts += cuts
+            missed += miss
+        elapsed = time.perf_counter() - start
+        audio_seconds = sum(len(audio) for _, audio, _ in corpus) / SAMPLE_RATE
+        latency = (f"mean {np.mean(latencies):.2f} s  p90 {np.percentile(latencies, 90):.2f} s"
+                   if latencies else "no turns ended")
+        print(f"{name:<10} turn-end {latency}   false cuts {false_cuts:3d}   "
+              f"missed ends {missed:3d}   {audio_seconds / elapsed:6.0f}x real time")
+
+# The regexes handle_input used before the tokenizer-based AddressParser
+LEGACY_ADDRESS_PATTERNS = [
+    r'at\s+([\d]+[\w\s,.-]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|Terr|Terrace)[\w\s,.-]+)',
+    r'on\s+([\d]+[\w\s,.-]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|Terr|Terrace)[\w\s,.-]+)',
+    r'(?:location|address|place) is\s+([\d]+[\w\s,.-]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|terr|terrace)[\w\s,.-]+)'
+]
+
+def legacy_find_address(text):
+    for pattern in LEGACY_ADDRESS_PATTERNS:
+        match = re.search(pattern, text, re.IGNORECASE)
+        if match:
+            return match.group(1)
+    return None
+
+def run_on_transcript(words, seed=0):
+    """A long panicked transcript full of numbers and 'at'/'on' but no street suffix."""
+    rng = np.random.default_rng(seed)
+    vocabulary = ['at', 'on', 'he', 'was', 'there', 'and', 'then', 'maybe', 'like',
+                  'the', 'car', 'came', 'back', 'floor', 'minutes', 'ago', 'please', 'hurry']
+    out = []
+    for i in range(words):
+        out.append(str(rng.integers(1, 500)) if i % 7 == 1 else vocabulary[rng.integers(len(vocabulary))])
+    return ' '.join(out)
+
+def bench_address(args):
+    """Time the legacy address regexes against AddressParser on long run-on transcripts."""
+    for words in args.words:
+        text = run_on_transcript(words)
+        for name, find in (('legacy regex', legacy_find_address), ('AddressParser', address_parser.parse)):
+            if name == 'legacy regex' and words > args.legacy_limit:
+                print(f"{name:<14} {words:>6} words   skipped (above --legacy-limit)")
+                continue
+            timings = []
+            for _ in range(args.iterations):
+                start = time.perf_counter()
+                find(text)
+                timings.append(time.perf_counter() - start)
+            report(f"{name:<14} {words:>6} words", timings)
+
+def bench_units(args):
+    """Time closest-3-available-ambulance queries on a large roster with status churn."""
+    rng = np.random.default_rng(0)
+    roster = UnitRoster()
+    types = ['AMBULANCE', 'FIRE_ENGINE', 'POLICE']
+    for i in range(args.units):
+        roster.add(Unit(f"U-{i}", types[i % 3], 40.5 + rng.random() * 0.4, -74.25 + rng.random() * 0.5))
+    unit_ids = list(roster.units)
+
+    query_timings, churn_timings = [], []
+    for _ in range(args.queries):
+        for _ in range(args.churn):
+            unit_id = unit_ids[rng.integers(len(unit_ids))]
+            status = 'AVAILABLE' if rng.random() < 0.6 else 'DISPATCHED'
+            start = time.perf_counter()
+            roster.update(unit_id, status=status,
+                          lat=40.5 + rng.random() * 0.4, lon=-74.25 + rng.random() * 0.5)
+            churn_timings.append(time.perf_counter() - start)
+        lat, lon = 40.5 + rng.random() * 0.4, -74.25 + rng.random() * 0.5
+        start = time.perf_counter()
+        roster.nearest('AMBULANCE', lat, lon, k=3)
+        query_timings.append(time.perf_counter() - start)
+
+    print(f"{args.units} units, {args.churn} status/position updates between queries")
+    report("nearest 3 ambulances", query_timings)
+    report("status update", churn_timings)
+
+def bench_archive(args):
+    """Time live-path archive appends, flushing, and call and time-range lookups."""
+    rng = np.random.default_rng(0)
+    utterance = synthetic_speech(args.utterance_seconds)
+    directory = tempfile.mkdtemp()
+    archive = CallArchive(directory, flush_interval=3600).open()
+    append_timings, flush_timings = [], []
+    now = time.time()
+    for call in range(args.calls):
+        call_id = f"call-{call}"
+        t = now + call * 60.0
+        archive.record_event(call_id, 'call_start', {}, timestamp=t)
+        for turn in range(args.turns):
+            start = time.perf_counter()
+            archive.record_audio(call_id, utterance, t + turn * 8, t + turn * 8 + args.utterance_seconds)
+            archive.record_event(call_id, 'transcript_update',
+                                 {'role': 'caller', 'message': "There's a fire at 12 Main Street"},
+                                 timestamp=t + turn * 8 + args.utterance_seconds)
+            append_timings.append(time.perf_counter() - start)
+        if call % 100 == 99:
+            start = time.perf_counter()
+            archive.flush()
+            flush_timings.append(time.perf_counter() - start)
+    archive.close()
+
+    size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    entries = len(archive.entries())
+    print(f"{args.calls} calls, {entries} records, {size / 1e6:.1f} MB "
+          f"({os.path.getsize(archive.index_path) / 1e6:.1f} MB index)")
+    report("append utterance + event", append_timings)
+    report("flush 100 calls", flush_timings)
+    lookups, ranges = [], []
+    for _ in range(args.queries):
+        call = int(rng.integers(args.calls))
+        start = time.perf_counter()
+        archive.events(f"call-{call}")
+        archive.audio(f"call-{call}")
+        lookups.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        archive.events(since=now + call * 60.0, until=now + call * 60.0 + 600)
+        ranges.append(time.perf_counter() - start)
+    report("call events + audio", lookups)
+    report("10 minute range events", ranges)
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+    os.rmdir(directory)
+
+SEARCH_STREETS = ['Park', 'Main', 'Oak', 'Maple', 'Broadway', 'Elm', 'Lexington', 'Madison', 'Pine',
+                  'Cedar', 'Washington', 'Lake', 'Hill', 'Church', 'Mill', 'River', 'Spring', 'Union']
+SEARCH_SUFFIXES = ['Avenue', 'Street', 'Road', 'Ave', 'St', 'Place', 'Boulevard']
+
+def bench_search(args):
+    """Time incremental indexing, merging and phrase/filter queries over many archived calls."""
+    rng = np.random.default_rng(0)
+    phrases = [(name, phrase) for name, table in EMERGENCY_TYPES for phrase in table]
+    directory = tempfile.mkdtemp()
+    archive = CallArchive(os.path.join(directory, 'archive'), flush_interval=3600).open()
+    index = TranscriptIndex(archive, os.path.join(directory, 'search'))
+    now = time.time()
+    index_timings, merge_timings = [], []
+    for call in range(args.calls):
+        call_id = f"call-{call}"
+        t = now - (args.calls - call) * args.spacing
+        emergency_type, phrase = phrases[rng.integers(len(phrases))]
+        street = f"{SEARCH_STREETS[rng.integers(len(SEARCH_STREETS))]} {SEARCH_SUFFIXES[rng.integers(len(SEARCH_SUFFIXES))]}"
+        lines = [f"there is a {phrase} at {rng.integers(1, 999)} {street}",
+                 "what is the address of the emergency",
+                 f"please hurry it is the building next to the {SEARCH_STREETS[rng.integers(len(SEARCH_STREETS))]} station",
+                 "help is on the way stay on the line with me"]
+        for turn, message in enumerate(lines[:args.turns]):
+            archive.record_event(call_id, 'transcript_update',
+                                 {'role': 'caller' if turn % 2 == 0 else 'dispatcher', 'message': message},
+                                 timestamp=t + turn)
+        archive.record_event(call_id, 'incident_update', {'type': emergency_type}, timestamp=t + 1)
+        if call % args.batch == args.batch - 1 or call == args.calls - 1:
+            archive.flush()
+            start = time.perf_counter()
+            index.update()
+            index_timings.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            if index.merge():
+                merge_timings.append(time.perf_counter() - start)
+
+    stats = index.stats()
+    print(f"{args.calls} calls, {stats['utterances']} utterances in {stats['segments']} segment(s) "
+          f"(tiers {stats['tiers']})")
+    report(f"index {args.batch} calls", index_timings)
+    if merge_timings:
+        report("merge", merge_timings)
+    week = now - 7 * 24 * 3600
+    queries = [("gas", {}), ('"gas leak"', {}), ('"gas leak" "park avenue"', {}),
+               ('"gas leak" "park avenue"', {'since': week}), ("park", {'emergency_type': 'MEDICAL'}),
+               ("help way", {'role': 'dispatcher', 'since': week})]
+    for query, filters in queries:
+        timings = []
+        for _ in range(args.queries):
+            start = time.perf_counter()
+            result = index.search(query, **filters)
+            timings.append(time.perf_counter() - start)
+        label = query + ''.join(f" {key}={value if key != 'since' else 'week'}" for key, value in filters.items())
+        report(label[:28], timings, f"{result['total_matches']} matches in {result['total_calls']} calls")
+    archive.close()
+    for root, _, names in os.walk(directory, topdown=False):
+        for name in names:
+            os.remove(os.path.join(root, name))
+        os.rmdir(root)
+
+class LocalOpenAI:
+    """Local stand-in for the OpenAI endpoints the dispatcher calls, with configurable latency.
+
+    Latencies are log-normally jittered around the configured means. Time to
+    first token grows by `context_cost` per message sent to the model, honoring
+    a run's truncation_strategy. A `tail_rate` fraction of requests take 10x
+    as long, to exercise hedging. Transcripts cycle through `transcripts`; TTS
+    returns silence sized to the text.
+    """
+
+    def __init__(self, transcription_latency=0.4, first_token_latency=0.5, token_interval=0.02,
+                 tts_latency=0.2, transcripts=None, response=None, seed=None, context_cost=0.0,
+                 tail_rate=0.0):
+        self.transcription_latency = transcription_latency
+        self.first_token_latency = first_token_latency
+        self.context_cost = context_cost
+        self.tail_rate = tail_rate
+        self.thread_messages = 0
+        self.token_interval = token_interval
+        self.tts_latency = tts_latency
+        self.transcripts = itertools.cycle(transcripts or [
+            "There's a fire in my apartment at 42 Elm Street",
+            "My neighbor is not breathing, please hurry",
+            "There is heavy smoke and it's spreading quickly",
+        ])
+        self.response = response or ("Help is on the way. Stay on the line with me. "
+                                     "Is anyone inside the building?")
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.Lock()
+
+        ns = types.SimpleNamespace
+        self.audio = ns(transcriptions=ns(create=self._transcribe),
+                        speech=ns(create=self._speech,
+                                  with_streaming_response=ns(create=self._speech_stream)))
+        self.beta = ns(threads=ns(create=lambda **kw: ns(id="thread_local"),
+                                  messages=ns(create=self._create_message,
+                                              delete=self._delete_message),
+                                  runs=ns(stream=self._run_stream, cancel=lambda **kw: None)))
+
+    def _sleep(self, mean):
+        if mean > 0:
+            with self.lock:
+                jitter = self.rng.lognormal(0, 0.3)
+                if self.rng.random() < self.tail_rate:
+                    jitter *= 10
+            time.sleep(mean * jitter)
+
+    def _create_message(self, **kwargs):
+        with self.lock:
+            self.thread_messages += 1
+        return types.SimpleNamespace(id="msg_local")
+
+    def _delete_message(self, **kwargs):
+        with self.lock:
+            self.thread_messages -= 1
+
+    def _transcribe(self, **kwargs):
+        self._sleep(self.transcription_latency)
+        with self.lock:
+            return next(self.transcripts)
+
+    def _pcm_for(self, text):
+        return bytes(int(len(text) * 0.06 * TTS_SAMPLE_RATE) * 2)  # ~60 ms of speech per character
+
+    def _speech(self, **kwargs):
+        self._sleep(self.tts_latency)
+        return types.SimpleNamespace(content=self._pcm_for(kwargs['input']))
+
+    @contextlib.contextmanager
+    def _speech_stream(self, **kwargs):
+        self._sleep(self.tts_latency)
+        pcm = self._pcm_for(kwargs['input'])
+        yield types.SimpleNamespace(
+            iter_bytes=lambda size: (pcm[i:i + size] for i in range(0, len(pcm), size)))
+
+    @contextlib.contextmanager
+    def _run_stream(self, **kwargs):
+        with self.lock:
+            self.thread_messages += 1  # The reply
+            context = self.thread_messages
+        truncation = kwargs.get('truncation_strategy') or {}
+        if truncation.get('type') == 'last_messages':
+            context = min(context, truncation['last_messages'] + 1)  # Plus the summary
+
+        def deltas():
+            self._sleep(self.first_token_latency + self.context_cost * context)
+            for word in self.response.split(' '):
+                yield word + ' '
+                time.sleep(self.token_interval)
+        yield types.SimpleNamespace(text_deltas=deltas())
+
+class NullPlayer(AudioPlayer):
+    """Stands in for the sound card: blocks for as long as the audio would play."""
+
+    class Stream:
+        stopped = False
+
+        def __init__(self, speed):
+            self.speed = speed
+
+        def write(self, block):
+            time.sleep(len(block) / (2 * TTS_SAMPLE_RATE) / self.speed)
+
+        def abort(self):
+            pass
+
+        def close(self):
+            pass
+
+    def __init__(self, speed):
+        super().__init__(TTS_SAMPLE_RATE)
+        self.stream = self.Stream(speed)
+
+class FirstAudioTimer:
+    """Measures the time from the caller going quiet to the first dispatcher audio."""
+
+    def __init__(self):
+        self.timings = []
+        self.lock = threading.Lock()
+
+    def instrument(self, dispatcher):
+        turn_ends = {}
+        current = {}
+        queue_utterance, handle_input, player = (dispatcher.queue_utterance,
+                                                 dispatcher.handle_input, dispatcher.player)
+
+        def timed_queue_utterance(end):
+            turn_ends[dispatcher.utterance_seq] = time.perf_counter()
+            queue_utterance(end)
+
+        def timed_handle_input(text, *args):
+            # The dialogue worker answers utterance `utterances_done` next
+            current['ended'] = turn_ends.pop(dispatcher.utterances_done, None)
+            handle_input(text, *args)
+
+        def timed_write(pcm):
+            ended = current.pop('ended', None)
+            if ended is not None:
+                with self.lock:
+                    self.timings.append(time.perf_counter() - ended)
+            return write(pcm)
+
+        write = player.write
+        dispatcher.queue_utterance = timed_queue_utterance
+        dispatcher.handle_input = timed_handle_input
+        player.write = timed_write
+
+def replay_corpus(directory, turns=6):
+    if directory:
+        return [load_wav(path) for path in sorted(glob.glob(os.path.join(directory, '*.wav')))]
+    return [synthetic_call(40, seed, n_turns=turns)[0] for seed in range(4)]
+
+def bench_replay(args):
+    """Replay calls end to end against a local OpenAI stand-in at N concurrent calls."""
+    corpus = replay_corpus(args.corpus, args.turns)
+    if not corpus:
+        raise SystemExit(f"No WAV files in {args.corpus}")
+
+    # Keep geocoding offline so the benchmark never leaves the machine
+    gazetteer = GazetteerProvider()
+    gazetteer.add("42 Elm Street, New York, NY", 40.7128, -74.0060)
+    Main.geocoder = Geocoder([gazetteer], GeocodeCache())
+    Main.unit_roster = Main.demo_roster()
+
+    for calls in args.calls:
+        timer = FirstAudioTimer()
+        Main.stage_metrics = StageMetrics(enabled=True)  # Fresh process histograms per run
+        Main.event_hub = Main.EventHub()
+        # Rate budgets are in wall-clock time and replay runs faster than real time,
+        # so only concurrency is budgeted here
+        Main.scheduler = PriorityScheduler([EndpointBudget(name, args.api_concurrency or calls)
+                                            for name in Main.scheduler.budgets])
+
+        def factory(call_id):
+            client = LocalOpenAI(args.transcription_latency, args.first_token_latency,
+                                 args.token_interval, args.tts_latency, seed=hash(call_id) % 2**32,
+                                 context_cost=args.context_cost, tail_rate=args.tail_rate)
+            audio = corpus[int(call_id) % len(corpus)]
+            dispatcher = EmergencyDispatcher(call_id=call_id, client=client,
+                                             audio_source=WavReplaySource(audio, args.speed))
+            dispatcher.player = NullPlayer(args.speed)
+            dispatcher.speculative_turns = not args.no_speculation
+            if args.no_compaction:
+                dispatcher.compact_after_turns = None
+            timer.instrument(dispatcher)
+            return dispatcher
+
+        manager = CallSessionManager(max_sessions=calls, dispatcher_factory=factory)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak_threads = threading.active_count()
+        audio_seconds = 0.0
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(open(os.devnull, 'w')):
+            for i in range(calls):
+                manager.start_call(str(i))
+                audio_seconds += len(corpus[i % len(corpus)]) / SAMPLE_RATE
+            while manager.stats()['active_calls']:
+                peak_threads = max(peak_threads, threading.active_count())
+                time.sleep(0.05)
+        elapsed = time.perf_counter() - start
+        manager.shutdown()
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+        turns = len(timer.timings)
+        print(f"\n{calls} concurrent call(s) at {args.speed:g}x: {elapsed:.1f} s wall, "
+              f"{audio_seconds / elapsed:.1f} audio-s/s, {turns / elapsed:.1f} turns/s, "
+              f"peak {peak_threads} threads, max RSS +{(rss_after - rss_before) / 1024:.0f} MiB")
+        if timer.timings:
+            report("  first audio", timer.timings, f"n={turns}")
+        endpoints = {name: stats for name, stats in Main.call_policy.stats().items()
+                     if stats['count']}
+        for name, stats in endpoints.items():
+            print(f"  endpoint {name:<16} p50 {stats['p50'] * 1000:8.1f} ms   p99 {stats['p99'] * 1000:8.1f} ms"
+                  f"   hedges {stats.get('hedges', 0)} (won {stats.get('hedge_wins', 0)})"
+                  f"   retries {stats.get('retries', 0)}   timeouts {stats.get('timeouts', 0)}")
+        events = Main.event_hub.stats()
+        print(f"  dashboard events: {events['coalesced_updates']} updates sent as {events['messages']} "
+              f"messages, {events['bytes'] / 1024:.0f} KiB")
+        for name, budget in Main.scheduler.stats().items():
+            for priority, c in budget['classes'].items():
+                print(f"  queue {name:<10} {priority:<10} wait p50 {c['wait']['p50'] * 1000:8.1f} ms"
+                      f"   p99 {c['wait']['p99'] * 1000:8.1f} ms   peak depth {c['peak_queued']}"
+                      f"   n={c['granted']}")
+        for stage, h in Main.stage_metrics.snapshot().items():
+            print(f"  {stage:<25} p50 {h['p50'] * 1000:8.1f} ms   p95 {h['p95'] * 1000:8.1f} ms"
+                  f"   p99 {h['p99'] * 1000:8.1f} ms   n={h['count']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Emergency dispatcher benchmarks")
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    encode = subparsers.add_parser('encode', help=bench_encode.__doc__)
+    encode.add_argument('--seconds', type=float, default=4.0)
+    encode.add_argument('--iterations', type=int, default=200)
+    encode.set_defaults(func=bench_encode)
+
+    vad = subparsers.add_parser('vad', help=bench_vad.__doc__)
+    vad.add_argument('--corpus', help="Directory of labelled WAVs (default: synthetic corpus)")
+    vad.set_defaults(func=bench_vad)
+
+    address = subparsers.add_parser('address', help=bench_address.__doc__)
+    address.add_argument('--words', type=int, nargs='+', default=[50, 500, 2000, 8000])
+    address.add_argument('--iterations', type=int, default=5)
+    address.add_argument('--legacy-limit', type=int, default=8000)
+    address.set_defaults(func=bench_address)
+
+    units = subparsers.add_parser('units', help=bench_units.__doc__)
+    units.add_argument('--units', type=int, default=3000)
+    units.add_argument('--queries', type=int, default=2000)
+    units.add_argument('--churn', type=int, default=5)
+    units.set_defaults(func=bench_units)
+
+    archive = subparsers.add_parser('archive', help=bench_archive.__doc__)
+    archive.add_argument('--calls', type=int, default=2000)
+    archive.add_argument('--turns', type=int, default=6)
+    archive.add_argument('--utterance-seconds', type=float, default=3.0)
+    archive.add_argument('--queries', type=int, default=200)
+    archive.set_defaults(func=bench_archive)
+
+    search = subparsers.add_parser('search', help=bench_search.__doc__)
+    search.add_argument('--calls', type=int, default=200000)
+    search.add_argument('--turns', type=int, default=4)
+    search.add_argument('--batch', type=int, default=2000, help="Calls archived between indexing passes")
+    search.add_argument('--spacing', type=float, default=30.0, help="Seconds between archived calls")
+    search.add_argument('--queries', type=int, default=50)
+    search.set_defaults(func=bench_search)
+
+    replay = subparsers.add_parser('replay', help=bench_replay.__doc__)
+    replay.add_argument('--corpus', help="Directory of 16 kHz mono WAVs (default: synthetic calls)")
+    replay.add_argument('--calls', type=int, nargs='+', default=[1, 10, 100])
+    replay.add_argument('--turns', type=int, default=6, help="Caller turns per synthetic call")
+    replay.add_argument('--speed', type=float, default=10.0, help="Replay speed vs real time")
+    replay.add_argument('--transcription-latency', type=float, default=0.4)
+    replay.add_argument('--first-token-latency', type=float, default=0.5)
+    replay.add_argument('--token-interval', type=float, default=0.02)
+    replay.add_argument('--tts-latency', type=float, default=0.2)
+    replay.add_argument('--context-cost', type=float, default=0.0,
+                        help="Extra time to first token per message in the model's context")
+    replay.add_argument('--api-concurrency', type=int, default=None,
+                        help="Requests in flight per endpoint across all calls (default: one per call)")
+    replay.add_argument('--tail-rate', type=float, default=0.0,
+                        help="Fraction of API requests that take 10x their usual latency")
+    replay.add_argument('--no-compaction', action='store_true',
+                        help="Send the whole thread with every run")
+    replay.add_argument('--no-speculation', action='store_true',
+                        help="Wait for the end of each turn before transcribing")
+    replay.set_defaults(func=bench_replay)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,45 @@
-from flask import Flask, render_template_string, jsonify
-from flask_socketio import SocketIO
+from flask import Flask, jsonify, request, Response
+from flask_socketio import SocketIO, join_room, leave_room
+from socketio import AsyncServer, ASGIApp
+from werkzeug.http import parse_accept_header, parse_etags
 import sounddevice as sd
 import numpy as np
 import threading
+import asyncio
 import queue
 import time
-from openai import OpenAI
-import wave
+import bisect
+import collections
+import heapq
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import contextlib
+import random
+import openai
+from openai import OpenAI, AsyncOpenAI
 import os
-import tempfile
+import io
+import wave
+import re
+import csv
+import json
+import sqlite3
+import urllib.parse
+import urllib.request
+import struct
+import gzip
+import hashlib
+import mmap
+import itertools
+import argparse
+
+try:
+    import soundfile as sf  # Optional, only needed for FLAC uploads
+except ImportError:
+    sf = None
+try:
+    import brotli  # Optional, adds Brotli variants of the dashboard assets
+except ImportError:
+    brotli = None
 
 #pip install flask
 #pip install flask flask-socketio
@@ -20,269 +51,4943 @@ import tempfile
 app = Flask(__name__)
 socketio = SocketIO(app)
 
-# Your existing EmergencyDispatcher class here
-class EmergencyDispatcher:
+# Maximum number of calls a single server process will handle at once
+MAX_CONCURRENT_CALLS = 32
+
+# OpenAI TTS returns raw PCM at this rate
+TTS_SAMPLE_RATE = 24000
+TTS_CHUNK_BYTES = 4800  # 100 ms of 16-bit mono audio per playback write
+PLAYBACK_BLOCK_BYTES = 960  # 20 ms; playback can be interrupted between blocks
+SPOKEN_CHARS_PER_SECOND = 15  # Rough TTS speaking rate, to estimate how much was heard
+
+# Geocoding: persistent cache, and an optional offline gazetteer of `address,lat,lon` rows
+GEOCODE_CACHE_PATH = "geocode_cache.sqlite3"
+GAZETTEER_PATH = "gazetteer.csv"
+
+# Response units as `unit_id,type,lat,lon[,status]` rows; a demo fleet is used if missing
+UNIT_ROSTER_PATH = "units.csv"
+
+# Per-stage latency histograms, exported on /metrics; spans are no-ops when disabled
+METRICS_ENABLED = True
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# OpenAI credentials and the dispatcher assistant
+OPENAI_API_KEY = "Open API Key Here"
+ASSISTANT_ID = "asst_DGcJujd3wtjBRZ4KsdrD0q5X"
+# Retries and deadlines are handled by call_policy; the client's own only bound abandoned requests
+OPENAI_CLIENT_OPTIONS = {'max_retries': 0, 'timeout': 30.0}
+
+# Idle dispatcher sessions kept ready (client, thread, greeting audio) so calls start at once
+SESSION_POOL_SIZE = 4
+
+# Calls one process holds in async mode (python Main.py --async); idle calls cost no threads
+ASYNC_MAX_CONCURRENT_CALLS = 500
+
+# Phrases the dispatcher says on every call; kept in the phrase cache
+GREETING = "911, what's your emergency?"
+TECHNICAL_DIFFICULTIES = "I'm experiencing technical difficulties. Please hold."
+
+def encode_wav(audio_data, sample_rate, channels=1):
+    """Encode int16 samples as a WAV file in memory with a single copy of the audio."""
+    pcm = memoryview(np.ascontiguousarray(audio_data, dtype=np.int16)).cast('B')
+    body = bytearray(44 + len(pcm))
+    struct.pack_into('<4sI4s4sIHHIIHH4sI', body, 0,
+                     b'RIFF', 36 + len(pcm), b'WAVE',
+                     b'fmt ', 16, 1, channels, sample_rate,
+                     sample_rate * channels * 2, channels * 2, 16,
+                     b'data', len(pcm))
+    body[44:] = pcm
+    return bytes(body)
+
+def encode_flac(audio_data, sample_rate, channels=1):
+    """Encode int16 samples as FLAC in memory. Requires the soundfile package."""
+    buffer = io.BytesIO()
+    sf.write(buffer, np.asarray(audio_data).reshape(-1, channels), sample_rate,
+             format='FLAC', subtype='PCM_16')
+    return buffer.getvalue()
+
+def encode_audio(audio_data, sample_rate, channels=1, audio_format='wav'):
+    """Encode an utterance for upload. Returns (filename, body, mime type)."""
+    if audio_format == 'flac' and sf is not None:
+        return 'speech.flac', encode_flac(audio_data, sample_rate, channels), 'audio/flac'
+    return 'speech.wav', encode_wav(audio_data, sample_rate, channels), 'audio/wav'
+
+# Incident classification rules, in priority order. Every phrase in every table is
+# compiled into one matcher so each utterance is scanned once.
+EMERGENCY_TYPES = [
+    ('MEDICAL', ['heart attack', 'breathing', 'unconscious', 'bleeding', 'injury', 'injured',
+                 'fell', 'fallen', 'seizure', 'stroke', 'choking', 'allergic', 'accident',
+                 'overdose', 'pain', 'medical']),
+    ('FIRE', ['fire', 'smoke', 'burning', 'flames', 'gas leak', 'explosion']),
+    ('POLICE', ['break-in', 'break in', 'breakin', 'robbery', 'theft', 'assault', 'weapon',
+                'gunshot', 'fight', 'domestic', 'violence', 'suspicious', 'burglary', 'stolen']),
+]
+
+EMERGENCY_PROBLEMS = {
+    'MEDICAL': [
+        ('CHOKING', ['choking']),
+        ('HEART_ATTACK', ['heart attack']),
+        ('BREATHING', ['difficulty breathing', 'trouble breathing', "can't breathing",
+                       'not breathing', 'heavy breathing']),
+        ('UNCONSCIOUS', ['unconscious', 'passed out']),
+        ('BLEEDING', ['bleeding']),
+        ('INJURY', ['injury', 'injured', 'fell', 'fallen']),
+    ],
+    'FIRE': [
+        ('STRUCTURE_FIRE', ['building', 'house', 'apartment', 'structure', 'room on fire']),
+        ('GAS_LEAK', ['gas leak']),
+        ('EXPLOSION', ['explosion']),
+    ],
+    'POLICE': [
+        ('BREAK_IN', ['break-in', 'break in', 'breakin', 'burglary']),
+        ('ASSAULT', ['assault', 'fight', 'violence']),
+        ('WEAPON', ['weapon', 'gunshot', 'gunshots', 'gun', 'guns', 'knife', 'knives']),
+    ],
+}
+
+VICTIM_STATUSES = ['conscious', 'unconscious', 'breathing', 'not breathing', 'responsive',
+                   'unresponsive', 'bleeding', 'stable', 'critical', 'awake', 'alert',
+                   'confused', 'dizzy']
+
+KEY_DETAILS = ['multiple victims', 'weapon present', 'children involved', 'elderly person',
+               'heavy smoke', 'spreading quickly']
+
+# Victim statuses and key details that make a call critical whatever its type
+CRITICAL_STATUSES = {'not breathing', 'unconscious', 'unresponsive', 'critical'}
+CRITICAL_DETAILS = {'weapon present', 'multiple victims', 'spreading quickly'}
+
+# Units sent for each emergency type, plus the extra unit sent when the caller
+# mentions one of the escalation phrases
+DISPATCH_UNITS = {
+    'MEDICAL': (['🚑 Ambulance'],
+                ['critical', 'severe', 'unconscious', 'not breathing'], '🚁 Medical Helicopter'),
+    'FIRE': (['🚒 Fire Engine', '🚑 Ambulance (Standby)'],
+             ['large', 'spreading', 'building', 'structure'], '🚒 Additional Fire Units'),
+    'POLICE': (['🚓 Police Units'],
+               ['weapon', 'gun', 'knife', 'violent', 'assault'], '🚨 SWAT Team'),
+}
+
+# Roster unit types needed per emergency type: (always, extra when escalated)
+UNIT_REQUIREMENTS = {
+    'MEDICAL': ({'AMBULANCE': 1}, {'HELICOPTER': 1}),
+    'FIRE': ({'FIRE_ENGINE': 1, 'AMBULANCE': 1}, {'FIRE_ENGINE': 2}),
+    'POLICE': ({'POLICE': 2}, {'SWAT': 1}),
+}
+
+UNIT_ICONS = {'AMBULANCE': '🚑', 'HELICOPTER': '🚁', 'FIRE_ENGINE': '🚒', 'POLICE': '🚓', 'SWAT': '🚨'}
+
+class IncidentClassifier:
+    """Compiles all incident keyword tables into a single multi-pattern matcher.
+
+    Phrases are joined into one alternation (longest first) inside a lookahead, so
+    one pass over the text reports every phrase at every word boundary, including
+    overlapping ones such as "not breathing" and "breathing".
+    """
+
     def __init__(self):
-        # Initialize OpenAI client
-        self.client = OpenAI(api_key="Open API Key Here")
-        self.assistant_id = "asst_DGcJujd3wtjBRZ4KsdrD0q5X"
-        self.thread = self.client.beta.threads.create()
-        
-        # Audio parameters
+        self.tags = collections.defaultdict(list)
+        for rank, (emergency_type, phrases) in enumerate(EMERGENCY_TYPES):
+            for phrase in phrases:
+                self.tags[phrase].append(('type', emergency_type, rank))
+        for emergency_type, problems in EMERGENCY_PROBLEMS.items():
+            for rank, (problem, phrases) in enumerate(problems):
+                for phrase in phrases:
+                    self.tags[phrase].append(('problem', emergency_type, (rank, problem)))
+        for phrase in VICTIM_STATUSES:
+            self.tags[phrase].append(('status', None, phrase))
+        for phrase in KEY_DETAILS:
+            self.tags[phrase].append(('detail', None, phrase))
+        for emergency_type, (_, phrases, _) in DISPATCH_UNITS.items():
+            for phrase in phrases:
+                self.tags[phrase].append(('escalate', emergency_type, phrase))
+
+        # Only the longest phrase is reported at a position, so it inherits the tags
+        # of any shorter phrase it starts with ("not breathing" -> "not", ...)
+        for phrase in self.tags:
+            for other in self.tags:
+                if phrase.startswith(other + ' '):
+                    self.tags[phrase].extend(self.tags[other])
+
+        alternation = '|'.join(re.escape(p) for p in sorted(self.tags, key=len, reverse=True))
+        self.pattern = re.compile(r"\b(?=(" + alternation + r")\b)", re.IGNORECASE)
+
+    def matches(self, text):
+        """Every (phrase, tags) found in the text, left to right."""
+        return [(m.group(1).lower(), self.tags[m.group(1).lower()])
+                for m in self.pattern.finditer(text)]
+
+    def classify(self, text):
+        """Classify one utterance on its own."""
+        types, problems, statuses, details, escalations = [], [], [], [], set()
+        for phrase, tags in self.matches(text):
+            for kind, emergency_type, value in tags:
+                if kind == 'type':
+                    types.append((value, emergency_type))
+                elif kind == 'problem':
+                    problems.append((emergency_type, value))
+                elif kind == 'status' and value not in statuses:
+                    statuses.append(value)
+                elif kind == 'detail' and value not in details:
+                    details.append(value)
+                elif kind == 'escalate':
+                    escalations.add(emergency_type)
+
+        emergency_type = min(types)[1] if types else None
+        type_problems = sorted(p for t, p in problems if t == emergency_type)
+        return {
+            'type': emergency_type,
+            'problem': type_problems[0][1].replace('_', ' ') if type_problems else None,
+            'victim_status': statuses[0] if statuses else None,
+            'key_details': details,
+            'escalations': escalations,
+        }
+
+incident_classifier = IncidentClassifier()
+
+# Street suffixes recognised by the address parser, mapped to their spoken form
+STREET_SUFFIXES = {
+    'street': 'Street', 'st': 'Street', 'avenue': 'Avenue', 'ave': 'Avenue',
+    'road': 'Road', 'rd': 'Road', 'boulevard': 'Boulevard', 'blvd': 'Boulevard',
+    'lane': 'Lane', 'ln': 'Lane', 'drive': 'Drive', 'dr': 'Drive',
+    'circle': 'Circle', 'cir': 'Circle', 'court': 'Court', 'ct': 'Court',
+    'way': 'Way', 'parkway': 'Parkway', 'pkwy': 'Parkway',
+    'terrace': 'Terrace', 'terr': 'Terrace',
+}
+
+# Words that never appear inside a street name; they end the name scan
+ADDRESS_STOPWORDS = {
+    'a', 'an', 'the', 'and', 'or', 'but', 'so', 'is', 'are', 'was', 'at', 'on', 'in', 'of',
+    'to', 'by', 'near', 'from', 'with', 'off', 'my', 'his', 'her', 'our', 'their', 'i', 'we',
+    'he', 'she', 'they', 'it', 'there', 'here', 'just', 'about', 'around', 'minutes',
+    'people', 'kids', 'years', 'floor', 'times',
+}
+
+class AddressParser:
+    """Linear-time street address extraction from transcripts.
+
+    Text is split into word and punctuation tokens with a single non-nested
+    pattern, then scanned once; each house number looks ahead at most
+    `max_name_tokens` + 1 tokens for a street suffix, so a run-on transcript costs
+    O(n) instead of the old regexes' super-linear backtracking.
+    """
+
+    TOKEN = re.compile(r"[A-Za-z0-9]+(?:['-][A-Za-z0-9]+)*|[,.]")
+    HOUSE_NUMBER = re.compile(r"\d+[A-Za-z]?(?:-\d+)?")
+    ORDINAL = re.compile(r"\d+(?:st|nd|rd|th)", re.IGNORECASE)
+    STATE = re.compile(r"[A-Z]{2}")
+    NUMBER_CUES = {'at', 'is', 'number', 'address'}
+
+    def __init__(self, max_name_tokens=4):
+        self.max_name_tokens = max_name_tokens
+
+    def parse(self, text):
+        """Find the first address in the text.
+
+        Returns a dict with number, street, city and state (any of which may be
+        None for a partial address), or None if nothing address-like was said.
+        """
+        tokens = self.TOKEN.findall(text)
+        lowered = [t.lower() for t in tokens]
+        street_only = None
+        number_only = None
+
+        for i, token in enumerate(tokens):
+            if lowered[i] not in STREET_SUFFIXES or i == 0:
+                if (number_only is None and i > 0 and lowered[i - 1] in self.NUMBER_CUES
+                        and self.HOUSE_NUMBER.fullmatch(token)):
+                    number_only = token
+                continue
+
+            # Walk back over the street name to the house number, if there is one
+            start = i
+            while start > 0 and i - start < self.max_name_tokens and self._name_token(tokens[start - 1]):
+                start -= 1
+            if start == i:
+                continue
+            if (start > 0 and self.HOUSE_NUMBER.fullmatch(tokens[start - 1])
+                    and not self.ORDINAL.fullmatch(tokens[start - 1])):
+                number = tokens[start - 1]
+            elif ((self._name_token(tokens[start]) and tokens[start][0].isupper())
+                  or self.ORDINAL.fullmatch(tokens[start])):
+                number = None
+            else:
+                continue
+
+            street = ' '.join(tokens[start:i] + [STREET_SUFFIXES[lowered[i]]])
+            address = {'number': number, 'street': street, 'city': None, 'state': None}
+            self._parse_city(tokens, i + 1, address)
+            if number is not None:
+                return address
+            if street_only is None:
+                street_only = address
+
+        if street_only is not None:
+            return street_only
+        if number_only is not None:
+            return {'number': number_only, 'street': None, 'city': None, 'state': None}
+        return None
+
+    def _name_token(self, token):
+        if self.ORDINAL.fullmatch(token):
+            return True
+        return (token not in (',', '.') and token.lower() not in ADDRESS_STOPWORDS
+                and not self.HOUSE_NUMBER.fullmatch(token))
+
+    def _parse_city(self, tokens, i, address):
+        """Pick up a trailing ", City" and ", ST" after the street suffix."""
+        if i < len(tokens) and tokens[i] == '.':
+            i += 1  # "St." abbreviation
+        if i + 1 >= len(tokens) or tokens[i] != ',':
+            return
+        city = []
+        i += 1
+        while i < len(tokens) and len(city) < 3 and tokens[i][0].isupper() and tokens[i].isalpha():
+            if city and self.STATE.fullmatch(tokens[i]):
+                break
+            city.append(tokens[i])
+            i += 1
+        if city:
+            address['city'] = ' '.join(city)
+        if i + 1 < len(tokens) and tokens[i] == ',' and self.STATE.fullmatch(tokens[i + 1]):
+            address['state'] = tokens[i + 1]
+        elif i < len(tokens) and self.STATE.fullmatch(tokens[i]):
+            address['state'] = tokens[i]
+
+    @staticmethod
+    def format(address):
+        parts = [' '.join(p for p in (address['number'], address['street']) if p)]
+        parts += [p for p in (address['city'], address['state']) if p]
+        return ', '.join(parts)
+
+address_parser = AddressParser()
+
+class AddressTracker:
+    """Assembles a call's address across utterances ("I'm at 42" ... "Elm Street")."""
+
+    def __init__(self, parser=None, max_gap=2):
+        self.parser = parser or address_parser
+        self.max_gap = max_gap  # Utterances a partial address is remembered for
+        self.pending = None
+        self.pending_age = 0
+        self.address = None
+
+    def update(self, text):
+        """Parse an utterance. Returns the formatted address if a new one was completed."""
+        found = self.parser.parse(text)
+        if self.pending is not None:
+            self.pending_age += 1
+            if self.pending_age > self.max_gap:
+                self.pending = None
+        if found is None:
+            return None
+
+        if (found['number'] is None or found['street'] is None) and self.pending is not None:
+            merged = {k: found[k] or self.pending[k] for k in found}
+            if merged['number'] and merged['street']:
+                found = merged
+
+        if found['number'] is None or found['street'] is None:
+            self.pending, self.pending_age = found, 0
+            return None
+
+        self.pending = None
+        formatted = self.parser.format(found)
+        if formatted == self.address:
+            return None
+        self.address = formatted
+        return formatted
+
+class NominatimProvider:
+    """Geocodes through the public OpenStreetMap Nominatim API (needs network)."""
+
+    URL = "https://nominatim.openstreetmap.org/search"
+
+    def __init__(self, user_agent="Emergency Dispatch System", timeout=3.0, min_interval=1.0):
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.min_interval = min_interval  # Nominatim's usage policy: at most 1 request/s
+        self.last_request = 0.0
+        self.lock = threading.Lock()
+
+    def geocode(self, address):
+        with self.lock:
+            wait = self.last_request + self.min_interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self.last_request = time.time()
+        query = urllib.parse.urlencode({'q': address, 'format': 'json', 'limit': 1})
+        req = urllib.request.Request(f"{self.URL}?{query}", headers={'User-Agent': self.user_agent})
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            results = json.load(response)
+        if not results:
+            return None
+        return {'lat': float(results[0]['lat']), 'lon': float(results[0]['lon']),
+                'display': results[0].get('display_name', address)}
+
+class GazetteerProvider:
+    """Offline geocoder over a local CSV of `address,lat,lon` rows.
+
+    Addresses are normalised to tokens and stored in a token trie, so a spoken
+    address that is a prefix of a gazetteer entry ("42 Elm Street" vs
+    "42 Elm Street, Queens, NY") resolves to the shortest completion.
+    """
+
+    def __init__(self, path=None):
+        self.root = {}
+        self.size = 0
+        if path:
+            self.load(path)
+
+    @staticmethod
+    def tokens(address):
+        words = re.findall(r"[a-z0-9]+", address.lower())
+        return [STREET_SUFFIXES.get(w, w).lower() for w in words]
+
+    def add(self, address, lat, lon):
+        node = self.root
+        for token in self.tokens(address):
+            node = node.setdefault(token, {})
+        node[None] = {'lat': float(lat), 'lon': float(lon), 'display': address}
+        self.size += 1
+
+    def load(self, path):
+        with open(path, newline='') as f:
+            for row in csv.reader(f):
+                if len(row) < 3:
+                    continue
+                try:
+                    # Unquoted addresses may contain commas; coordinates are the last two fields
+                    self.add(','.join(row[:-2]), row[-2], row[-1])
+                except ValueError:
+                    continue  # Header or malformed row
+
+    def geocode(self, address):
+        node = self.root
+        for token in self.tokens(address):
+            node = node.get(token)
+            if node is None:
+                return None
+        # Breadth-first, so the shortest completion wins
+        frontier = [node]
+        while frontier:
+            for candidate in frontier:
+                if None in candidate:
+                    return dict(candidate[None])
+            frontier = [child for n in frontier for key, child in n.items() if key is not None]
+        return None
+
+class GeocodeCache:
+    """Persistent geocode cache with TTL in SQLite, fronted by an in-memory LRU."""
+
+    def __init__(self, path=':memory:', ttl=30 * 24 * 3600, negative_ttl=300, memory_size=4096):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl  # Misses are retried sooner than hits expire
+        self.memory_size = memory_size
+        self.memory = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS geocode (query TEXT PRIMARY KEY, "
+                        "result TEXT, expires REAL)")
+        self.db.commit()
+
+    def get(self, query):
+        """Returns (found, result). `result` is None for a cached miss."""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(query)
+            if entry is not None and entry[1] > now:
+                self.memory.move_to_end(query)
+                return True, entry[0]
+            row = self.db.execute("SELECT result, expires FROM geocode WHERE query = ?",
+                                  (query,)).fetchone()
+            if row is None or row[1] <= now:
+                return False, None
+            result = json.loads(row[0])
+            self._remember(query, result, row[1])
+            return True, result
+
+    def put(self, query, result):
+        expires = time.time() + (self.ttl if result is not None else self.negative_ttl)
+        with self.lock:
+            self._remember(query, result, expires)
+            self.db.execute("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?)",
+                            (query, json.dumps(result), expires))
+            self.db.commit()
+
+    def _remember(self, query, result, expires):
+        self.memory[query] = (result, expires)
+        self.memory.move_to_end(query)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+class Geocoder:
+    """Resolves addresses through the cache, then each provider in turn."""
+
+    def __init__(self, providers, cache=None, default_region="New York, NY"):
+        self.providers = providers
+        self.cache = cache or GeocodeCache()
+        self.default_region = default_region
+
+    def geocode(self, address):
+        query = ' '.join(GazetteerProvider.tokens(address))
+        found, result = self.cache.get(query)
+        if found:
+            return result
+
+        candidates = [address]
+        if self.default_region and ',' not in address:
+            # Callers rarely name the city; fall back to the service area
+            candidates.append(f"{address}, {self.default_region}")
+        result = None
+        for provider in self.providers:
+            for candidate in candidates:
+                try:
+                    result = provider.geocode(candidate)
+                except Exception as e:
+                    print(f"Geocoding error ({type(provider).__name__}): {e}")
+                    result = None
+                if result is not None:
+                    result['source'] = type(provider).__name__
+                    break
+            if result is not None:
+                break
+
+        self.cache.put(query, result)
+        return result
+
+def build_geocoder():
+    providers = []
+    if os.path.exists(GAZETTEER_PATH):
+        providers.append(GazetteerProvider(GAZETTEER_PATH))
+    providers.append(NominatimProvider())
+    return Geocoder(providers, GeocodeCache(GEOCODE_CACHE_PATH))
+
+geocoder = None  # Built on first use, so importing Main opens no cache file
+geocoder_lock = threading.Lock()
+
+def get_geocoder():
+    global geocoder
+    with geocoder_lock:
+        if geocoder is None:
+            geocoder = build_geocoder()
+        return geocoder
+
+class Unit:
+    """One response unit on the roster."""
+
+    def __init__(self, unit_id, unit_type, lat, lon, status='AVAILABLE'):
+        self.unit_id = unit_id
+        self.unit_type = unit_type
+        self.lat = lat
+        self.lon = lon
+        self.status = status
+        self.call_id = None  # Call the unit is assigned to, if any
+        self.cell = None
+
+    def to_dict(self):
+        return {'unit_id': self.unit_id, 'type': self.unit_type, 'status': self.status,
+                'lat': self.lat, 'lon': self.lon, 'call_id': self.call_id}
+
+class UnitRoster:
+    """Units with type, status and position, and a grid index of available units.
+
+    Positions are projected to kilometres around the service area's latitude and
+    bucketed into square cells. Only AVAILABLE units are indexed, so status churn
+    is an O(1) move between cell sets, and a nearest-k query searches rings of
+    cells outward from the incident until no closer unit can exist.
+    """
+
+    def __init__(self, ref_lat=40.7128, cell_km=1.0, speed_kmh=40.0):
+        self.cell_km = cell_km
+        self.speed_kmh = speed_kmh  # Rough average response speed for ETAs
+        self.km_per_lat = 110.57
+        self.km_per_lon = 111.32 * np.cos(np.radians(ref_lat))
+        self.units = {}
+        self.grid = collections.defaultdict(lambda: collections.defaultdict(set))
+        self.bounds = {}  # unit_type -> [min_x, max_x, min_y, max_y] of occupied cells
+        self.lock = threading.RLock()
+
+    def _project(self, lat, lon):
+        return lat * self.km_per_lat, lon * self.km_per_lon
+
+    def _cell(self, lat, lon):
+        y, x = self._project(lat, lon)
+        return int(x // self.cell_km), int(y // self.cell_km)
+
+    def _index(self, unit):
+        if unit.status != 'AVAILABLE':
+            return
+        unit.cell = self._cell(unit.lat, unit.lon)
+        self.grid[unit.unit_type][unit.cell].add(unit.unit_id)
+        cx, cy = unit.cell
+        b = self.bounds.setdefault(unit.unit_type, [cx, cx, cy, cy])
+        b[0], b[1], b[2], b[3] = min(b[0], cx), max(b[1], cx), min(b[2], cy), max(b[3], cy)
+
+    def _unindex(self, unit):
+        if unit.cell is None:
+            return
+        cell = self.grid[unit.unit_type][unit.cell]
+        cell.discard(unit.unit_id)
+        if not cell:
+            del self.grid[unit.unit_type][unit.cell]
+        unit.cell = None
+
+    def add(self, unit):
+        with self.lock:
+            if unit.unit_id in self.units:
+                self._unindex(self.units[unit.unit_id])
+            self.units[unit.unit_id] = unit
+            self._index(unit)
+
+    def update(self, unit_id, status=None, lat=None, lon=None):
+        """Apply a status change and/or position report for a unit."""
+        with self.lock:
+            unit = self.units[unit_id]
+            self._unindex(unit)
+            if status is not None:
+                unit.status = status
+                if status == 'AVAILABLE':
+                    unit.call_id = None
+            if lat is not None and lon is not None:
+                unit.lat, unit.lon = lat, lon
+            self._index(unit)
+
+    def nearest(self, unit_type, lat, lon, k=3):
+        """The k closest AVAILABLE units of a type as (distance_km, unit), closest first."""
+        with self.lock:
+            cells = self.grid.get(unit_type)
+            if not cells:
+                return []
+            y, x = self._project(lat, lon)
+            cx, cy = int(x // self.cell_km), int(y // self.cell_km)
+            min_x, max_x, min_y, max_y = self.bounds[unit_type]
+            max_ring = max(abs(cx - min_x), abs(cx - max_x), abs(cy - min_y), abs(cy - max_y))
+
+            found = []
+            for ring in range(max_ring + 1):
+                for cell in self._ring_cells(cx, cy, ring):
+                    for unit_id in cells.get(cell, ()):
+                        unit = self.units[unit_id]
+                        uy, ux = self._project(unit.lat, unit.lon)
+                        found.append((float(np.hypot(ux - x, uy - y)), unit_id))
+                # Anything in the next ring is at least `ring` cells away
+                if len(found) >= k and heapq.nsmallest(k, found)[-1][0] <= ring * self.cell_km:
+                    break
+            return [(distance, self.units[unit_id]) for distance, unit_id in heapq.nsmallest(k, found)]
+
+    @staticmethod
+    def _ring_cells(cx, cy, ring):
+        if ring == 0:
+            yield (cx, cy)
+            return
+        for dx in range(-ring, ring + 1):
+            yield (cx + dx, cy - ring)
+            yield (cx + dx, cy + ring)
+        for dy in range(-ring + 1, ring):
+            yield (cx - ring, cy + dy)
+            yield (cx + ring, cy + dy)
+
+    def recommend(self, incident, call_id=None, assign=True):
+        """Closest available units for an incident's requirements.
+
+        `incident` is an IncidentState dict with coordinates. Units already
+        assigned to the call count towards the requirement; with `assign` the
+        new picks are marked DISPATCHED so other calls do not get them.
+        """
+        if not incident.get('type') or not incident.get('coordinates'):
+            return []
+        base, escalated = UNIT_REQUIREMENTS[incident['type']]
+        needed = collections.Counter(base)
+        if incident.get('severity') == 'critical':
+            needed.update(escalated)
+
+        lat, lon = incident['coordinates']
+        with self.lock:
+            assigned = [u for u in self.units.values() if call_id is not None and u.call_id == call_id]
+            for unit in assigned:
+                needed[unit.unit_type] -= 1
+            picks = []
+            for unit_type, count in needed.items():
+                if count > 0:
+                    picks += self.nearest(unit_type, lat, lon, count)
+            if assign:
+                for _, unit in picks:
+                    self.update(unit.unit_id, status='DISPATCHED')
+                    unit.call_id = call_id
+
+            recommendations = []
+            for unit in assigned + [unit for _, unit in picks]:
+                uy, ux = self._project(unit.lat, unit.lon)
+                y, x = self._project(lat, lon)
+                distance = float(np.hypot(ux - x, uy - y))
+                recommendations.append({
+                    'unit_id': unit.unit_id,
+                    'type': unit.unit_type,
+                    'label': f"{UNIT_ICONS.get(unit.unit_type, '')} {unit.unit_id}".strip(),
+                    'distance_km': round(distance, 2),
+                    'eta_min': round(60 * distance / self.speed_kmh, 1),
+                })
+            return recommendations
+
+    def assigned(self, call_id):
+        """Ids of the units currently assigned to a call."""
+        with self.lock:
+            return sorted(u.unit_id for u in self.units.values()
+                          if call_id is not None and u.call_id == call_id)
+
+    def release(self, call_id):
+        """Return every unit assigned to a call to service."""
+        if call_id is None:
+            return
+        with self.lock:
+            for unit in list(self.units.values()):
+                if unit.call_id == call_id:
+                    self.update(unit.unit_id, status='AVAILABLE')
+
+    def load(self, path):
+        """Load `unit_id,type,lat,lon[,status]` rows from a CSV file."""
+        with open(path, newline='') as f:
+            for row in csv.reader(f):
+                try:
+                    status = row[4] if len(row) > 4 and row[4] else 'AVAILABLE'
+                    self.add(Unit(row[0], row[1].upper(), float(row[2]), float(row[3]), status))
+                except (IndexError, ValueError):
+                    continue  # Header or malformed row
+
+    def stats(self):
+        with self.lock:
+            counts = collections.Counter((u.unit_type, u.status) for u in self.units.values())
+            return {f"{unit_type}/{status}": n for (unit_type, status), n in sorted(counts.items())}
+
+def demo_roster(seed=0):
+    """A synthetic fleet spread over New York City, for running without units.csv."""
+    rng = np.random.default_rng(seed)
+    roster = UnitRoster()
+    fleet = {'AMBULANCE': 60, 'FIRE_ENGINE': 40, 'POLICE': 80, 'HELICOPTER': 3, 'SWAT': 6}
+    for unit_type, count in fleet.items():
+        for i in range(count):
+            roster.add(Unit(f"{unit_type[0]}{unit_type[-1]}-{i + 1}", unit_type,
+                            40.55 + rng.random() * 0.35, -74.15 + rng.random() * 0.4))
+    return roster
+
+def build_roster():
+    if os.path.exists(UNIT_ROSTER_PATH):
+        roster = UnitRoster()
+        roster.load(UNIT_ROSTER_PATH)
+        return roster
+    return demo_roster()
+
+class IncidentState:
+    """Running summary of one call, built up from the caller's utterances."""
+
+    def __init__(self):
+        self.type = None
+        self.problem = None
+        self.victim_status = None
+        self.key_details = []
+        self.units = []
+        self.severity = None
+        self.location = None
+        self.coordinates = None
+
+    def update(self, text, classifier=None):
+        """Fold one utterance into the summary. Returns True if anything changed."""
+        result = (classifier or incident_classifier).classify(text)
+        before = self.to_dict()
+
+        # The first type detected sticks for the rest of the call
+        if self.type is None:
+            self.type = result['type']
+        if result['problem'] and result['type'] == self.type:
+            self.problem = result['problem']
+        if result['victim_status']:
+            self.victim_status = result['victim_status']
+        for detail in result['key_details']:
+            if detail not in self.key_details:
+                self.key_details.append(detail)
+
+        if self.type:
+            base_units, _, extra_unit = DISPATCH_UNITS[self.type]
+            for unit in base_units:
+                if unit not in self.units:
+                    self.units.append(unit)
+            if self.type in result['escalations']:
+                if extra_unit not in self.units:
+                    self.units.append(extra_unit)
+                self.severity = 'critical'
+            elif self.severity is None:
+                self.severity = 'urgent'
+
+        return self.to_dict() != before
+
+    def priority(self):
+        """Scheduling class for the call's API work: 'critical', 'urgent' or 'routine'."""
+        if (self.severity == 'critical' or self.victim_status in CRITICAL_STATUSES
+                or CRITICAL_DETAILS.intersection(self.key_details)):
+            return 'critical'
+        return 'urgent' if self.type else 'routine'
+
+    def to_dict(self):
+        return {
+            'type': self.type,
+            'problem': self.problem,
+            'victim_status': self.victim_status,
+            'key_details': list(self.key_details),
+            'units': list(self.units),
+            'severity': self.severity,
+            'location': self.location,
+            'coordinates': self.coordinates,
+        }
+
+class PhraseCache:
+    """LRU cache of synthesized speech, bounded by total PCM bytes.
+
+    Only short phrases are cached; long one-off answers would just evict the
+    stock phrases that every call repeats.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, max_phrase_length=120):
+        self.max_bytes = max_bytes
+        self.max_phrase_length = max_phrase_length
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, voice, text):
+        with self.lock:
+            pcm = self.entries.get((voice, text))
+            if pcm is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end((voice, text))
+            self.hits += 1
+            return pcm
+
+    def put(self, voice, text, pcm):
+        if len(text) > self.max_phrase_length or len(pcm) > self.max_bytes or not pcm:
+            return
+        with self.lock:
+            old = self.entries.pop((voice, text), None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[(voice, text)] = pcm
+            self.size += len(pcm)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stats(self):
+        with self.lock:
+            return {'phrases': len(self.entries), 'bytes': self.size,
+                    'hits': self.hits, 'misses': self.misses}
+
+phrase_cache = PhraseCache()
+
+SUPERVISOR_ROOM = 'supervisors'  # Consoles that opted in to every call's events
+
+def payload_size(data):
+    """Approximate wire size of an event payload: binary fields raw, the rest as JSON."""
+    binary = sum(len(v) for v in data.values() if isinstance(v, (bytes, bytearray)))
+    rest = {k: v for k, v in data.items() if not isinstance(v, (bytes, bytearray))}
+    return binary + len(json.dumps(rest, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+
+class RateMeter:
+    """Messages and bytes per second over a sliding window of one-second buckets."""
+
+    def __init__(self, window=10):
+        self.window = window
+        self.buckets = collections.deque()  # [second, messages, bytes]
+
+    def add(self, size, now=None):
+        second = int(time.time() if now is None else now)
+        if not self.buckets or self.buckets[-1][0] != second:
+            self.buckets.append([second, 0, 0])
+        self.buckets[-1][1] += 1
+        self.buckets[-1][2] += size
+
+    def rates(self, now=None):
+        now = int(time.time() if now is None else now)
+        while self.buckets and self.buckets[0][0] <= now - self.window:
+            self.buckets.popleft()
+        messages = sum(b[1] for b in self.buckets)
+        size = sum(b[2] for b in self.buckets)
+        return {'messages_per_second': messages / self.window,
+                'bytes_per_second': size / self.window}
+
+class EventHub:
+    """Sends each call's events to its own room (and the supervisor room) and batches
+    high-frequency updates into one `frame` per call every `interval` seconds.
+
+    Coalesced kinds: 'tokens' (streamed reply text, concatenated), 'incident'
+    (changed summary fields, merged) and 'level' (caller input level, latest
+    wins). Any other event for the call flushes its pending frame first, so the
+    client sees everything in order.
+    """
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self.pending = {}  # call_id -> frame being built
+        self.lock = threading.Lock()  # Also orders a flushed frame before the event that flushed it
+        self.thread = None
+        self.server = None  # Emitter used instead of the Flask-SocketIO server (async mode)
+        self.coalesced = 0
+        self.messages = collections.Counter()
+        self.bytes = collections.Counter()
+        self.meter = RateMeter()
+
+    def coalesce(self, call_id, kind, value):
+        with self.lock:
+            frame = self.pending.setdefault(call_id, {})
+            if kind == 'tokens':
+                frame['tokens'] = frame.get('tokens', '') + value
+            elif kind == 'incident':
+                frame.setdefault('incident', {}).update(value)
+            else:
+                frame[kind] = value
+            self.coalesced += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.flush_worker, name="event-hub", daemon=True)
+                self.thread.start()
+
+    def emit(self, call_id, event, data, supervisors=True):
+        """Send an event now, after any frame still pending for the call."""
+        with self.lock:
+            frame = self.pending.pop(call_id, None)
+            if frame:
+                self._send(call_id, 'frame', frame, True)
+            self._send(call_id, event, data, supervisors)
+
+    def flush(self):
+        with self.lock:
+            frames, self.pending = self.pending, {}
+            for call_id, frame in frames.items():
+                self._send(call_id, 'frame', frame, True)
+
+    def flush_worker(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def _send(self, call_id, event, data, supervisors):
+        server = self.server or socketio
+        if call_id is None:
+            server.emit(event, data)  # Not bound to a call: broadcast, as a standalone console
+        else:
+            data = {**data, 'call_id': call_id}
+            server.emit(event, data, to=[call_id, SUPERVISOR_ROOM] if supervisors else call_id)
+        size = payload_size(data)
+        self.messages[event] += 1
+        self.bytes[event] += size
+        self.meter.add(size)
+
+    def stats(self):
+        with self.lock:
+            return {'messages': sum(self.messages.values()), 'bytes': sum(self.bytes.values()),
+                    'coalesced_updates': self.coalesced, **self.meter.rates(),
+                    'by_event': {event: {'messages': n, 'bytes': self.bytes[event]}
+                                 for event, n in self.messages.items()}}
+
+event_hub = EventHub()
+
+ARCHIVE_DIR = "call_archive"
+ARCHIVE_SEGMENT_BYTES = 64 * 1024 * 1024  # Start a new segment file after this many bytes
+ARCHIVED_EVENTS = {'transcript_update', 'location_update', 'dispatch_update', 'barge_in'}
+
+class CallArchive:
+    """Append-only archive of every call's caller audio and transcript/incident events.
+
+    Records are appended to numbered segment files behind a small header, and
+    each gets a fixed-width entry in `index.bin`: call key, kind, segment,
+    offset, length, start and end time. append() only adds bytes to in-memory
+    lists; a background thread writes them out every `flush_interval` seconds,
+    segments first, so a flushed index entry never points past the data.
+    Readers memory-map the index and filter it with numpy, then read just the
+    records they need. Audio records are raw 16 kHz int16 mono; event records
+    are JSON. Appends are ignored until open() is called.
+    """
+
+    AUDIO, EVENT = 1, 2
+    MAGIC = b'CALR'
+    HEADER = struct.Struct('<4sB16sIdd')  # magic, kind, call key, length, start, end
+    ENTRY = struct.Struct('<16sBIQIdd')  # call key, kind, segment, offset, length, start, end
+    INDEX_DTYPE = np.dtype([('call', 'S16'), ('kind', 'u1'), ('segment', '<u4'), ('offset', '<u8'),
+                            ('length', '<u4'), ('start', '<f8'), ('end', '<f8')])
+
+    def __init__(self, directory=ARCHIVE_DIR, segment_bytes=ARCHIVE_SEGMENT_BYTES, flush_interval=1.0):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()  # Guards the pending lists and write position
+        self.flush_lock = threading.Lock()  # One writer to disk at a time
+        self.is_open = False
+        self.segment = 0
+        self.position = 0  # Logical end of the current segment, including pending bytes
+        self.pending_data = []  # (segment, bytes) not yet written
+        self.pending_index = []
+        self.files = {}  # segment -> append handle
+        self.readers = {}  # segment -> read-only fd
+        self.map = None
+        self.mapped_size = 0
+        self.map_lock = threading.Lock()
+        self.thread = None
+        self.records = collections.Counter()
+        self.bytes_written = 0
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, 'index.bin')
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f'segment-{segment:06d}.dat')
+
+    @staticmethod
+    def call_key(call_id):
+        return hashlib.blake2b(str(call_id).encode('utf-8'), digest_size=16).digest()
+
+    def open(self):
+        """Create the archive directory if needed, recover any unindexed tail and start flushing."""
+        os.makedirs(self.directory, exist_ok=True)
+        with self.flush_lock, self.lock:
+            self.segment, self.position = self._recover()
+            self.is_open = True
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.flush_worker, name="call-archive", daemon=True)
+            self.thread.start()
+        return self
+
+    def _recover(self):
+        """Index complete records that reached the last segment but not the index
+        (a crash between the two writes) and cut off a torn final record.
+        Returns the segment and position to continue appending at."""
+        size = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+        with open(self.index_path, 'ab') as index:
+            index.truncate(size - size % self.ENTRY.size)  # Drop a torn entry
+        segments = sorted(int(name[8:14]) for name in os.listdir(self.directory)
+                          if name.startswith('segment-') and name.endswith('.dat'))
+        if not segments:
+            return 1, 0
+        segment = segments[-1]
+        entries = self.entries()
+        position = 0
+        if len(entries) and entries['segment'][-1] == segment:
+            position = int(entries['offset'][-1] + entries['length'][-1])
+        recovered = []
+        with open(self.segment_path(segment), 'r+b') as f:
+            f.seek(position)
+            while True:
+                header = f.read(self.HEADER.size)
+                if len(header) < self.HEADER.size:
+                    break
+                magic, kind, key, length, start, end = self.HEADER.unpack(header)
+                if magic != self.MAGIC or len(f.read(length)) < length:
+                    break
+                recovered.append(self.ENTRY.pack(key, kind, segment, position + self.HEADER.size,
+                                                 length, start, end))
+                position += self.HEADER.size + length
+            f.truncate(position)
+        if recovered:
+            with open(self.index_path, 'ab') as index:
+                index.write(b''.join(recovered))
+        return segment, position
+
+    def append(self, call_id, kind, payload, start, end=None):
+        """Queue one record. Does no I/O; the flush thread writes it out."""
+        if not self.is_open or call_id is None:
+            return
+        end = start if end is None else end
+        key = self.call_key(call_id)
+        header = self.HEADER.pack(self.MAGIC, kind, key, len(payload), start, end)
+        with self.lock:
+            if self.position and self.position + len(header) + len(payload) > self.segment_bytes:
+                self.segment += 1
+                self.position = 0
+            offset = self.position + len(header)
+            self.pending_data.append((self.segment, header + payload))
+            self.pending_index.append(self.ENTRY.pack(key, kind, self.segment, offset,
+                                                      len(payload), start, end))
+            self.position = offset + len(payload)
+            self.records[kind] += 1
+
+    def record_audio(self, call_id, samples, start, end):
+        self.append(call_id, self.AUDIO, samples.tobytes(), start, end)
+
+    def record_event(self, call_id, event, data, timestamp=None):
+        payload = json.dumps({'event': event, 'call_id': call_id, **data}, default=str).encode('utf-8')
+        self.append(call_id, self.EVENT, payload, time.time() if timestamp is None else timestamp)
+
+    def flush(self):
+        """Write pending records to their segments, then their index entries."""
+        with self.flush_lock:
+            with self.lock:
+                data, self.pending_data = self.pending_data, []
+                entries, self.pending_index = self.pending_index, []
+                current = self.segment
+            if not entries:
+                return
+            for segment, group in itertools.groupby(data, key=lambda item: item[0]):
+                f = self.files.get(segment)
+                if f is None:
+                    f = self.files[segment] = open(self.segment_path(segment), 'ab')
+                chunk = b''.join(record for _, record in group)
+                f.write(chunk)
+                f.flush()
+                self.bytes_written += len(chunk)
+            for segment in [s for s in self.files if s < current]:
+                self.files.pop(segment).close()
+            with open(self.index_path, 'ab') as index:
+                index.write(b''.join(entries))
+
+    def flush_worker(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Error writing call archive: {e}")
+
+    def close(self):
+        """Flush, stop accepting records and release every file handle and mapping."""
+        self.flush()
+        with self.lock:
+            self.is_open = False
+        with self.flush_lock:
+            for f in self.files.values():
+                f.close()
+            self.files.clear()
+        with self.map_lock:
+            for fd in self.readers.values():
+                os.close(fd)
+            self.readers.clear()
+            if self.map is not None:
+                try:
+                    self.map.close()
+                except BufferError:
+                    pass  # Entry arrays still in use; the mapping goes when they do
+                self.map = None
+                self.mapped_size = 0
+
+    def entries(self):
+        """Every flushed index entry, as a structured array over the memory-mapped index."""
+        with self.map_lock:
+            size = os.path.getsize(self.index_path) if os.path.exists(self.index_path) else 0
+            size -= size % self.ENTRY.size
+            if size != self.mapped_size:
+                # Arrays handed out earlier keep the old mapping alive until they are dropped
+                self.map = None
+                if size:
+                    with open(self.index_path, 'rb') as f:
+                        self.map = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+                self.mapped_size = size
+            if self.map is None:
+                return np.zeros(0, dtype=self.INDEX_DTYPE)
+            return np.frombuffer(self.map, dtype=self.INDEX_DTYPE, count=size // self.ENTRY.size)
+
+    def find(self, call_id=None, since=None, until=None, kind=None):
+        """Index entries for one call and/or a time range, oldest first."""
+        entries = self.entries()
+        mask = np.ones(len(entries), dtype=bool)
+        if call_id is not None:
+            mask &= entries['call'] == self.call_key(call_id)
+        if kind is not None:
+            mask &= entries['kind'] == kind
+        if since is not None:
+            mask &= entries['end'] >= since
+        if until is not None:
+            mask &= entries['start'] <= until
+        return entries[mask]
+
+    def read(self, entry):
+        """The payload of one index entry."""
+        segment = int(entry['segment'])
+        with self.map_lock:
+            fd = self.readers.get(segment)
+            if fd is None:
+                fd = self.readers[segment] = os.open(self.segment_path(segment), os.O_RDONLY)
+        return os.pread(fd, int(entry['length']), int(entry['offset']))
+
+    def events(self, call_id=None, since=None, until=None):
+        """Archived events, each with its archive `time`."""
+        return [dict(json.loads(self.read(entry)), time=float(entry['start']))
+                for entry in self.find(call_id, since, until, self.EVENT)]
+
+    def audio(self, call_id, since=None, until=None):
+        """The caller's archived utterances, concatenated, as int16 samples."""
+        chunks = [np.frombuffer(self.read(entry), dtype=np.int16)
+                  for entry in self.find(call_id, since, until, self.AUDIO)]
+        return np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int16)
+
+    def calls(self, since=None, until=None):
+        """Calls with archived records in the range: id, first and last record time, record count."""
+        entries = self.find(since=since, until=until)
+        if not len(entries):
+            return []
+        order = np.argsort(entries['call'], kind='stable')
+        entries = entries[order]
+        keys, first, counts = np.unique(entries['call'], return_index=True, return_counts=True)
+        starts = np.minimum.reduceat(entries['start'], first)
+        ends = np.maximum.reduceat(entries['end'], first)
+        result = []
+        for index, count, start, end in zip(first, counts, starts, ends):
+            group = entries[index:index + count]
+            opening = group[group['kind'] == self.EVENT][:1]
+            call_id = json.loads(self.read(opening[0])).get('call_id') if len(opening) else None
+            result.append({'call_id': call_id, 'start': float(start), 'end': float(end),
+                           'records': int(count)})
+        return sorted(result, key=lambda call: call['start'])
+
+    def stats(self):
+        with self.lock:
+            return {'open': self.is_open, 'audio_records': self.records[self.AUDIO],
+                    'event_records': self.records[self.EVENT], 'pending': len(self.pending_index),
+                    'bytes_written': self.bytes_written, 'segment': self.segment}
+
+call_archive = CallArchive()
+
+SEARCH_INDEX_DIR = "search_index"
+SEARCH_ROLES = ('caller', 'dispatcher')
+
+class IndexSegment:
+    """Immutable slice of the transcript index: utterances and their positional postings.
+
+    `docs` holds each utterance's call ordinal, role, time and archive entry.
+    Term i's postings are its (doc, position) occurrences, sorted, at
+    starts[i]:starts[i + 1] of `occ_docs` and `occ_pos`. Segments are built
+    from one indexing pass and merged `merge_factor` at a time into the next
+    tier up.
+    """
+
+    DOC_DTYPE = np.dtype([('call', '<i4'), ('role', 'u1'), ('time', '<f8'), ('entry', '<i8')])
+
+    def __init__(self, docs, terms, starts, occ_docs, occ_pos, archive_range, tier=0, path=None):
+        self.docs = docs
+        self.terms = list(terms)
+        self.lookup = {term: i for i, term in enumerate(self.terms)}
+        self.starts = starts
+        self.occ_docs = occ_docs
+        self.occ_pos = occ_pos
+        self.archive_range = tuple(int(n) for n in archive_range)  # Archive entries covered
+        self.tier = tier
+        self.path = path  # Set once saved
+
+    @classmethod
+    def _from_occurrences(cls, docs, terms, term_ids, occ_docs, occ_pos, archive_range, tier):
+        # Occurrences arrive in doc and position order; a stable sort groups them by term
+        order = np.argsort(term_ids, kind='stable')
+        starts = np.searchsorted(term_ids[order], np.arange(len(terms) + 1)).astype(np.int64)
+        return cls(docs, terms, starts, occ_docs[order], occ_pos[order], archive_range, tier)
+
+    @classmethod
+    def build(cls, utterances, archive_range):
+        """Segment for (call, role, time, archive entry, tokens) utterances."""
+        docs = np.array([utterance[:4] for utterance in utterances], dtype=cls.DOC_DTYPE)
+        vocabulary = {}
+        term_ids, occ_docs, occ_pos = [], [], []
+        for doc, utterance in enumerate(utterances):
+            for pos, token in enumerate(utterance[4]):
+                term_ids.append(vocabulary.setdefault(token, len(vocabulary)))
+                occ_docs.append(doc)
+                occ_pos.append(pos)
+        return cls._from_occurrences(docs, list(vocabulary), np.array(term_ids, dtype=np.int32),
+                                     np.array(occ_docs, dtype=np.int32),
+                                     np.array(occ_pos, dtype=np.int32), archive_range, 0)
+
+    @classmethod
+    def merge(cls, segments):
+        """One segment holding `segments` (consecutive, oldest first), a tier up."""
+        vocabulary = {}
+        term_ids, occ_docs, base = [], [], 0
+        for segment in segments:
+            mapping = np.array([vocabulary.setdefault(term, len(vocabulary)) for term in segment.terms],
+                               dtype=np.int32)
+            counts = np.diff(segment.starts)
+            term_ids.append(np.repeat(mapping, counts))
+            occ_docs.append(segment.occ_docs + base)
+            base += len(segment.docs)
+        return cls._from_occurrences(np.concatenate([s.docs for s in segments]), list(vocabulary),
+                                     np.concatenate(term_ids), np.concatenate(occ_docs),
+                                     np.concatenate([s.occ_pos for s in segments]),
+                                     (segments[0].archive_range[0], segments[-1].archive_range[1]),
+                                     segments[0].tier + 1)
+
+    def postings(self, term):
+        i = self.lookup.get(term)
+        if i is None:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+        a, b = self.starts[i], self.starts[i + 1]
+        return self.occ_docs[a:b], self.occ_pos[a:b]
+
+    def frequency(self, clause):
+        """Occurrences of the clause's rarest term, to evaluate selective clauses first."""
+        counts = []
+        for term in clause:
+            i = self.lookup.get(term)
+            counts.append(0 if i is None else self.starts[i + 1] - self.starts[i])
+        return min(counts)
+
+    def match(self, clause, candidates=None):
+        """Sorted doc ids containing the clause's terms as a phrase, among sorted `candidates`."""
+        keys = None
+        for offset, term in enumerate(clause):
+            docs, positions = self.postings(term)
+            if candidates is not None and len(docs):
+                found = np.searchsorted(candidates, docs)
+                keep = candidates[np.minimum(found, len(candidates) - 1)] == docs
+                docs, positions = docs[keep], positions[keep]
+            if len(clause) == 1:
+                return docs[np.r_[True, docs[1:] != docs[:-1]]] if len(docs) else docs
+            # A phrase matches where term i sits at the first term's position + i
+            keep = positions >= offset
+            term_keys = (docs[keep].astype(np.int64) << 32) | (positions[keep] - offset)
+            keys = term_keys if keys is None else np.intersect1d(keys, term_keys)
+            if not len(keys):
+                break
+        return np.unique(keys >> 32).astype(np.int32)
+
+    def save(self, path):
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, docs=self.docs, terms=np.array(self.terms, dtype=str), starts=self.starts,
+                     occ_docs=self.occ_docs, occ_pos=self.occ_pos,
+                     archive_range=np.array(self.archive_range), tier=np.array(self.tier))
+        os.replace(path + '.tmp', path)
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['docs'], data['terms'].tolist(), data['starts'], data['occ_docs'],
+                       data['occ_pos'], data['archive_range'], int(data['tier']), path)
+
+class TranscriptIndex:
+    """Full-text index over the caller and dispatcher utterances in the call archive.
+
+    Tails the archive: every `interval` seconds the entries appended since the
+    last pass are read. Transcript events become documents in a new small
+    segment, and incident updates record each call's emergency type. A merge
+    thread combines `merge_factor` segments of one tier into the next, so a
+    query touches a few segments of logarithmically growing size. Merged
+    segments are saved to `directory` with a manifest of the archive position
+    they cover, and close() saves the rest; on open, indexing resumes from
+    there. Text is not stored; hits are read back from the archive.
+    """
+
+    def __init__(self, archive=None, directory=SEARCH_INDEX_DIR, interval=1.0, merge_factor=8):
+        self.archive = archive or call_archive
+        self.directory = directory
+        self.interval = interval
+        self.merge_factor = merge_factor
+        self.segments = []  # Oldest first, each covering the archive entries after the last
+        self.position = 0  # Archive entries indexed so far
+        self.calls = {}  # Archive call key -> ordinal
+        self.call_types = []  # Ordinal -> emergency type, '' until classified
+        self.types = None  # call_types as an array, rebuilt after changes
+        self.lock = threading.Lock()  # Guards the segment list and call table
+        self.update_lock = threading.Lock()  # One indexing pass at a time
+        self.save_lock = threading.Lock()  # One writer of the saved files at a time
+        self.merge_wanted = threading.Event()
+        self.threads = []
+        self.merges = 0
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, 'manifest.json')
+
+    def open(self):
+        """Load the saved index, then index the archive from where it left off, in the background."""
+        os.makedirs(self.directory, exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+            self.segments = [IndexSegment.load(os.path.join(self.directory, name))
+                             for name in manifest['segments']]
+            self.position = manifest['position']
+            with np.load(os.path.join(self.directory, 'calls.npz')) as calls:
+                self.calls = {bytes(key): i for i, key in enumerate(calls['keys'])}
+                self.call_types = calls['types'].tolist()
+        if not self.threads:
+            for target, name in ((self.update_worker, "search-index"), (self.merge_worker, "search-merge")):
+                thread = threading.Thread(target=target, name=name, daemon=True)
+                thread.start()
+                self.threads.append(thread)
+        return self
+
+    def update(self):
+        """Index the archive entries flushed since the last pass. Returns the utterances added."""
+        with self.update_lock:
+            entries = self.archive.entries()[self.position:]
+            if not len(entries):
+                return 0
+            end = self.position + len(entries)
+            rows = np.flatnonzero(entries['kind'] == CallArchive.EVENT)
+            utterances = []
+            for row in rows:
+                entry = entries[row]
+                event = json.loads(self.archive.read(entry))
+                if event.get('event') == 'transcript_update':
+                    if event.get('message') and not event.get('partial'):
+                        role = SEARCH_ROLES.index(event['role']) if event.get('role') in SEARCH_ROLES else 0
+                        utterances.append((self.call_ordinal(entry['call']), role, entry['start'],
+                                           self.position + row, self.tokens(event['message'])))
+                elif event.get('event') == 'incident_update' and event.get('type'):
+                    call = self.call_ordinal(entry['call'])
+                    with self.lock:
+                        self.call_types[call] = event['type']
+                        self.types = None
+            segment = IndexSegment.build(utterances, (self.position, end)) if utterances else None
+            with self.lock:
+                if segment is not None:
+                    self.segments.append(segment)
+                self.position = end
+            if self.mergeable() is not None:
+                self.merge_wanted.set()
+            return len(utterances)
+
+    def call_ordinal(self, key):
+        key = bytes(key)
+        ordinal = self.calls.get(key)
+        if ordinal is None:
+            with self.lock:
+                ordinal = self.calls[key] = len(self.call_types)
+                self.call_types.append('')
+                self.types = None
+        return ordinal
+
+    def mergeable(self):
+        """Index in `segments` of the oldest run of `merge_factor` same-tier segments, or None."""
+        with self.lock:
+            tiers = [segment.tier for segment in self.segments]
+        for start in range(len(tiers) - self.merge_factor + 1):
+            if tiers[start:start + self.merge_factor].count(tiers[start]) == self.merge_factor:
+                return start
+        return None
+
+    def merge(self):
+        """Merge runs of same-tier segments until none is left. Returns True if any were merged."""
+        merged = False
+        while True:
+            start = self.mergeable()
+            if start is None:
+                return merged
+            with self.lock:
+                run = self.segments[start:start + self.merge_factor]
+            segment = IndexSegment.merge(run)  # Queries keep using the old segments meanwhile
+            with self.lock:
+                # Indexing only appends, so the run is still where it was
+                self.segments[start:start + self.merge_factor] = [segment]
+            self.merges += 1
+            merged = True
+
+    def update_worker(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.update()
+            except Exception as e:
+                print(f"Error updating search index: {e}")
+
+    def merge_worker(self):
+        while True:
+            self.merge_wanted.wait()
+            self.merge_wanted.clear()
+            try:
+                if self.merge():
+                    self.save()
+            except Exception as e:
+                print(f"Error merging search index: {e}")
+
+    def close(self):
+        """Index what the archive has flushed and save everything, so a restart loses nothing."""
+        if not self.threads:
+            return  # Never opened
+        self.update()
+        self.save()
+
+    def save(self):
+        """Write unsaved segments and the call table, then point the manifest at them."""
+        with self.save_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with self.lock:
+                segments = list(self.segments)
+                position = self.position
+                keys = list(self.calls)
+                types = list(self.call_types)
+            for segment in segments:
+                if segment.path is None:
+                    lo, hi = segment.archive_range
+                    segment.save(os.path.join(self.directory, f'segment-{lo:012d}-{hi:012d}.npz'))
+            calls_path = os.path.join(self.directory, 'calls.npz')
+            with open(calls_path + '.tmp', 'wb') as f:
+                np.savez(f, keys=np.array(keys, dtype='S16'), types=np.array(types, dtype=str))
+            os.replace(calls_path + '.tmp', calls_path)
+            names = [os.path.basename(segment.path) for segment in segments]
+            with open(self.manifest_path + '.tmp', 'w') as f:
+                json.dump({'segments': names, 'position': position}, f)
+            os.replace(self.manifest_path + '.tmp', self.manifest_path)
+            for name in os.listdir(self.directory):
+                if name.startswith('segment-') and name.endswith('.npz') and name not in names:
+                    os.remove(os.path.join(self.directory, name))
+
+    @staticmethod
+    def tokens(text):
+        """Lowercase words, with apostrophes dropped so "there's" matches "theres" and
+        street suffixes spelled out so "Ave" matches "avenue"."""
+        words = re.findall(r"[a-z0-9]+", re.sub(r"['\u2019]", '', text.lower()))
+        return [STREET_SUFFIXES[word].lower() if word in STREET_SUFFIXES else word for word in words]
+
+    @classmethod
+    def parse(cls, query):
+        """Clauses of a query: each "quoted phrase" and each other word, as token tuples."""
+        clauses = [tuple(cls.tokens(phrase)) for phrase in re.findall(r'"([^"]*)"', query)]
+        clauses += [(token,) for token in cls.tokens(re.sub(r'"[^"]*"', ' ', query))]
+        return [clause for clause in clauses if clause]
+
+    def search(self, query, since=None, until=None, emergency_type=None, role=None, limit=20,
+               per_call=3):
+        """Calls with utterances matching every clause of `query`, most recent first."""
+        started = time.perf_counter()
+        clauses = self.parse(query)
+        with self.lock:
+            segments = list(self.segments)
+            if self.types is None:
+                self.types = np.array(self.call_types, dtype=str)
+            types = self.types
+        hits = []
+        for segment in segments if clauses else []:
+            docs = None
+            for clause in sorted(clauses, key=segment.frequency):
+                docs = segment.match(clause, docs)
+                if not len(docs):
+                    break
+            if not len(docs):
+                continue
+            found = segment.docs[docs]
+            mask = np.ones(len(found), dtype=bool)
+            if since is not None:
+                mask &= found['time'] >= since
+            if until is not None:
+                mask &= found['time'] <= until
+            if role is not None:
+                mask &= found['role'] == SEARCH_ROLES.index(role)
+            if emergency_type:
+                mask &= types[found['call']] == emergency_type.upper()
+            hits.append(found[mask])
+        hits = np.concatenate(hits) if hits else np.zeros(0, dtype=IndexSegment.DOC_DTYPE)
+        hits = hits[np.argsort(-hits['time'], kind='stable')]
+
+        # Calls ranked by their latest match, each with its latest few matching utterances
+        calls, first = np.unique(hits['call'], return_index=True)
+        entries = self.archive.entries()
+        results = []
+        for index in np.sort(first)[:limit]:
+            call = hits['call'][index]
+            matches = []
+            for hit in hits[hits['call'] == call][:per_call]:
+                event = json.loads(self.archive.read(entries[hit['entry']]))
+                matches.append({'time': float(hit['time']), 'role': SEARCH_ROLES[hit['role']],
+                                'message': event['message']})
+            results.append({'call_id': event.get('call_id'), 'type': str(types[call]) or None,
+                            'matches': matches})
+        return {'query': query, 'total_matches': len(hits), 'total_calls': len(calls),
+                'calls': results, 'took_ms': (time.perf_counter() - started) * 1000}
+
+    def stats(self):
+        with self.lock:
+            return {'segments': len(self.segments), 'tiers': [s.tier for s in self.segments],
+                    'utterances': sum(len(s.docs) for s in self.segments), 'calls': len(self.call_types),
+                    'archive_position': self.position, 'merges': self.merges}
+
+transcript_index = TranscriptIndex()
+
+class AudioPlayer:
+    """Plays 16-bit mono PCM through one output stream that stays open for the call.
+
+    Audio is written in 20 ms blocks so stop() (barge-in) takes effect within a
+    block, and the level of recent blocks is kept as the echo reference.
+    """
+
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.stream = None
+        self.remainder = b''  # Odd trailing byte of a chunk that split a sample
+        self.lock = threading.Lock()
+        self.interrupted = threading.Event()
+        self.levels = collections.deque(maxlen=25)  # (time, dB) of the last 0.5 s of blocks
+        self.stopped_at = 0.0  # When a write was last cut short
+
+    def write(self, pcm):
+        """Play PCM bytes, blocking until they have been handed to the device.
+
+        Returns the number of bytes played, which is short if stop() was called.
+        """
+        with self.lock:
+            pcm = self.remainder + pcm
+            usable = len(pcm) - len(pcm) % 2
+            self.remainder = pcm[usable:]
+            if not usable or self.interrupted.is_set():
+                return 0
+            if self.stream is None:
+                self.stream = sd.RawOutputStream(samplerate=self.sample_rate, channels=1,
+                                                 dtype='int16', latency='low')
+            if self.stream.stopped:
+                self.stream.start()
+            for offset in range(0, usable, PLAYBACK_BLOCK_BYTES):
+                if self.interrupted.is_set():
+                    self.stream.abort()  # Drop whatever the device still has queued
+                    self.stopped_at = time.perf_counter()
+                    self.remainder = b''
+                    return offset
+                block = pcm[offset:min(offset + PLAYBACK_BLOCK_BYTES, usable)]
+                self.levels.append((time.perf_counter(), level_db(np.frombuffer(block, np.int16))))
+                self.stream.write(block)
+            return usable
+
+    def reference_db(self, window=0.2):
+        """Loudest playback level over the last `window` seconds, or None if silent."""
+        cutoff = time.perf_counter() - window
+        recent = [db for t, db in list(self.levels) if t >= cutoff]
+        return max(recent) if recent else None
+
+    def stop(self):
+        """Interrupt playback; writes are dropped until resume()."""
+        self.interrupted.set()
+
+    def resume(self):
+        self.interrupted.clear()
+
+    def close(self):
+        self.stop()
+        with self.lock:
+            if self.stream is not None:
+                self.stream.close()
+                self.stream = None
+
+class NetworkPlayer(AudioPlayer):
+    """Sends the dispatcher's voice back to a remote caller as binary Socket.IO frames.
+
+    Blocks are paced at real time, so barge-in, the echo reference and the
+    `speaking` state behave exactly as they do with a local sound card.
+    """
+
+    class Stream:
+        stopped = False
+
+        def __init__(self, call_id, sample_rate):
+            self.call_id = call_id
+            self.sample_rate = sample_rate
+            self.seq = 0
+            self.next_time = time.perf_counter()
+
+        def write(self, block):
+            event_hub.emit(self.call_id, 'audio_out', {'seq': self.seq, 'sample_rate': self.sample_rate,
+                                                       'pcm': bytes(block)}, supervisors=False)
+            self.seq += 1
+            self.next_time = max(self.next_time, time.perf_counter())
+            self.next_time += len(block) / (2 * self.sample_rate)
+            # Stay at most one block ahead of the caller's playback
+            delay = self.next_time - time.perf_counter() - PLAYBACK_BLOCK_BYTES / (2 * self.sample_rate)
+            if delay > 0:
+                time.sleep(delay)
+
+        def abort(self):
+            event_hub.emit(self.call_id, 'audio_flush', {}, supervisors=False)
+            self.next_time = time.perf_counter()
+
+        def close(self):
+            pass
+
+    def __init__(self, call_id, sample_rate):
+        super().__init__(sample_rate)
+        self.stream = self.Stream(call_id, sample_rate)
+
+class StageQueue:
+    """Bounded queue between pipeline stages with overflow and backpressure counters."""
+
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.enqueued = 0
+        self.dropped = 0
+        self.high_water = 0
+        self.blocked_time = 0.0
+        self.closed = False
+
+    def put_nowait(self, item):
+        """Enqueue without blocking (safe from real-time callbacks). Drops the item if full."""
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self._record()
+        return True
+
+    def put(self, item):
+        """Enqueue, blocking while the next stage is saturated. Returns False once closed."""
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            start = time.perf_counter()
+            while not self.closed:
+                try:
+                    self.queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            self.blocked_time += time.perf_counter() - start
+            if self.closed:
+                return False
+        self._record()
+        return True
+
+    def close(self):
+        """Release any producer blocked on a full queue."""
+        self.closed = True
+
+    def get(self, timeout=None):
+        """Dequeue the next item, or None if nothing arrived within the timeout."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def _record(self):
+        self.enqueued += 1
+        self.high_water = max(self.high_water, self.queue.qsize())
+
+    def stats(self):
+        return {
+            'depth': self.queue.qsize(),
+            'capacity': self.queue.maxsize,
+            'high_water': self.high_water,
+            'enqueued': self.enqueued,
+            'dropped': self.dropped,
+            'blocked_seconds': round(self.blocked_time, 3),
+        }
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (Prometheus-style upper bounds, plus +Inf)."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside the bucket that contains it."""
+        with self.lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            if seen + n >= rank and n:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0.0
+                return lower + (self.buckets[i] - lower) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+    def prometheus(self, name, labels):
+        """Bucket, sum and count lines in the Prometheus text format."""
+        with self.lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+        lines.append(f'{name}_sum{{{labels}}} {total}')
+        lines.append(f'{name}_count{{{labels}}} {count}')
+        return lines
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 6),
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+        }
+
+class Span:
+    """Times a `with` block into a StageMetrics stage."""
+
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+        return False
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class StageMetrics:
+    """Latency histograms per pipeline stage.
+
+    Each call owns one, chained to the process-wide `stage_metrics` so every
+    observation lands in both. When disabled, span() hands back a shared no-op
+    and observe() returns immediately.
+    """
+
+    def __init__(self, enabled=None, parent=None):
+        self.enabled = METRICS_ENABLED if enabled is None else enabled
+        self.parent = parent
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def span(self, stage):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, stage)
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, LatencyHistogram())
+        histogram.observe(seconds)
+        if self.parent is not None:
+            self.parent.observe(stage, seconds)
+
+    def snapshot(self):
+        """Count, sum and estimated p50/p95/p99 (seconds) per stage."""
+        return {stage: h.snapshot() for stage, h in sorted(self.histograms.items())}
+
+    def prometheus(self, name="dispatcher_stage_latency_seconds"):
+        """Render the histograms in the Prometheus text exposition format."""
+        lines = [f"# HELP {name} Latency of each dispatcher pipeline stage.",
+                 f"# TYPE {name} histogram"]
+        for stage, h in sorted(self.histograms.items()):
+            lines += h.prometheus(name, f'stage="{stage}"')
+        return "\n".join(lines) + "\n"
+
+stage_metrics = StageMetrics()
+
+# Errors worth another attempt; anything else (bad request, auth) fails straight away
+RETRYABLE_ERRORS = (TimeoutError, ConnectionError, openai.APIConnectionError,
+                    openai.RateLimitError, openai.InternalServerError)
+
+def is_client_error(error):
+    """The endpoint answered but rejected this request (bad request, auth...). Says nothing
+    about the endpoint's health, so it doesn't count against the breaker."""
+    return (isinstance(error, openai.APIStatusError) and 400 <= error.status_code < 500
+            and error.status_code not in (408, 429))
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit breaker is open."""
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures, then lets one trial call
+    through every `reset_timeout` seconds until one succeeds."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=10.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.time() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def release_trial(self):
+        """The trial call was abandoned without an outcome; let another one through."""
+        with self.lock:
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.trial_running or self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+            self.trial_running = False
+
+class EndpointPolicy:
+    """Deadline, hedging, retry and circuit-breaker settings for one external endpoint.
+
+    Only `idempotent` endpoints are hedged or retried on timeouts; the others
+    are retried only when the server rejected the request outright (rate limit).
+    For streamed endpoints `timeout` bounds each wait for data (connecting, or
+    the gap between chunks) rather than the whole stream.
+    """
+
+    def __init__(self, name, timeout=10.0, max_attempts=2, hedge=False, hedge_quantile=0.95,
+                 min_hedge_delay=0.25, idempotent=True, backoff=0.2, breaker=None):
+        self.name = name
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.hedge = hedge and idempotent
+        self.hedge_quantile = hedge_quantile
+        self.min_hedge_delay = min_hedge_delay
+        self.idempotent = idempotent
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = LatencyHistogram()
+        self.counts = collections.Counter()
+        self.lock = threading.Lock()  # Hedges and parallel calls count from several threads
+
+    def count(self, event):
+        with self.lock:
+            self.counts[event] += 1
+
+    def hedge_delay(self):
+        """Send a duplicate once this attempt is slower than the endpoint's usual tail."""
+        if self.latency.count < 20:
+            return max(self.min_hedge_delay, self.timeout / 2)
+        return max(self.min_hedge_delay, self.latency.quantile(self.hedge_quantile))
+
+    def retryable(self, error):
+        if self.idempotent:
+            return isinstance(error, RETRYABLE_ERRORS)
+        return isinstance(error, openai.RateLimitError)
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.counts)
+        return {**self.latency.snapshot(), **counts, 'breaker': self.breaker.state}
+
+class CallPolicy:
+    """Runs external API calls under per-endpoint deadlines, hedging, retries and breakers.
+
+    Unary calls go through call(), which runs attempts on a shared pool so a
+    deadline can be enforced and a hedge sent. Each attempt is passed the time
+    left before the deadline, to use as the request's timeout, so an attempt
+    that is given up on also stops. Streaming calls can't be duplicated once
+    they start, so they go through guard(), which applies the breaker, records
+    latency and errors, and yields the timeout for each read of the stream.
+    Requests the endpoint rejected as malformed or unauthorized don't count
+    against the breaker.
+    """
+
+    def __init__(self, policies, max_workers=64):
+        self.endpoints = {policy.name: policy for policy in policies}
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="api")
+
+    def call(self, endpoint, fn, fallback=None):
+        """Run `fn(timeout)` under the endpoint's policy; on failure return `fallback()` or raise."""
+        policy = self.endpoints[endpoint]
+        if not policy.breaker.allow():
+            policy.count('short_circuited')
+            if fallback is not None:
+                return fallback()
+            raise CircuitOpenError(endpoint)
+
+        deadline = time.perf_counter() + policy.timeout
+        error = None
+        for attempt in range(policy.max_attempts):
+            if attempt:
+                policy.count('retries')
+            try:
+                result = self._attempt(policy, fn, deadline)
+                policy.breaker.record_success()
+                return result
+            except Exception as e:
+                error = e
+                remaining = deadline - time.perf_counter()
+                if not policy.retryable(e) or attempt + 1 == policy.max_attempts or remaining <= 0:
+                    break
+                # Full jitter keeps many calls from retrying in lockstep
+                time.sleep(min(remaining, random.uniform(0, policy.backoff * 2 ** attempt)))
+
+        self._record_failure(policy, error)
+        print(f"{endpoint} failed: {error!r}")
+        if fallback is not None:
+            return fallback()
+        raise error
+
+    @staticmethod
+    def _record_failure(policy, error):
+        policy.count('failures')
+        if is_client_error(error):
+            policy.count('rejected')
+            policy.breaker.release_trial()
+        else:
+            policy.breaker.record_failure()
+
+    def _attempt(self, policy, fn, deadline):
+        start = time.perf_counter()
+        policy.count('calls')
+        primary = self.executor.submit(fn, deadline - start)
+        pending = {primary}
+        hedge_at = start + policy.hedge_delay() if policy.hedge else None
+        error = None
+        while pending:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            until = deadline if hedge_at is None else min(deadline, hedge_at)
+            done, pending = wait(pending, timeout=until - now, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    policy.latency.observe(time.perf_counter() - start)
+                    if future is not primary:
+                        policy.count('hedge_wins')
+                    return future.result()
+                error = future.exception()
+            if hedge_at is not None and time.perf_counter() >= hedge_at:
+                # Slower than usual: race a duplicate against it (the loser is ignored)
+                hedge_at = None
+                if pending:
+                    policy.count('hedges')
+                    pending.add(self.executor.submit(fn, deadline - time.perf_counter()))
+        if not pending and error is not None:
+            raise error
+        policy.count('timeouts')
+        raise TimeoutError(f"{policy.name} exceeded its {policy.timeout:.1f} s deadline")
+
+    @contextlib.contextmanager
+    def guard(self, endpoint):
+        """Breaker and stats around a streaming call made in the caller's thread.
+        Yields the timeout to pass to the request."""
+        policy = self.endpoints[endpoint]
+        if not policy.breaker.allow():
+            policy.count('short_circuited')
+            raise CircuitOpenError(endpoint)
+        policy.count('calls')
+        start = time.perf_counter()
+        try:
+            yield policy.timeout
+        except Exception as e:
+            self._record_failure(policy, e)
+            raise
+        policy.latency.observe(time.perf_counter() - start)
+        policy.breaker.record_success()
+
+    async def acall(self, endpoint, fn, fallback=None):
+        """call() for the event loop: `fn(timeout)` returns a coroutine. A losing hedge is cancelled."""
+        policy = self.endpoints[endpoint]
+        if not policy.breaker.allow():
+            policy.count('short_circuited')
+            if fallback is not None:
+                return fallback()
+            raise CircuitOpenError(endpoint)
+
+        deadline = time.perf_counter() + policy.timeout
+        error = None
+        for attempt in range(policy.max_attempts):
+            if attempt:
+                policy.count('retries')
+            try:
+                result = await self._aattempt(policy, fn, deadline)
+                policy.breaker.record_success()
+                return result
+            except asyncio.CancelledError:
+                policy.breaker.release_trial()
+                raise
+            except Exception as e:
+                error = e
+                remaining = deadline - time.perf_counter()
+                if not policy.retryable(e) or attempt + 1 == policy.max_attempts or remaining <= 0:
+                    break
+                await asyncio.sleep(min(remaining, random.uniform(0, policy.backoff * 2 ** attempt)))
+
+        self._record_failure(policy, error)
+        print(f"{endpoint} failed: {error!r}")
+        if fallback is not None:
+            return fallback()
+        raise error
+
+    async def _aattempt(self, policy, fn, deadline):
+        start = time.perf_counter()
+        policy.count('calls')
+        primary = asyncio.ensure_future(fn(deadline - start))
+        pending = {primary}
+        hedge_at = start + policy.hedge_delay() if policy.hedge else None
+        error = None
+        try:
+            while pending:
+                now = time.perf_counter()
+                if now >= deadline:
+                    break
+                until = deadline if hedge_at is None else min(deadline, hedge_at)
+                done, pending = await asyncio.wait(pending, timeout=until - now,
+                                                   return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        policy.latency.observe(time.perf_counter() - start)
+                        if task is not primary:
+                            policy.count('hedge_wins')
+                        return task.result()
+                    error = task.exception()
+                if hedge_at is not None and time.perf_counter() >= hedge_at:
+                    hedge_at = None
+                    if pending:
+                        policy.count('hedges')
+                        pending.add(asyncio.ensure_future(fn(deadline - time.perf_counter())))
+        finally:
+            for task in pending:
+                task.cancel()
+        if not pending and error is not None:
+            raise error
+        policy.count('timeouts')
+        raise TimeoutError(f"{policy.name} exceeded its {policy.timeout:.1f} s deadline")
+
+    @contextlib.asynccontextmanager
+    async def aguard(self, endpoint):
+        """guard() for streaming calls made on the event loop."""
+        policy = self.endpoints[endpoint]
+        if not policy.breaker.allow():
+            policy.count('short_circuited')
+            raise CircuitOpenError(endpoint)
+        policy.count('calls')
+        start = time.perf_counter()
+        try:
+            yield policy.timeout
+        except asyncio.CancelledError:
+            policy.breaker.release_trial()  # The call ended; not the endpoint's fault
+            raise
+        except Exception as e:
+            self._record_failure(policy, e)
+            raise
+        policy.latency.observe(time.perf_counter() - start)
+        policy.breaker.record_success()
+
+    def stats(self):
+        return {name: policy.stats() for name, policy in self.endpoints.items()}
+
+    def prometheus(self, name="dispatcher_endpoint_latency_seconds"):
+        lines = [f"# HELP {name} Latency of external API calls per endpoint.",
+                 f"# TYPE {name} histogram"]
+        for endpoint, policy in sorted(self.endpoints.items()):
+            lines += policy.latency.prometheus(name, f'endpoint="{endpoint}"')
+        lines.append("# TYPE dispatcher_endpoint_events_total counter")
+        for endpoint, policy in sorted(self.endpoints.items()):
+            with policy.lock:
+                counts = sorted(policy.counts.items())
+            for event, n in counts:
+                lines.append(f'dispatcher_endpoint_events_total{{endpoint="{endpoint}",event="{event}"}} {n}')
+        return "\n".join(lines) + "\n"
+
+call_policy = CallPolicy([
+    EndpointPolicy('transcribe', timeout=8.0, max_attempts=3, hedge=True),
+    EndpointPolicy('tts_render', timeout=10.0, hedge=True),
+    EndpointPolicy('tts', timeout=5.0, breaker=CircuitBreaker(3, 10.0)),  # Streamed; guarded only
+    EndpointPolicy('messages', timeout=5.0, idempotent=False),
+    EndpointPolicy('run', timeout=15.0, breaker=CircuitBreaker(3, 15.0)),  # Streamed; guarded only
+    EndpointPolicy('run_poll', timeout=5.0, max_attempts=3, hedge=True),
+    EndpointPolicy('messages_list', timeout=5.0, max_attempts=3, hedge=True),
+])
+
+# How many seconds of waiting each class is worth: a routine request that has waited
+# 4 s longer than a critical one goes first, so no call is starved
+PRIORITY_OFFSETS = {'critical': 0.0, 'urgent': 1.5, 'routine': 4.0, 'background': 30.0}
+
+class SchedulerTimeout(TimeoutError):
+    """Raised when a request waits longer than the scheduler's `max_wait` for a slot."""
+
+class EndpointBudget:
+    """Concurrency and rate budget for one endpoint, with a priority queue in front.
+
+    Waiting requests are ordered by `since + PRIORITY_OFFSETS[class]`: the time
+    the caller started waiting, pushed back by how much less urgent the call is.
+    The order doesn't change as time passes, so a heap holds it, and a request
+    that has waited long enough overtakes newer, more urgent ones. The rate is a
+    token bucket of `rate` requests per second holding up to `burst` tokens.
+    """
+
+    def __init__(self, name, concurrency, rate=None, burst=None):
+        self.name = name
+        self.concurrency = concurrency
+        self.rate = rate
+        self.burst = burst or concurrency
+        self.tokens = float(self.burst)
+        self.refilled = time.perf_counter()
+        self.in_flight = 0
+        self.waiting = []  # Heap of [key, seq, class]
+        self.seq = 0
+        self.condition = threading.Condition()  # Also guards the counters below
+        self.depth = collections.Counter()
+        self.peak_depth = collections.Counter()
+        self.granted = collections.Counter()
+        self.timeouts = collections.Counter()
+        self.wait = collections.defaultdict(LatencyHistogram)
+
+    def _refill(self, now):
+        if self.rate is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+
+    def acquire(self, priority, since=None, max_wait=None):
+        """Block until this request is at the head of the queue and the budget allows it."""
+        start = time.perf_counter()
+        since = start if since is None else since
+        with self.condition:
+            entry = [since + PRIORITY_OFFSETS[priority], self.seq, priority]
+            self.seq += 1
+            heapq.heappush(self.waiting, entry)
+            self.depth[priority] += 1
+            self.peak_depth[priority] = max(self.peak_depth[priority], self.depth[priority])
+            try:
+                while True:
+                    now = time.perf_counter()
+                    self._refill(now)
+                    timeout = None if max_wait is None else start + max_wait - now
+                    if self.waiting[0] is entry and self.in_flight < self.concurrency:
+                        if self.rate is None or self.tokens >= 1:
+                            break
+                        # Head of the queue; sleep until the next token
+                        token_at = (1 - self.tokens) / self.rate
+                        timeout = token_at if timeout is None else min(timeout, token_at)
+                    if timeout is not None and timeout <= 0:
+                        self.waiting.remove(entry)
+                        heapq.heapify(self.waiting)
+                        self.timeouts[priority] += 1
+                        raise SchedulerTimeout(f"no {self.name} slot within {max_wait:.1f} s")
+                    self.condition.wait(timeout)
+                heapq.heappop(self.waiting)
+                if self.rate is not None:
+                    self.tokens -= 1
+                self.in_flight += 1
+                self.granted[priority] += 1
+                self.wait[priority].observe(time.perf_counter() - start)
+            finally:
+                self.depth[priority] -= 1
+                self.condition.notify_all()  # The next request may be able to go too
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            classes = {priority: {'queued': self.depth[priority],
+                                  'peak_queued': self.peak_depth[priority],
+                                  'granted': self.granted[priority],
+                                  'timeouts': self.timeouts[priority],
+                                  'wait': self.wait[priority].snapshot()}
+                       for priority in PRIORITY_OFFSETS if self.peak_depth[priority]}
+            return {'in_flight': self.in_flight, 'concurrency': self.concurrency,
+                    'rate': self.rate, 'classes': classes}
+
+class PriorityScheduler:
+    """Shares API capacity between calls, most urgent first.
+
+    Every transcription, assistant run and speech synthesis takes a slot from
+    its endpoint's budget before calling out, and holds it until the call
+    (including any hedges and retries under call_policy) is finished.
+    """
+
+    def __init__(self, budgets, max_wait=10.0):
+        self.budgets = {budget.name: budget for budget in budgets}
+        self.max_wait = max_wait
+
+    @contextlib.contextmanager
+    def slot(self, endpoint, priority='routine', since=None):
+        budget = self.budgets[endpoint]
+        budget.acquire(priority, since, self.max_wait)
+        try:
+            yield
+        finally:
+            budget.release()
+
+    def stats(self):
+        return {name: budget.stats() for name, budget in self.budgets.items()}
+
+    def prometheus(self, name="dispatcher_scheduler_wait_seconds"):
+        lines = [f"# HELP {name} Time API requests waited for a scheduler slot.",
+                 f"# TYPE {name} histogram"]
+        for endpoint, budget in sorted(self.budgets.items()):
+            with budget.condition:  # acquire() adds histograms as new classes arrive
+                waits = sorted(budget.wait.items())
+            for priority, histogram in waits:
+                lines += histogram.prometheus(name, f'endpoint="{endpoint}",priority="{priority}"')
+        lines.append("# TYPE dispatcher_scheduler_queue_depth gauge")
+        for endpoint, budget in sorted(self.budgets.items()):
+            with budget.condition:
+                depths = [(priority, budget.depth[priority]) for priority in PRIORITY_OFFSETS]
+            for priority, depth in depths:
+                lines.append(f'dispatcher_scheduler_queue_depth{{endpoint="{endpoint}",'
+                             f'priority="{priority}"}} {depth}')
+        return "\n".join(lines) + "\n"
+
+# Streamed speech holds its slot while it plays, so TTS is limited mainly by rate
+scheduler = PriorityScheduler([
+    EndpointBudget('transcribe', concurrency=8, rate=10.0),
+    EndpointBudget('assistant', concurrency=8, rate=5.0),
+    EndpointBudget('tts', concurrency=MAX_CONCURRENT_CALLS, rate=10.0),
+])
+
+def level_db(samples):
+    """Mean power of int16 samples in dB (same scale as frame_features' energy)."""
+    x = np.asarray(samples, dtype=np.float32)
+    return float(10 * np.log10(np.mean(x * x) + 1e-3)) if len(x) else 0.0
+
+class EchoGate:
+    """Keeps the dispatcher's own voice, picked up by the microphone, out of the VAD.
+
+    While audio plays, a frame only counts as possible caller speech if it is
+    `margin_db` louder than the expected echo: the playback level minus the
+    echo return loss (how much quieter playback comes back into the microphone).
+    The return loss is learned from gated frames, so it adapts to speakers,
+    headsets and rooms.
+    """
+
+    def __init__(self, margin_db=6.0, echo_loss_db=10.0):
+        self.margin_db = margin_db
+        self.echo_loss_db = echo_loss_db
+        self.gated = 0
+
+    def passes(self, mic_db, reference_db):
+        """True if the frame may be the caller rather than echo."""
+        if reference_db is None:
+            return True
+        if mic_db > reference_db - self.echo_loss_db + self.margin_db:
+            return True
+        # Echo only: learn how much quieter playback is at the microphone
+        self.echo_loss_db += 0.05 * ((reference_db - mic_db) - self.echo_loss_db)
+        self.gated += 1
+        return False
+
+def frame_features(frames, sample_rate):
+    """Per-frame energy (dB), zero-crossing rate and spectral flatness.
+
+    `frames` is a 2-D (n_frames, frame_length) int16 array; everything is computed
+    in one vectorized pass so a whole recording can be analyzed at once.
+    """
+    x = np.asarray(frames, dtype=np.float32)
+    energy_db = 10 * np.log10(np.mean(x * x, axis=1) + 1e-3)
+
+    signs = np.signbit(x)
+    zcr = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+
+    spectrum = np.abs(np.fft.rfft(x * np.hanning(x.shape[1]), axis=1)) + 1e-3
+    flatness = np.exp(np.mean(np.log(spectrum), axis=1)) / np.mean(spectrum, axis=1)
+    return energy_db, zcr, flatness
+
+class VoiceActivityDetector:
+    """Base class for VAD engines: turns per-frame speech decisions into turn events.
+
+    update() returns 'onset' when a turn starts, 'end' when the trailing silence
+    reaches endpoint_duration(), and None otherwise.
+    """
+
+    onset_frames = 1  # Consecutive speech frames needed to start a turn
+
+    def __init__(self, frame_duration, silence_duration):
+        self.frame_duration = frame_duration
+        self.silence_duration = silence_duration
+        self.in_turn = False
+        self.speech_run = 0
+        self.silence_frames = 0
+
+    def is_speech(self, frame):
+        raise NotImplementedError
+
+    def endpoint_duration(self):
+        """Seconds of trailing silence that end the current turn."""
+        return self.silence_duration
+
+    def on_pause(self, pause):
+        """Called when speech resumes after a pause that did not end the turn."""
+
+    def update(self, frame, suppress=False):
+        """Advance by one frame. `suppress` treats it as non-speech without analyzing it."""
+        speech = False if suppress else self.is_speech(frame)
+        self.speech_run = self.speech_run + 1 if speech else 0
+
+        if not self.in_turn:
+            if self.speech_run >= self.onset_frames:
+                self.in_turn = True
+                self.silence_frames = 0
+                return 'onset'
+            return None
+
+        if speech:
+            if self.silence_frames:
+                self.on_pause(self.silence_frames * self.frame_duration)
+            self.silence_frames = 0
+            return None
+
+        self.silence_frames += 1
+        if self.silence_frames * self.frame_duration >= self.endpoint_duration():
+            self.reset_turn()
+            return 'end'
+        return None
+
+    def reset_turn(self):
+        self.in_turn = False
+        self.speech_run = 0
+        self.silence_frames = 0
+
+class ThresholdVAD(VoiceActivityDetector):
+    """The original detector: mean amplitude over a fixed threshold, fixed silence timeout."""
+
+    def __init__(self, frame_duration, silence_duration=1.5, threshold=700):
+        super().__init__(frame_duration, silence_duration)
+        self.threshold = threshold
+
+    def is_speech(self, frame):
+        return np.abs(frame).mean() > self.threshold
+
+class AdaptiveVAD(VoiceActivityDetector):
+    """Energy + zero-crossing + spectral flatness VAD with an adaptive noise floor.
+
+    The noise floor follows quiet frames quickly and creeps up slowly during speech,
+    so stationary background noise is absorbed within a few seconds. A short
+    hangover keeps weak word endings inside the turn, and the endpoint adapts to
+    the caller's own pauses instead of always waiting `silence_duration`.
+    """
+
+    onset_frames = 2
+
+    def __init__(self, sample_rate, frame_duration, silence_duration=1.5,
+                 min_endpoint=0.45, default_endpoint=1.0, snr_db=9.0):
+        super().__init__(frame_duration, silence_duration)
+        self.sample_rate = sample_rate
+        self.min_endpoint = min_endpoint
+        self.default_endpoint = default_endpoint
+        self.snr_db = snr_db
+        self.min_floor_db = 30.0  # Keeps digital silence from making every click "speech"
+        self.noise_floor_db = 40.0
+        self.max_flatness = 0.6  # Noise has a flat spectrum, voiced speech is peaky
+        self.max_zcr = 0.45
+        self.hangover_frames = 2
+        self.hangover = 0
+        self.pauses = collections.deque(maxlen=30)
+        self.min_pause = 0.2
+        self.endpoint_margin = 0.3
+
+    def classify(self, energy_db, zcr, flatness):
+        """Speech decision for one frame's features, updating the noise floor."""
+        margin = energy_db - self.noise_floor_db
+        speech = margin > self.snr_db and flatness < self.max_flatness and zcr < self.max_zcr
+        if speech:
+            self.hangover = self.hangover_frames
+            self.noise_floor_db += 0.001 * (energy_db - self.noise_floor_db)
+        elif self.hangover and margin > self.snr_db / 2:
+            self.hangover -= 1
+            speech = True
+        else:
+            self.hangover = 0
+            rate = 0.2 if energy_db < self.noise_floor_db else 0.02
+            self.noise_floor_db += rate * (energy_db - self.noise_floor_db)
+        self.noise_floor_db = max(self.noise_floor_db, self.min_floor_db)
+        return speech
+
+    def is_speech(self, frame):
+        frame = np.asarray(frame).reshape(1, -1)
+        energy_db, zcr, flatness = frame_features(frame, self.sample_rate)
+        return self.classify(energy_db[0], zcr[0], flatness[0])
+
+    def analyze(self, audio, frame_samples):
+        """Speech decisions for a whole recording, with features computed in one pass."""
+        n = len(audio) // frame_samples
+        frames = np.asarray(audio[:n * frame_samples]).reshape(n, frame_samples)
+        features = zip(*frame_features(frames, self.sample_rate))
+        return np.array([self.classify(*f) for f in features], dtype=bool)
+
+    def on_pause(self, pause):
+        # Gaps between syllables say nothing about how long this caller pauses mid-sentence
+        if pause >= self.min_pause:
+            self.pauses.append(pause)
+
+    def endpoint_duration(self):
+        # Wait a little longer than this caller's usual mid-sentence pause
+        if len(self.pauses) < 3:
+            return self.default_endpoint
+        typical = np.percentile(self.pauses, 90) + self.endpoint_margin
+        return float(np.clip(typical, self.min_endpoint, self.silence_duration))
+
+class AudioRingBuffer:
+    """Fixed-capacity int16 capture buffer.
+
+    Every sample is written twice, at i and i + capacity, so any window of up to
+    `capacity` samples is one contiguous slice and can be handed out as a view.
+    Positions are absolute sample counts since the call started.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = np.zeros(2 * capacity, dtype=np.int16)
+        self.total = 0
+
+    @property
+    def oldest(self):
+        """Oldest absolute position still held in the buffer."""
+        return max(0, self.total - self.capacity)
+
+    def write(self, samples):
+        """Copy samples into the buffer in place. Returns the new end position."""
+        skipped = max(0, len(samples) - self.capacity)
+        samples = samples[skipped:]
+        self.total += skipped
+        n = len(samples)
+        offset = self.total % self.capacity
+        first = min(n, self.capacity - offset)
+        for base in (0, self.capacity):
+            self.data[base + offset:base + offset + first] = samples[:first]
+            self.data[base:base + n - first] = samples[first:]
+        self.total += n
+        return self.total
+
+    def is_valid(self, start):
+        """True if the samples from `start` onward have not been overwritten."""
+        return start >= self.oldest
+
+    def view(self, start, end):
+        """Zero-copy view of samples [start, end). Only valid until they are overwritten."""
+        if not self.is_valid(start) or end > self.total or end - start > self.capacity:
+            raise ValueError(f"Samples {start}-{end} are not in the buffer")
+        offset = start % self.capacity
+        return self.data[offset:offset + end - start]
+
+def load_wav(path, sample_rate=16000):
+    """Read a 16-bit mono WAV file as int16 samples."""
+    with wave.open(path, 'rb') as wf:
+        if wf.getsampwidth() != 2 or wf.getnchannels() != 1:
+            raise ValueError(f"{path}: expected 16-bit mono audio")
+        if wf.getframerate() != sample_rate:
+            raise ValueError(f"{path}: expected {sample_rate} Hz, got {wf.getframerate()} Hz")
+        return np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+
+class WavReplaySource:
+    """Feeds recorded audio through the dispatcher's audio_callback at `speed` times real time.
+
+    Stands in for the microphone: the dispatcher runs exactly the capture,
+    segmentation and transcription path it runs live.
+    """
+
+    def __init__(self, audio, speed=1.0, drain_timeout=30.0):
+        self.audio = audio
+        self.speed = speed
+        self.drain_timeout = drain_timeout  # How long to wait for the last turn once audio ends
+
+    def run(self, dispatcher):
+        chunk = dispatcher.chunk_samples
+        interval = dispatcher.chunk_duration / self.speed
+        next_time = time.perf_counter()
+        for start in range(0, len(self.audio) - chunk + 1, chunk):
+            if not dispatcher.call_in_progress:
+                return
+            frame = self.audio[start:start + chunk].reshape(-1, 1)
+            dispatcher.audio_callback(frame, chunk, None, None)
+            next_time += interval
+            delay = next_time - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        # Trailing silence so a turn still open at the end of the recording is closed
+        silence = np.zeros((chunk, 1), dtype=np.int16)
+        for _ in range(int(dispatcher.silence_duration / dispatcher.chunk_duration) + 1):
+            dispatcher.audio_callback(silence, chunk, None, None)
+
+        deadline = time.time() + self.drain_timeout
+        while dispatcher.call_in_progress and time.time() < deadline:
+            if dispatcher.pipeline_idle():
+                return
+            time.sleep(0.01)
+
+class SpeculativeTurn:
+    """Transcription and assistant run started during a pause, before the turn has ended.
+
+    Deltas from the run are buffered rather than spoken. If the turn ends without
+    the caller speaking again it is committed and the dialogue stage relays them;
+    if the caller resumes, it is cancelled and the run and message are removed
+    from the thread. The run lock is held until one or the other happens.
+    """
+
+    def __init__(self, dispatcher, start, end):
+        self.dispatcher = dispatcher
+        self.start = start
+        self.end = end
+        self.started = time.perf_counter()
+        self.transcript = None
+        self.message_id = None
+        self.run_id = None
+        self.options = {}  # Run parameters, counted as a compaction only if the turn is committed
+        self.failed = False
+        self.deltas = queue.Queue()
+        self.ready = threading.Event()  # Set once the transcript is known
+        self.decided = threading.Event()  # Set by commit() or cancel()
+        self.cancelled = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        d = self.dispatcher
+        try:
+            self.transcript = d.transcribe(d.ring.view(self.start, self.end), since=self.started)
+            if not d.ring.is_valid(self.start):
+                self.transcript = None
+        finally:
+            self.ready.set()
+        if not self.transcript or self.cancelled:
+            self.deltas.put(None)
+            return
+
+        with d.run_lock:  # The thread allows one active run at a time
+            try:
+                if not self.cancelled:
+                    with d.slot('assistant', self.started):
+                        self.stream()
+            except Exception as e:
+                print(f"Speculative run failed: {e}")
+                self.failed = True
+            finally:
+                self.deltas.put(None)
+            self.decided.wait()
+            if (self.cancelled or self.failed) and self.message_id is not None:
+                self.discard()
+
+    def stream(self):
+        d = self.dispatcher
+        d.record_interrupted_reply()
+        message = call_policy.call('messages', lambda timeout: d.client.beta.threads.messages.create(
+            thread_id=d.thread.id,
+            role="user",
+            content=self.transcript,
+            timeout=timeout
+        ))
+        self.message_id = message.id
+        self.options = d.run_options()
+        with call_policy.guard('run') as timeout, d.client.beta.threads.runs.stream(
+            thread_id=d.thread.id,
+            assistant_id=d.assistant_id,
+            timeout=timeout,
+            **self.options
+        ) as stream:
+            for delta in stream.text_deltas:
+                if self.run_id is None:
+                    self.run_id = getattr(getattr(stream, 'current_run', None), 'id', None)
+                if self.cancelled:
+                    break
+                self.deltas.put(delta)
+
+    def discard(self):
+        """Undo the run, its reply and the message so the real turn starts from a clean thread."""
+        d = self.dispatcher
+        d.cancel_run(self.run_id)
+        try:
+            if self.run_id is not None:
+                # The run may have finished, or written part of a reply, before it was cancelled
+                replies = d.client.beta.threads.messages.list(thread_id=d.thread.id, run_id=self.run_id)
+                for reply in replies.data:
+                    d.client.beta.threads.messages.delete(thread_id=d.thread.id, message_id=reply.id)
+            d.client.beta.threads.messages.delete(thread_id=d.thread.id,
+                                                  message_id=self.message_id)
+        except Exception as e:
+            print(f"Could not remove speculative message: {e}")
+
+    def commit(self):
+        self.decided.set()
+
+    def cancel(self):
+        self.cancelled = True
+        self.decided.set()
+
+    def committed_deltas(self):
+        """Buffered deltas, then the rest of the run as it streams in."""
+        while True:
+            delta = self.deltas.get()
+            if delta is None:
+                return
+            yield delta
+
+class JitterBuffer:
+    """Puts sequence-numbered packets back in order and detects the ones that never came.
+
+    A missing packet is waited for until `delay_packets` later packets have
+    arrived (or `max_wait` seconds pass with later packets queued), then it is
+    reported lost. Packets older than the playout point are dropped as late,
+    unless they are so far behind it (more than `max_packets`) that the sender
+    must have restarted its sequence numbers; then the buffer resyncs to them.
+    """
+
+    LOST = object()
+
+    def __init__(self, delay_packets=3, max_wait=0.2, max_packets=200):
+        self.delay_packets = delay_packets
+        self.max_wait = max_wait
+        self.max_packets = max_packets
+        self.packets = {}
+        self.next_seq = None
+        self.skipped = 0  # Missing packets given up on, still to be reported LOST
+        self.waiting_since = None
+        self.closed = False
+        self.cond = threading.Condition()
+        self.received = 0
+        self.late = 0
+        self.duplicates = 0
+        self.lost = 0
+        self.overflows = 0
+        self.resyncs = 0
+
+    def put(self, seq, payload):
+        with self.cond:
+            self.received += 1
+            if self.next_seq is None:
+                self.next_seq = seq
+            if seq < self.next_seq - self.max_packets:
+                # The sender restarted; what is buffered belongs to the old stream
+                self.resyncs += 1
+                self.packets.clear()
+                self.next_seq = seq
+                self.skipped = 0
+                self.waiting_since = None
+            if seq < self.next_seq:
+                self.late += 1
+                return
+            if seq in self.packets:
+                self.duplicates += 1
+                return
+            if len(self.packets) >= self.max_packets:
+                # The consumer stalled; skip ahead rather than grow without bound
+                self.overflows += 1
+                if self.next_seq in self.packets:
+                    del self.packets[self.next_seq]
+                    self.next_seq += 1
+                else:
+                    # Give up on the gap (get() conceals it) instead of dropping a packet we have
+                    first = min(self.packets)
+                    self.skipped += first - self.next_seq
+                    self.next_seq = first
+                    self.waiting_since = None
+            self.packets[seq] = payload
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        """Next packet in sequence, LOST for a gap, or None if nothing is ready in time."""
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        with self.cond:
+            while not self.closed:
+                if self.skipped:
+                    self.skipped -= 1
+                    self.lost += 1
+                    return self.LOST
+                if self.next_seq in self.packets:
+                    self.waiting_since = None
+                    payload = self.packets.pop(self.next_seq)
+                    self.next_seq += 1
+                    return payload
+                if self.packets:
+                    now = time.perf_counter()
+                    if self.waiting_since is None:
+                        self.waiting_since = now
+                    if (len(self.packets) >= self.delay_packets
+                            or now - self.waiting_since >= self.max_wait):
+                        self.waiting_since = None
+                        self.lost += 1
+                        self.next_seq += 1
+                        return self.LOST
+                remaining = None if deadline is None else deadline - time.perf_counter()
+                if remaining is not None and remaining <= 0:
+                    return None
+                wait = self.max_wait if remaining is None else min(remaining, self.max_wait)
+                self.cond.wait(wait)
+            return None
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def stats(self):
+        with self.cond:
+            return {
+                'received': self.received,
+                'buffered': len(self.packets),
+                'late': self.late,
+                'duplicates': self.duplicates,
+                'lost': self.lost,
+                'overflows': self.overflows,
+                'resyncs': self.resyncs,
+            }
+
+class Resampler:
+    """Streaming int16 mono resampler: windowed-sinc low-pass, then linear interpolation.
+
+    State carries across calls, so feeding audio in arbitrary pieces gives the
+    same output as resampling it in one go.
+    """
+
+    def __init__(self, in_rate, out_rate, taps=31):
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.step = in_rate / out_rate
+        self.position = 0.0  # Input index of the next output sample, relative to `history`
+        self.history = np.zeros(0, dtype=np.float32)
+        self.kernel = None
+        if out_rate < in_rate:
+            cutoff = 0.45 * out_rate / in_rate  # Just under the new Nyquist, in cycles/sample
+            n = np.arange(taps) - (taps - 1) / 2
+            kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(taps)
+            self.kernel = (kernel / kernel.sum()).astype(np.float32)
+            self.filter_state = np.zeros(taps - 1, dtype=np.float32)
+
+    def process(self, samples):
+        x = np.asarray(samples, dtype=np.float32)
+        if self.in_rate == self.out_rate:
+            return np.asarray(samples, dtype=np.int16)
+        if self.kernel is not None:
+            padded = np.concatenate([self.filter_state, x])
+            x = np.convolve(padded, self.kernel, mode='valid')
+            self.filter_state = padded[len(padded) - len(self.filter_state):]
+
+        buf = np.concatenate([self.history, x])
+        last = len(buf) - 1
+        if last < self.position:
+            self.history = buf
+            return np.zeros(0, dtype=np.int16)
+        n_out = int((last - self.position) // self.step) + 1
+        pos = self.position + np.arange(n_out) * self.step
+        i = pos.astype(np.int64)
+        frac = (pos - i).astype(np.float32)
+        out = buf[i] * (1 - frac) + buf[np.minimum(i + 1, last)] * frac
+
+        # Keep the last input sample: the next output may interpolate from it
+        self.position += n_out * self.step - last
+        self.history = buf[last:]
+        return np.clip(np.round(out), -32768, 32767).astype(np.int16)
+
+class NetworkAudioSource:
+    """Audio source for a remote caller streaming PCM over Socket.IO (browser or SIP gateway).
+
+    push() takes binary int16 mono frames with sequence numbers at any sample
+    rate. run() replays them in order through a JitterBuffer, fills lost packets
+    with silence, resamples to the dispatcher's rate and hands fixed-size frames
+    to audio_callback, exactly like the microphone callback.
+    """
+
+    def __init__(self, jitter_packets=3, max_wait=0.2):
+        self.jitter = JitterBuffer(jitter_packets, max_wait)
+        self.resampler = None
+        self.last_packet_samples = 0
+        self.last_packet_rate = None
+        self.pending = np.zeros(0, dtype=np.int16)
+
+    def push(self, seq, pcm, sample_rate):
+        self.jitter.put(seq, (pcm, sample_rate))
+
+    def close(self):
+        self.jitter.close()
+
+    def samples(self, packet, target_rate):
+        """Resampled samples for one packet, or silence of the same length for a lost one."""
+        if packet is JitterBuffer.LOST:
+            if self.last_packet_rate is None:
+                return np.zeros(0, dtype=np.int16)
+            audio, rate = np.zeros(self.last_packet_samples, dtype=np.int16), self.last_packet_rate
+        else:
+            pcm, rate = packet
+            audio = np.frombuffer(pcm, dtype='<i2', count=len(pcm) // 2)
+            self.last_packet_samples, self.last_packet_rate = len(audio), rate
+        if self.resampler is None or self.resampler.in_rate != rate:
+            self.resampler = Resampler(rate, target_rate)
+        return self.resampler.process(audio)
+
+    def run(self, dispatcher):
+        chunk = dispatcher.chunk_samples
+        while dispatcher.call_in_progress:
+            packet = self.jitter.get(timeout=0.1)
+            if packet is None:
+                if self.jitter.closed:
+                    return
+                continue
+            self.pending = np.concatenate([self.pending,
+                                           self.samples(packet, dispatcher.sample_rate)])
+            while len(self.pending) >= chunk:
+                frame, self.pending = self.pending[:chunk], self.pending[chunk:]
+                dispatcher.audio_callback(frame.reshape(-1, 1), chunk, None, None)
+
+    def stats(self):
+        return self.jitter.stats()
+
+# Your existing EmergencyDispatcher class here
+class EmergencyDispatcher:
+    def __init__(self, call_id=None, client=None, audio_source=None):
+        self.call_id = call_id
+        self.audio_source = audio_source  # None means the local microphone
+
+        # Initialize OpenAI client
+        self.client = client or OpenAI(api_key=OPENAI_API_KEY, **OPENAI_CLIENT_OPTIONS)
+        self.assistant_id = ASSISTANT_ID
+        self.thread = self.client.beta.threads.create()
+        
+        # Audio parameters
+        self.sample_rate = 16000
+        self.channels = 1
+        self.chunk_duration = 0.05  # 100ms chunks for speech detection
+        self.chunk_samples = int(self.sample_rate * self.chunk_duration)
+        
+        # Speech detection parameters
+        self.speech_threshold = 700  # Only used by the 'threshold' VAD engine
+        self.silence_duration = 1.5  # Longest trailing silence before a turn ends
+        self.vad_engine = 'adaptive'  # 'adaptive' or 'threshold'
+        if self.vad_engine == 'threshold':
+            self.vad = ThresholdVAD(self.chunk_duration, self.silence_duration, self.speech_threshold)
+        else:
+            self.vad = AdaptiveVAD(self.sample_rate, self.chunk_duration, self.silence_duration)
+        self.min_audio_length = 0.05  # Minimum audio length to process
+        self.max_utterance_duration = 15.0  # Force a segment after this many seconds of speech
+        self.preroll_duration = 0.3  # Audio kept from before speech onset
+        self.is_recording = False
+        self.utterance_start = None  # Ring buffer position where the current utterance began
+
+        # Room for a maximum-length utterance plus pre-roll while the previous one is transcribed
+        ring_seconds = 2 * (self.max_utterance_duration + self.preroll_duration)
+        self.ring = AudioRingBuffer(int(ring_seconds * self.sample_rate))
+        
+        # State management
+        self.call_in_progress = True
+        self.cleaned_up = False  # end_call and run()'s finally both clean up
+        self.cleanup_lock = threading.Lock()
+        self.current_address = None
+        self.address_tracker = AddressTracker()
+        self.incident = IncidentState()
+        self.incident_sent = {}  # Incident fields as last sent to the dashboard
+        self.upload_format = 'wav'  # 'flac' cuts upload size roughly in half when soundfile is installed
+
+        # Response handling
+        self.tts_voice = "shimmer"
+        self.hold_interval = 10.0  # Longest the hold phrase repeats while TTS is down
+        self.hold_played_at = None
+        self.player = self.make_player()
+        self.attached_at = time.perf_counter() if call_id is not None else None
+        self.stream_responses = True  # Stream assistant tokens instead of polling the run
+
+        # Processing pipeline: capture -> segmenter -> transcription -> dialogue -> TTS
+        self.frame_queue = StageQueue('frames', maxsize=200)  # ~10 s of 50 ms frames
+        self.utterance_queue = StageQueue('utterances', maxsize=8)
+        self.transcript_queue = StageQueue('transcripts', maxsize=8)
+        self.tts_queue = StageQueue('tts', maxsize=32)
+        self.transcription_workers = 2
+        self.utterance_seq = 0
+        self.utterances_done = 0
+        self.speaking = False
+        self.input_overflows = 0
+        self.pipeline_threads = []
+        self.tts_thread = None
+        self.metrics = StageMetrics(parent=stage_metrics)
+
+        # Speculative turns: transcribe and start the run after a short pause, commit at turn end
+        self.speculative_turns = True  # Requires stream_responses
+        self.speculation_pause = 0.35
+        self.speculation = None
+        self.speculations = collections.Counter()
+        self.run_lock = threading.Lock()  # Serializes runs on the assistant thread
+
+        # Barge-in: the caller can talk over the dispatcher and stop playback
+        self.barge_in_enabled = True
+        self.echo_gate = EchoGate()
+        self.spoken = None  # Sentences of the current reply as far as they were heard
+        self.reply_interrupted = False
+        self.barge_in_at = None
+        self.barge_ins = 0
+
+        # Long calls: read only new messages and keep the model's context bounded
+        self.message_cursor = None  # Id of the last thread message read
+        self.caller_turns = []
+        self.compact_after_turns = 8  # None disables compaction
+        self.context_messages = 6  # Latest messages sent with each run once compacted
+        self.compactions = 0
+
+        # API requests queue for shared capacity by the call's priority and how long the caller has waited
+        self.waiting_since = None  # When the turn being answered ended
+
+    def make_player(self):
+        if isinstance(self.audio_source, NetworkAudioSource):
+            # Remote callers hear the dispatcher over the connection their audio arrives on
+            return NetworkPlayer(self.call_id, TTS_SAMPLE_RATE)
+        return AudioPlayer(TTS_SAMPLE_RATE)
+
+    def attach(self, call_id, audio_source=None):
+        """Bind a pre-warmed dispatcher to an incoming call."""
+        self.call_id = call_id
+        self.audio_source = audio_source
+        self.player = self.make_player()
+        self.attached_at = time.perf_counter()
+
+    def slot(self, endpoint, since=None):
+        """Wait for the scheduler to grant this call a request on `endpoint`."""
+        return scheduler.slot(endpoint, self.incident.priority(), since)
+
+    def detect_speech(self, audio_data):
+        """Detect if audio contains speech using the configured VAD engine."""
+        return self.vad.is_speech(audio_data)
+
+    def audio_callback(self, indata, frames, time_info, status):
+        """PortAudio callback. Writes the frame into the ring buffer and notifies the segmenter."""
+        if status:
+            if status.input_overflow:
+                self.input_overflows += 1
+            print(f"Audio status: {status}")
+        if self.attached_at is not None:
+            self.metrics.observe('pickup', time.perf_counter() - self.attached_at)
+            self.attached_at = None
+        start = self.ring.total
+        end = self.ring.write(indata.reshape(-1))
+        self.frame_queue.put_nowait((start, end))
+
+    def segment_worker(self):
+        """Pipeline stage: run speech detection on captured frames and cut utterances."""
+        preroll_samples = int(self.preroll_duration * self.sample_rate)
+        max_samples = int(self.max_utterance_duration * self.sample_rate)
+        last_end = 0
+
+        while self.call_in_progress:
+            frame = self.frame_queue.get(timeout=0.1)
+            if frame is None:
+                continue
+            start, end = frame
+            if not self.ring.is_valid(start):
+                continue  # Segmenter fell a full buffer behind; this frame was overwritten
+            indata = self.ring.view(start, end)
+
+            with self.metrics.span('vad'):
+                reference = self.player.reference_db() if self.barge_in_enabled else None
+                level = level_db(indata)
+                suppress = not self.echo_gate.passes(level, reference)
+                event = self.vad.update(indata, suppress)
+            if self.call_id is not None:
+                event_hub.coalesce(self.call_id, 'level', round(level))
+            if self.speculation is not None and event is None and not self.vad.silence_frames:
+                self.cancel_speculation()  # The caller kept talking
+            if event == 'onset':
+                print("Speech detected - starting recording...")
+                if self.barge_in_enabled and reference is not None:
+                    self.barge_in()
+                self.is_recording = True
+                # The VAD needs a few frames to confirm onset; reach back past them
+                onset = start - (self.vad.onset_frames - 1) * len(indata) - preroll_samples
+                self.utterance_start = max(onset, last_end, self.ring.oldest)
+
+            if not self.is_recording:
+                continue
+
+            if event == 'end':
+                print("Silence detected - queueing speech for transcription...")
+                self.metrics.observe('endpoint', self.vad.endpoint_duration())
+                self.queue_utterance(end)
+                self.is_recording = False
+                self.utterance_start = None
+                last_end = end
+            elif end - self.utterance_start >= max_samples:
+                print("Maximum utterance length reached - segmenting...")
+                self.cancel_speculation()
+                self.queue_utterance(end)
+                self.utterance_start = end
+                last_end = end
+            elif self.should_speculate():
+                self.speculation = SpeculativeTurn(self, self.utterance_start, end)
+                self.speculations['started'] += 1
+                self.speculation.thread.start()
+
+    def barge_in(self):
+        """The caller started talking over playback: stop it and drop queued sentences."""
+        self.barge_in_at = time.perf_counter()
+        self.player.stop()
+        while self.tts_queue.get(timeout=0) is not None:
+            pass
+        self.barge_ins += 1
+        if self.spoken is not None:
+            self.reply_interrupted = True
+        self.emit('barge_in', {'timestamp': time.strftime('%H:%M:%S')})
+
+    def record_interrupted_reply(self):
+        """Replace an interrupted reply in the thread with what the caller actually heard.
+
+        Must be called with run_lock held, before the next message is added.
+        """
+        if not self.reply_interrupted:
+            return
+        self.reply_interrupted = False
+        heard = ' '.join(self.spoken or []).strip()
+        try:
+            messages = self.client.beta.threads.messages.list(thread_id=self.thread.id, limit=1)
+            if messages.data and messages.data[0].role == 'assistant':
+                self.client.beta.threads.messages.delete(thread_id=self.thread.id,
+                                                         message_id=messages.data[0].id)
+                if self.message_cursor == messages.data[0].id:
+                    self.message_cursor = None
+            if heard:
+                self.client.beta.threads.messages.create(
+                    thread_id=self.thread.id,
+                    role="assistant",
+                    content=f"{heard} [interrupted by the caller]"
+                )
+        except Exception as e:
+            print(f"Error recording interrupted reply: {e}")
+
+    def begin_reply(self):
+        self.spoken = []
+        self.player.resume()
+
+    def should_speculate(self):
+        """True during a pause long enough to start work, once earlier turns are answered."""
+        pause = self.vad.silence_frames * self.chunk_duration
+        return (self.speculative_turns and self.stream_responses and self.speculation is None
+                and pause >= self.speculation_pause
+                and pause < self.vad.endpoint_duration()
+                and self.utterances_done == self.utterance_seq)
+
+    def cancel_speculation(self):
+        if self.speculation is not None:
+            self.speculation.cancel()
+            self.speculation = None
+            self.speculations['cancelled'] += 1
+
+    def queue_utterance(self, end):
+        """Hand a zero-copy view of the utterance ending at `end` to the transcription stage."""
+        view = self.ring.view(self.utterance_start, end)
+        ended = time.perf_counter()
+        self.archive_audio(view)
+        # Only silence followed the speculative audio, so its work stands for the whole turn
+        speculation, self.speculation = self.speculation, None
+        if speculation is not None:
+            speculation.commit()
+            self.speculations['committed'] += 1
+            self.metrics.observe('speculation_head_start', ended - speculation.started)
+        self.utterance_queue.put((self.utterance_seq, self.utterance_start, view, ended,
+                                  speculation))
+        self.utterance_seq += 1
+
+    def current_utterance(self):
+        """View of the utterance being recorded, or None if the caller is not speaking."""
+        if not self.is_recording or self.utterance_start is None:
+            return None
+        return self.ring.view(self.utterance_start, self.ring.total)
+
+    def transcription_worker(self):
+        """Pipeline stage: transcribe utterances. Several of these run in parallel."""
+        while self.call_in_progress:
+            item = self.utterance_queue.get(timeout=0.1)
+            if item is None:
+                continue
+            seq, start, audio_data, ended, speculation = item
+            if speculation is not None:
+                speculation.ready.wait()
+                transcript = speculation.transcript
+            else:
+                transcript = self.transcribe(audio_data, since=ended)
+                if not self.ring.is_valid(start):
+                    # The view was overwritten while it was being encoded
+                    print("Dropped utterance overwritten in the capture buffer")
+                    transcript = None
+            self.transcript_queue.put((seq, transcript, ended, speculation))
+
+    def dialogue_worker(self):
+        """Pipeline stage: feed transcripts to the assistant in the order they were spoken."""
+        pending = {}
+        next_seq = 0
+        while self.call_in_progress:
+            item = self.transcript_queue.get(timeout=0.1)
+            if item is None:
+                continue
+            seq, transcript, ended, speculation = item
+            pending[seq] = (transcript, ended, speculation)
+            while next_seq in pending:
+                transcript, ended, speculation = pending.pop(next_seq)
+                next_seq += 1
+                if transcript:
+                    print(f"Caller: {transcript}")
+                    self.waiting_since = ended
+                    self.handle_input(transcript, speculation)
+                    # End of caller speech to the end of the dispatcher's reply
+                    self.metrics.observe('turn', time.perf_counter() - ended)
+                    self.emit_metrics()
+                self.utterances_done = next_seq
+
+    def start_pipeline(self):
+        """Start the segmenter, transcription, dialogue and TTS worker threads."""
+        workers = [self.segment_worker, self.dialogue_worker]
+        workers += [self.transcription_worker] * self.transcription_workers
+        for target in workers:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.pipeline_threads.append(thread)
+
+        self.tts_thread = threading.Thread(target=self.tts_worker, daemon=True)
+        self.tts_thread.start()
+        self.pipeline_threads.append(self.tts_thread)
+
+    def pipeline_idle(self):
+        """True once every captured utterance has been answered and spoken."""
+        return (not self.is_recording and self.utterances_done == self.utterance_seq
+                and self.frame_queue.queue.empty() and self.tts_queue.queue.empty()
+                and not self.speaking)
+
+    def pipeline_stats(self):
+        """Queue depths and overflow counters for each pipeline stage."""
+        return {
+            'input_overflows': self.input_overflows,
+            'frames': self.frame_queue.stats(),
+            'utterances': self.utterance_queue.stats(),
+            'transcripts': self.transcript_queue.stats(),
+            'tts': self.tts_queue.stats(),
+            'speculation': dict(self.speculations),
+            'barge_ins': self.barge_ins,
+            'compacted_runs': self.compactions,
+            'echo_gated_frames': self.echo_gate.gated,
+            'ingest': (self.audio_source.stats()
+                       if isinstance(self.audio_source, NetworkAudioSource) else None),
+            'latency': self.metrics.snapshot(),
+        }
+
+    def record_and_process(self):
+        """Capture audio from the microphone (or the configured source) into the pipeline."""
+        if self.audio_source is not None:
+            self.audio_source.run(self)
+            return
+
+        try:
+            with sd.InputStream(
+                channels=self.channels,
+                samplerate=self.sample_rate,
+                blocksize=self.chunk_samples,
+                callback=self.audio_callback,
+                dtype=np.int16
+            ):
+                print("Listening for speech...")
+                while self.call_in_progress:
+                    time.sleep(0.1)
+        except Exception as e:
+            print(f"Error in audio stream: {e}")
+
+    def transcribe(self, audio_data, since=None):
+        """Transcribe one utterance with Whisper. Returns None if there was nothing to transcribe.
+
+        `since` is when the caller started waiting on it, for the scheduler.
+        """
+        duration = len(audio_data) / self.sample_rate
+
+        # Only process if audio is long enough
+        if duration < self.min_audio_length:
+            return None
+
+        try:
+            # Build the upload body in memory straight from the capture buffer
+            with self.metrics.span('encode'):
+                filename, body, mime_type = encode_audio(audio_data, self.sample_rate,
+                                                         self.channels, self.upload_format)
+
+            # Transcribe (deadline, hedged on slow responses; nothing to say if Whisper is down)
+            with self.slot('transcribe', since), self.metrics.span('transcribe'):
+                transcript = call_policy.call('transcribe', lambda timeout: self.client.audio.transcriptions.create(
+                    model="whisper-1",
+                    file=(filename, body, mime_type),
+                    response_format="text",
+                    timeout=timeout
+                ), fallback=lambda: None)
+
+            if transcript and transcript.strip():
+                return transcript
+        except Exception as e:
+            print(f"Error processing recorded speech: {e}")
+        return None
+
+    def process_recorded_speech(self):
+        """Transcribe the utterance being recorded and respond, bypassing the worker stages."""
+        audio_data = self.current_utterance()
+        if audio_data is None or not len(audio_data):
+            return
+
+        transcript = self.transcribe(audio_data)
+        if transcript:
+            print(f"Caller: {transcript}")
+            self.handle_input(transcript)
+
+    def text_to_speech(self, text):
+        """Convert text to speech using OpenAI's TTS, playing audio as it streams in.
+
+        Returns the fraction of `text` played before a barge-in (1.0 if all of it).
+        """
+        if self.player.interrupted.is_set():
+            return 0.0
+        cached = phrase_cache.get(self.tts_voice, text)
+        if cached is not None:
+            with self.metrics.span('playback'):
+                played = self.player.write(cached)
+            if played < len(cached):
+                self.observe_barge_in()
+            return played / len(cached) if cached else 1.0
+
+        played = 0
+        try:
+            chunks = []
+            playback = 0.0
+            with self.slot('tts', self.waiting_since):
+                start = time.perf_counter()
+                with call_policy.guard('tts') as timeout, self.client.audio.speech.with_streaming_response.create(
+                    model="tts-1",
+                    voice=self.tts_voice,
+                    input=text,
+                    response_format="pcm",  # Raw 24 kHz 16-bit mono, playable as it arrives
+                    timeout=timeout
+                ) as response:
+                    for chunk in response.iter_bytes(TTS_CHUNK_BYTES):
+                        if not chunks:
+                            self.metrics.observe('tts_first_chunk', time.perf_counter() - start)
+                        write_start = time.perf_counter()
+                        written = self.player.write(chunk)
+                        playback += time.perf_counter() - write_start
+                        played += written
+                        chunks.append(chunk)
+                        if written < len(chunk) and self.player.interrupted.is_set():
+                            self.observe_barge_in()
+                            # Total length is unknown mid-stream; estimate from the speaking rate
+                            heard = played / (2 * TTS_SAMPLE_RATE) * SPOKEN_CHARS_PER_SECOND
+                            return min(heard / max(len(text), 1), 1.0)
+            # Playback blocks the stream, so split the time into waiting on synthesis and playing
+            self.metrics.observe('tts_synthesis', time.perf_counter() - start - playback)
+            self.metrics.observe('playback', playback)
+            phrase_cache.put(self.tts_voice, text, b''.join(chunks))
+
+        except Exception as e:
+            print(f"Text-to-speech error: {e}")
+            hold = self.hold_phrase() if not played else None
+            if hold is not None:
+                self.player.write(hold)
+        return 1.0
+
+    def hold_phrase(self):
+        """Speech to play when TTS is failing (e.g. its breaker is open): the stock hold
+        phrase, if it was rendered while the endpoint was up, at most every `hold_interval` s."""
+        now = time.perf_counter()
+        if self.hold_played_at is not None and now - self.hold_played_at < self.hold_interval:
+            return None
+        pcm = phrase_cache.get(self.tts_voice, TECHNICAL_DIFFICULTIES)
+        if pcm is not None:
+            self.hold_played_at = now
+        return pcm
+
+    def observe_barge_in(self):
+        """Record how long playback took to stop after the caller started talking."""
+        if self.barge_in_at is not None and self.player.stopped_at >= self.barge_in_at:
+            self.metrics.observe('barge_in', self.player.stopped_at - self.barge_in_at)
+            self.barge_in_at = None
+
+    def prewarm_phrases(self, phrases=(GREETING, TECHNICAL_DIFFICULTIES)):
+        """Synthesize stock phrases into the phrase cache without playing them."""
+        for text in phrases:
+            if phrase_cache.get(self.tts_voice, text) is not None:
+                continue
+            try:
+                # Warming the cache must never hold up a live call
+                with scheduler.slot('tts', 'background'):
+                    response = call_policy.call('tts_render', lambda timeout: self.client.audio.speech.create(
+                        model="tts-1",
+                        voice=self.tts_voice,
+                        input=text,
+                        response_format="pcm",
+                        timeout=timeout
+                    ))
+                phrase_cache.put(self.tts_voice, text, response.content)
+            except Exception as e:
+                print(f"Error prewarming phrase cache: {e}")
+
+    def run(self):
+        """Main method to run the dispatcher."""
+        try:
+            call_archive.record_event(self.call_id, 'call_start', {})
+            self.start_pipeline()
+
+            # Greet through the TTS stage so capture starts at once; the echo gate
+            # keeps the greeting out of the VAD and the caller can talk over it
+            self.speak(GREETING)
+            threading.Thread(target=self.prewarm_phrases, daemon=True).start()
+            
+            # Start recording and processing
+            self.record_and_process()
+
+        except KeyboardInterrupt:
+            print("\nEmergency dispatcher shutting down...")
+        finally:
+            self.cleanup()
+
+    def cleanup(self):
+        """Clean up resources. Only the first call does anything."""
+        with self.cleanup_lock:
+            if self.cleaned_up:
+                return
+            self.cleaned_up = True
+        self.call_in_progress = False
+        if isinstance(self.audio_source, NetworkAudioSource):
+            self.audio_source.close()
+        self.cancel_speculation()
+        for stage in (self.frame_queue, self.utterance_queue, self.transcript_queue, self.tts_queue):
+            stage.close()
+        self.player.close()
+        unit_roster.release(self.call_id)
+        call_archive.record_event(self.call_id, 'call_end', {})
+    
+    def emit(self, event, data):
+        """Emit a Socket.IO event to this call's room, archiving the ones worth keeping."""
+        event_hub.emit(self.call_id, event, data)
+        if event in ARCHIVED_EVENTS:
+            call_archive.record_event(self.call_id, event, data)
+
+    def archive_audio(self, samples):
+        """Archive an utterance that just ended."""
+        now = time.time()
+        call_archive.record_audio(self.call_id, samples, now - len(samples) / self.sample_rate, now)
+
+    def publish_incident(self):
+        """Queue the incident fields that changed since the last update for the next frame."""
+        incident = self.incident.to_dict()
+        delta = {key: value for key, value in incident.items()
+                 if self.incident_sent.get(key) != value}
+        if delta:
+            self.incident_sent = incident
+            event_hub.coalesce(self.call_id, 'incident', delta)
+            call_archive.record_event(self.call_id, 'incident_update', delta)
+
+    def emit_metrics(self):
+        """Push this call's stage latencies to the dashboard."""
+        if self.metrics.enabled:
+            self.emit('metrics_update', {'stages': self.metrics.snapshot()})
+
+    def speak(self, text):
+        """Queue text for the TTS worker, or speak it inline if no worker is running."""
+        if self.tts_thread is not None and self.tts_thread.is_alive():
+            self.tts_queue.put(text)
+        else:
+            self.text_to_speech(text)
+
+    def tts_worker(self):
+        """Pipeline stage: speak queued sentences in order until the call ends."""
+        while self.call_in_progress:
+            text = self.tts_queue.get(timeout=0.1)
+            if text is not None:
+                self.speaking = True
+                fraction = self.text_to_speech(text)
+                if self.spoken is not None and fraction > 0:
+                    self.spoken.append(text if fraction >= 1 else heard_prefix(text, fraction))
+                self.speaking = self.tts_queue.queue.qsize() > 0
+
+    def stream_response(self):
+        """Stream the assistant's reply, pushing partial text to the frontend and
+        speaking each sentence as soon as it is complete."""
+        options = self.run_options()
+        with self.metrics.span('run'), call_policy.guard('run') as timeout, self.client.beta.threads.runs.stream(
+            thread_id=self.thread.id,
+            assistant_id=self.assistant_id,
+            timeout=timeout,
+            **options
+        ) as stream:
+            if options:
+                self.compactions += 1
+            response = self.relay_deltas(stream.text_deltas)
+            if self.player.interrupted.is_set():
+                self.cancel_run(getattr(getattr(stream, 'current_run', None), 'id', None))
+            return response
+
+    def cancel_run(self, run_id, timeout=2.0):
+        """Cancel a run and wait briefly for it to stop so the thread accepts new messages."""
+        if run_id is None:
+            return
+        try:
+            self.client.beta.threads.runs.cancel(thread_id=self.thread.id, run_id=run_id)
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                run = self.client.beta.threads.runs.retrieve(thread_id=self.thread.id,
+                                                             run_id=run_id)
+                if run.status in ('cancelled', 'completed', 'failed', 'expired'):
+                    return
+                time.sleep(0.1)
+        except Exception:
+            pass  # Usually already completed
+
+    def relay_deltas(self, deltas):
+        """Emit each text delta as a partial message and speak completed sentences."""
+        splitter = SentenceSplitter()
+        parts = []
+        start = time.perf_counter()
+        for delta in deltas:
+            if self.player.interrupted.is_set():
+                break  # The caller barged in; don't queue the rest of the reply
+            if not parts:
+                self.metrics.observe('first_token', time.perf_counter() - start)
+            parts.append(delta)
+            event_hub.coalesce(self.call_id, 'tokens', delta)
+            for sentence in splitter.feed(delta):
+                self.speak(sentence)
+
+        remainder = splitter.flush()
+        if remainder:
+            self.speak(remainder)
+        return ''.join(parts)
+
+    def poll_response(self):
+        """Create a run and poll until it completes. Used when streaming is disabled."""
+        run_start = time.perf_counter()
+        options = self.run_options()
+        with call_policy.guard('run') as timeout:
+            run = self.client.beta.threads.runs.create(
+                thread_id=self.thread.id,
+                assistant_id=self.assistant_id,
+                timeout=timeout,
+                **options
+            )
+        if options:
+            self.compactions += 1
+
+        start_time = time.time()
+        while time.time() - start_time < 30:
+            run_status = call_policy.call('run_poll', lambda timeout: self.client.beta.threads.runs.retrieve(
+                thread_id=self.thread.id,
+                run_id=run.id,
+                timeout=timeout
+            ))
+            if run_status.status == 'completed':
+                self.metrics.observe('run', time.perf_counter() - run_start)
+                with self.metrics.span('messages_list'):
+                    replies = call_policy.call('messages_list',
+                                               lambda timeout: self.fetch_run_messages(run.id, timeout))
+                if not replies:
+                    return None
+                response = '\n'.join(replies)
+                self.speak(response)
+                return response
+            time.sleep(0.5)
+        return None
+
+    def fetch_run_messages(self, run_id, timeout=None):
+        """Text of the assistant messages `run_id` created, read forward from the cursor.
+
+        Only the run's own messages are fetched, so the cost does not grow with
+        the length of the call.
+        """
+        params = {'thread_id': self.thread.id, 'run_id': run_id, 'order': 'asc'}
+        if self.message_cursor is not None:
+            params['after'] = self.message_cursor
+        if timeout is not None:
+            params['timeout'] = timeout
+        page = self.client.beta.threads.messages.list(**params)
+        replies = []
+        for msg in page.data:
+            self.message_cursor = msg.id
+            if msg.role == "assistant":
+                replies.extend(part.text.value for part in msg.content if part.type == 'text')
+        return replies
+
+    def run_options(self):
+        """Extra run parameters. Once the call is long, the context is compacted: only the
+        latest messages are sent, and the earlier ones are replaced by a structured summary."""
+        if self.compact_after_turns is None or len(self.caller_turns) <= self.compact_after_turns:
+            return {}
+        return {
+            'truncation_strategy': {'type': 'last_messages',
+                                    'last_messages': self.context_messages},
+            'additional_instructions': self.incident_summary(),
+        }
+
+    def incident_summary(self):
+        """Structured summary of the call so far, standing in for turns outside the context."""
+        incident = self.incident.to_dict()
+        lines = ["Summary of this call so far (earlier turns are no longer shown):"]
+        for label, key in (("Emergency type", 'type'), ("Problem", 'problem'),
+                           ("Victim status", 'victim_status'), ("Location", 'location'),
+                           ("Severity", 'severity')):
+            if incident.get(key):
+                lines.append(f"- {label}: {incident[key]}")
+        if incident.get('coordinates'):
+            lat, lon = incident['coordinates']
+            lines.append(f"- Coordinates: {lat:.5f}, {lon:.5f}")
+        if incident.get('key_details'):
+            lines.append(f"- Key details: {', '.join(incident['key_details'])}")
+        if incident.get('units'):
+            lines.append(f"- Units required: {', '.join(incident['units'])}")
+        dispatched = unit_roster.assigned(self.call_id)
+        if dispatched:
+            lines.append(f"- Units dispatched: {', '.join(dispatched)}")
+        in_context = self.context_messages // 2  # Roughly half the messages shown are the caller's
+        earlier = list(self.caller_turns)[:-in_context] if in_context else list(self.caller_turns)
+        if earlier:
+            lines.append("- Caller said earlier: " + " / ".join(earlier)[-600:])
+        return '\n'.join(lines)
+
+    def locate(self, address):
+        """Geocode the caller's address off the dialogue path and publish it."""
+        result = get_geocoder().geocode(address)
+        if result is None or address != self.current_address:
+            return
+        self.incident.coordinates = [result['lat'], result['lon']]
+        self.emit('location_update', {
+            'address': address,
+            'lat': result['lat'],
+            'lon': result['lon'],
+        })
+        self.dispatch_units()
+
+    def dispatch_units(self):
+        """Assign the nearest available units the incident still needs and publish them."""
+        recommendations = unit_roster.recommend(self.incident.to_dict(), call_id=self.call_id)
+        if recommendations:
+            self.emit('dispatch_update', {'units': recommendations})
+
+    def handle_input(self, text, speculation=None):
+        """Handle transcribed input and get AI response.
+
+        With a committed `speculation`, the message is already on the thread and
+        the run already started; its buffered reply is relayed instead.
+        """
+        if not text:
+            return
+
+        try:
+            # Emit transcript update
+            self.emit('transcript_update', {
+                'role': 'caller',
+                'message': text,
+                'timestamp': time.strftime('%H:%M:%S')
+            })
+
+            self.caller_turns.append(text)
+            changed = self.incident.update(text)
+            address = self.address_tracker.update(text)
+            if address:
+                self.current_address = address
+                self.incident.location = address
+                self.incident.coordinates = None
+                changed = True
+                geocode_executor.submit(self.locate, address)
+            if changed:
+                self.publish_incident()
+                if self.incident.coordinates:
+                    self.dispatch_units()
+
+            if speculation is not None:
+                self.begin_reply()
+                response = self.relay_deltas(speculation.committed_deltas())
+                speculation.thread.join()
+                if speculation.failed:
+                    speculation = None  # Its message was removed; answer the normal way
+                elif speculation.options:
+                    self.compactions += 1
+            if speculation is None:
+                with self.run_lock, self.slot('assistant', self.waiting_since):
+                    self.record_interrupted_reply()
+                    self.begin_reply()
+                    with self.metrics.span('messages_create'):
+                        call_policy.call('messages', lambda timeout: self.client.beta.threads.messages.create(
+                            thread_id=self.thread.id,
+                            role="user",
+                            content=text,
+                            timeout=timeout
+                        ))
+
+                    if self.stream_responses:
+                        response = self.stream_response()
+                    else:
+                        response = self.poll_response()
+
+            if response:
+                print(f"Dispatcher: {response}")
+                # Emit the complete dispatcher response
+                self.emit('transcript_update', {
+                    'role': 'dispatcher',
+                    'message': response,
+                    'partial': False,
+                    'timestamp': time.strftime('%H:%M:%S')
+                })
+
+        except Exception as e:
+            print(f"Error handling input: {e}")
+            self.speak(self.canned_reply())
+
+    def canned_reply(self):
+        """What to say when the assistant can't answer: confirm what is known and hold the caller."""
+        if self.incident.location:
+            return (f"I have your location as {self.incident.location}. "
+                    "Help is being arranged. Stay on the line.")
+        return TECHNICAL_DIFFICULTIES
+
+def heard_prefix(text, fraction):
+    """The words of `text` spoken in the first `fraction` of its audio."""
+    cut = int(len(text) * fraction)
+    words = text[:cut].rsplit(' ', 1)[0] if ' ' in text[:cut] else ''
+    return words + '...' if words else ''
+
+class SentenceSplitter:
+    """Split streamed text into complete sentences as the deltas arrive."""
+
+    # Abbreviations that end with a period but do not end a sentence
+    ABBREVIATIONS = {'st', 'ave', 'rd', 'blvd', 'dr', 'ln', 'mr', 'mrs', 'ms', 'apt'}
+    # Words that are abbreviations only when a number follows ("No. 5", but "No. Stay put.")
+    NUMBER_ABBREVIATIONS = {'no'}
+
+    def __init__(self):
+        self.buffer = ''
+
+    def feed(self, delta):
+        """Add a text delta and return any sentences it completed."""
+        self.buffer += delta
+        sentences = []
+        start = 0
+        for i, ch in enumerate(self.buffer):
+            if ch not in '.!?' or i + 1 >= len(self.buffer) or not self.buffer[i + 1].isspace():
+                continue
+            if ch == '.':
+                words = self.buffer[start:i].split()
+                word = words[-1].lower() if words else ''
+                if word in self.ABBREVIATIONS:
+                    continue
+                if word in self.NUMBER_ABBREVIATIONS:
+                    following = self.buffer[i + 1:].lstrip()
+                    if not following:
+                        break  # Wait for the next delta to tell
+                    if following[0].isdigit():
+                        continue
+            sentence = self.buffer[start:i + 1].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = i + 1
+        self.buffer = self.buffer[start:]
+        return sentences
+
+    def flush(self):
+        """Return whatever text is left once the stream has ended."""
+        remainder, self.buffer = self.buffer.strip(), ''
+        return remainder
+
+class CallSessionManager:
+    """Keep one EmergencyDispatcher per call and run them on a bounded worker pool."""
+
+    def __init__(self, max_sessions=MAX_CONCURRENT_CALLS, dispatcher_factory=None):
+        self.max_sessions = max_sessions
+        self.dispatcher_factory = dispatcher_factory or EmergencyDispatcher
+        # One worker per admitted call, so at most max_sessions calls run at once
+        self.executor = ThreadPoolExecutor(max_workers=max_sessions,
+                                           thread_name_prefix="call")
+        self.sessions = {}
+        self.ended = set()  # Reserved calls ended while their dispatcher was being built
+        self.lock = threading.Lock()
+        self.calls_started = 0
+        self.calls_rejected = 0
+
+    def start_call(self, call_id, **options):
+        """Admit a new call and start its dispatcher. Returns None if at capacity.
+
+        `options` are passed to the dispatcher factory (e.g. `audio_source`).
+        If the call is ended while its dispatcher is being built, the dispatcher
+        is cleaned up instead of run.
+        """
+        with self.lock:
+            if call_id in self.sessions:
+                return self.sessions[call_id]
+            if len(self.sessions) >= self.max_sessions:
+                self.calls_rejected += 1
+                return None
+            # Reserve the slot before the (slow) dispatcher construction
+            self.sessions[call_id] = None
+
+        try:
+            dispatcher = self.dispatcher_factory(call_id=call_id, **options)
+        except Exception as e:
+            print(f"Error starting call {call_id}: {e}")
+            with self.lock:
+                self.sessions.pop(call_id, None)
+                self.ended.discard(call_id)
+            return None
+
+        with self.lock:
+            ended = call_id in self.ended
+            if ended:
+                self.ended.discard(call_id)
+                del self.sessions[call_id]
+            else:
+                self.sessions[call_id] = dispatcher
+                self.calls_started += 1
+        if ended:
+            dispatcher.cleanup()
+            return dispatcher
+        future = self.executor.submit(dispatcher.run)
+        future.add_done_callback(lambda _: self._release(call_id, dispatcher))
+        return dispatcher
+
+    def end_call(self, call_id):
+        """Stop the call's dispatcher. Returns False if the call is unknown."""
+        with self.lock:
+            if call_id not in self.sessions:
+                return False
+            dispatcher = self.sessions[call_id]
+            if dispatcher is None:
+                self.ended.add(call_id)  # Still being built; start_call ends it
+                return True
+        dispatcher.cleanup()
+        return True
+
+    def get(self, call_id):
+        with self.lock:
+            return self.sessions.get(call_id)
+
+    def _release(self, call_id, dispatcher):
+        with self.lock:
+            if self.sessions.get(call_id) is dispatcher:
+                del self.sessions[call_id]
+
+    def stats(self):
+        with self.lock:
+            return {
+                'active_calls': len(self.sessions),
+                'max_calls': self.max_sessions,
+                'calls_started': self.calls_started,
+                'calls_rejected': self.calls_rejected,
+                'pipelines': {call_id: d.pipeline_stats()
+                              for call_id, d in self.sessions.items() if d is not None},
+            }
+
+    def shutdown(self):
+        """End every call and stop the worker pool."""
+        with self.lock:
+            dispatchers = [d for d in self.sessions.values() if d is not None]
+            self.ended.update(call_id for call_id, d in self.sessions.items() if d is None)
+        for dispatcher in dispatchers:
+            dispatcher.cleanup()
+        self.executor.shutdown(wait=False)
+
+class SessionPool:
+    """Pre-built dispatcher sessions, so a call does not wait for client, thread and greeting setup.
+
+    All sessions share one OpenAI client, whose connections are kept warm by a
+    periodic lightweight request. A background thread keeps `size` idle
+    sessions ready; acquire() falls back to building one inline if the pool is
+    empty or was never started.
+    """
+
+    def __init__(self, size=SESSION_POOL_SIZE, dispatcher_factory=None, client=None,
+                 keepalive_interval=20.0):
+        self.size = size
+        self.dispatcher_factory = dispatcher_factory or EmergencyDispatcher
+        self.client = client
+        self.keepalive_interval = keepalive_interval
+        self.idle = collections.deque()
+        self.lock = threading.Lock()
+        self.wanted = threading.Event()
+        self.running = False
+        self.thread = None
+        self.hits = 0
+        self.misses = 0
+
+    def start(self):
+        """Fill the pool in the background and keep it full."""
+        if self.running:
+            return
+        if self.client is None:
+            self.client = OpenAI(api_key=OPENAI_API_KEY, **OPENAI_CLIENT_OPTIONS)
+        self.running = True
+        self.thread = threading.Thread(target=self.refill_worker, name="session-pool", daemon=True)
+        self.thread.start()
+
+    def build(self):
+        return self.dispatcher_factory(client=self.client)
+
+    def warm(self):
+        """Keep the shared client's connections open with a cheap request."""
+        try:
+            self.client.beta.assistants.retrieve(ASSISTANT_ID)
+        except Exception as e:
+            print(f"Session pool keepalive failed: {e}")
+
+    def refill_worker(self):
+        self.warm()
+        last_warm = time.time()
+        while self.running:
+            with self.lock:
+                missing = self.size - len(self.idle)
+            if missing > 0:
+                try:
+                    dispatcher = self.build()
+                    # Greeting and stock phrases are rendered once, then served from the cache
+                    dispatcher.prewarm_phrases()
+                except Exception as e:
+                    print(f"Error pre-building session: {e}")
+                    self.wanted.wait(5.0)  # Back off while the API is unreachable
+                    self.wanted.clear()
+                    continue
+                with self.lock:
+                    self.idle.append(dispatcher)
+                continue
+            if time.time() - last_warm >= self.keepalive_interval:
+                self.warm()
+                last_warm = time.time()
+            self.wanted.wait(self.keepalive_interval)
+            self.wanted.clear()
+
+    def acquire(self, call_id, audio_source=None):
+        """A ready dispatcher bound to `call_id`; used as CallSessionManager's factory."""
+        with self.lock:
+            dispatcher = self.idle.popleft() if self.idle else None
+            if dispatcher is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if dispatcher is None:
+            dispatcher = self.build()
+        self.wanted.set()
+        dispatcher.attach(call_id, audio_source)
+        return dispatcher
+
+    def shutdown(self):
+        self.running = False
+        self.wanted.set()
+        with self.lock:
+            idle, self.idle = list(self.idle), collections.deque()
+        for dispatcher in idle:
+            dispatcher.cleanup()
+
+    def stats(self):
+        with self.lock:
+            return {'idle': len(self.idle), 'size': self.size, 'hits': self.hits,
+                    'misses': self.misses}
+
+class AsyncNetworkAudioSource(NetworkAudioSource):
+    """NetworkAudioSource driven by the event loop instead of a thread.
+
+    push() must be called on the loop. run() sleeps until a packet arrives, or
+    until a pending gap may be declared lost, so an idle call costs no wakeups.
+    """
+
+    def __init__(self, jitter_packets=3, max_wait=0.2):
+        super().__init__(jitter_packets, max_wait)
+        self.arrived = asyncio.Event()
+
+    def push(self, seq, pcm, sample_rate):
+        super().push(seq, pcm, sample_rate)
+        self.arrived.set()
+
+    def close(self):
+        super().close()
+        self.arrived.set()
+
+    async def run(self, dispatcher):
+        chunk = dispatcher.chunk_samples
+        while True:
+            packet = self.jitter.get(timeout=0)
+            if packet is None:
+                if self.jitter.closed:
+                    return
+                self.arrived.clear()
+                try:
+                    await asyncio.wait_for(self.arrived.wait(),
+                                           self.jitter.max_wait if self.jitter.packets else None)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.pending = np.concatenate([self.pending,
+                                           self.samples(packet, dispatcher.sample_rate)])
+            while len(self.pending) >= chunk:
+                frame, self.pending = self.pending[:chunk], self.pending[chunk:]
+                dispatcher.process_frame(frame)
+
+class AsyncEmergencyDispatcher:
+    """One call on the event loop: the EmergencyDispatcher pipeline as asyncio tasks.
+
+    Audio arrives over the network. VAD and segmentation run inline as frames
+    arrive. Each utterance is transcribed by its own task, and the dialogue
+    stage awaits those tasks in spoken order. Speech is synthesized and sent
+    back paced with asyncio.sleep. Nothing holds a thread while it waits, so an
+    idle call is a few suspended coroutines. end() cancels every task,
+    including API requests in flight. Speculative turns and the priority
+    scheduler are only available in the threaded core.
+    """
+
+    def __init__(self, call_id=None, client=None):
+        self.call_id = call_id
+        self.client = client or AsyncOpenAI(api_key=OPENAI_API_KEY, **OPENAI_CLIENT_OPTIONS)
+        self.assistant_id = ASSISTANT_ID
+        self.thread = None
+        self.audio_source = AsyncNetworkAudioSource()
+
+        # Audio and speech detection (as in EmergencyDispatcher)
         self.sample_rate = 16000
-        self.channels = 1
-        self.chunk_duration = 0.05  # 100ms chunks for speech detection
+        self.chunk_duration = 0.05
         self.chunk_samples = int(self.sample_rate * self.chunk_duration)
-        
-        # Speech detection parameters
-        self.speech_threshold = 700  # Adjust based on your microphone
-        self.silence_duration = 1.5  # Seconds of silence to end recording
-        self.min_audio_length = 0.05  # Minimum audio length to process
-        self.speech_frames = []
-        self.silence_frames = 0
+        self.silence_duration = 1.5
+        self.vad = AdaptiveVAD(self.sample_rate, self.chunk_duration, self.silence_duration)
+        self.min_audio_length = 0.05
+        self.max_utterance_duration = 15.0
+        self.preroll_duration = 0.3
         self.is_recording = False
-        
+        self.utterance_start = None
+        self.last_end = 0
+        ring_seconds = 2 * (self.max_utterance_duration + self.preroll_duration)
+        self.ring = AudioRingBuffer(int(ring_seconds * self.sample_rate))
+
         # State management
         self.call_in_progress = True
-        self.temp_dir = tempfile.mkdtemp()
         self.current_address = None
+        self.address_tracker = AddressTracker()
+        self.incident = IncidentState()
+        self.incident_sent = {}
+        self.upload_format = 'wav'
+        self.tts_voice = "shimmer"
+        self.hold_interval = 10.0  # Longest the hold phrase repeats while TTS is down
+        self.hold_played_at = None
 
-    def detect_speech(self, audio_data):
-        """Detect if audio contains speech using amplitude threshold."""
-        return np.abs(audio_data).mean() > self.speech_threshold
+        # Stages: capture -> transcription task per utterance -> dialogue -> speech
+        self.turns = asyncio.Queue(maxsize=8)  # (ended, transcription task) in spoken order
+        self.tts_queue = asyncio.Queue(maxsize=32)
+        self.tasks = set()
+        self.dropped_utterances = 0
+        self.metrics = StageMetrics(parent=stage_metrics)
 
-    def record_and_process(self):
-        """Continuously record and process audio with speech detection."""
-        def audio_callback(indata, frames, time_info, status):
-            if status:
-                print(f"Audio status: {status}")
-            
-            # Check for speech in current chunk
-            if self.detect_speech(indata):
-                if not self.is_recording:
-                    print("Speech detected - starting recording...")
-                    self.is_recording = True
-                self.speech_frames.append(indata.copy())
-                self.silence_frames = 0
-            elif self.is_recording:
-                self.silence_frames += 1
-                self.speech_frames.append(indata.copy())  # Keep some silence for natural speech
-                
-                # Check if silence duration exceeded
-                silence_time = self.silence_frames * self.chunk_duration
-                if silence_time >= self.silence_duration:
-                    print("Silence detected - processing speech...")
-                    self.process_recorded_speech()
-                    self.is_recording = False
-                    self.speech_frames = []
-                    self.silence_frames = 0
+        # Playback to the caller and barge-in
+        self.barge_in_enabled = True
+        self.echo_gate = EchoGate()
+        self.levels = collections.deque(maxlen=25)  # (play time, dB) of recently sent blocks
+        self.next_time = time.perf_counter()
+        self.out_seq = 0
+        self.speech = None  # Task speaking the current sentence
+        self.interrupted = False
+        self.barge_ins = 0
+        self.spoken = None  # Sentences of the current reply as far as they were heard
+        self.reply_interrupted = False
 
+        # Long calls (see EmergencyDispatcher.run_options)
+        self.caller_turns = []
+        self.compact_after_turns = 8
+        self.context_messages = 6
+        self.compactions = 0
+
+    # Helpers that don't block, shared with the threaded dispatcher
+    emit = EmergencyDispatcher.emit
+    archive_audio = EmergencyDispatcher.archive_audio
+    emit_metrics = EmergencyDispatcher.emit_metrics
+    publish_incident = EmergencyDispatcher.publish_incident
+    dispatch_units = EmergencyDispatcher.dispatch_units
+    run_options = EmergencyDispatcher.run_options
+    incident_summary = EmergencyDispatcher.incident_summary
+    canned_reply = EmergencyDispatcher.canned_reply
+    hold_phrase = EmergencyDispatcher.hold_phrase
+
+    def spawn(self, coro):
+        """Start a task that end() will cancel."""
+        task = asyncio.get_running_loop().create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def run(self):
+        """Run the call until it is cancelled or the caller's audio source closes."""
         try:
-            with sd.InputStream(
-                channels=self.channels,
-                samplerate=self.sample_rate,
-                blocksize=self.chunk_samples,
-                callback=audio_callback,
-                dtype=np.int16
-            ):
-                print("Listening for speech...")
-                while self.call_in_progress:
-                    time.sleep(0.1)
-        except Exception as e:
-            print(f"Error in audio stream: {e}")
+            call_archive.record_event(self.call_id, 'call_start', {})
+            self.thread = await self.client.beta.threads.create()
+            self.spawn(self.dialogue_worker())
+            self.spawn(self.tts_worker())
+            await self.speak(GREETING)
+            await self.audio_source.run(self)
+        finally:
+            await self.end()
 
-    def process_recorded_speech(self):
-        """Process the recorded speech frames."""
-        if not self.speech_frames:
+    async def end(self):
+        """Stop the call: close the audio source and cancel every stage and request."""
+        if not self.call_in_progress:
+            return
+        self.call_in_progress = False
+        self.audio_source.close()
+        tasks = list(self.tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        unit_roster.release(self.call_id)
+        call_archive.record_event(self.call_id, 'call_end', {})
+
+    def process_frame(self, frame):
+        """Capture and segmenter stages for one 16 kHz frame (see EmergencyDispatcher.segment_worker)."""
+        start = self.ring.total
+        end = self.ring.write(frame)
+        indata = self.ring.view(start, end)
+
+        with self.metrics.span('vad'):
+            reference = self.reference_db() if self.barge_in_enabled else None
+            level = level_db(indata)
+            suppress = not self.echo_gate.passes(level, reference)
+            event = self.vad.update(indata, suppress)
+        if self.call_id is not None:
+            event_hub.coalesce(self.call_id, 'level', round(level))
+        if event == 'onset':
+            if self.barge_in_enabled and reference is not None:
+                self.barge_in()
+            self.is_recording = True
+            preroll = int(self.preroll_duration * self.sample_rate)
+            onset = start - (self.vad.onset_frames - 1) * len(indata) - preroll
+            self.utterance_start = max(onset, self.last_end, self.ring.oldest)
+
+        if not self.is_recording:
             return
+        if event == 'end':
+            self.metrics.observe('endpoint', self.vad.endpoint_duration())
+            self.queue_utterance(end)
+            self.is_recording = False
+            self.utterance_start = None
+            self.last_end = end
+        elif end - self.utterance_start >= self.max_utterance_duration * self.sample_rate:
+            self.queue_utterance(end)
+            self.utterance_start = end
+            self.last_end = end
 
+    def queue_utterance(self, end):
+        """Start transcribing the utterance ending at `end` and queue it for the dialogue stage."""
+        self.archive_audio(self.ring.view(self.utterance_start, end))
+        task = self.spawn(self.transcribe(self.utterance_start, end))
         try:
-            # Combine all frames
-            audio_data = np.concatenate(self.speech_frames)
-            duration = len(audio_data) / self.sample_rate
-
-            # Only process if audio is long enough
-            if duration >= self.min_audio_length:
-                # Save to temporary WAV file
-                temp_path = os.path.join(self.temp_dir, f"speech_{time.time()}.wav")
-                with wave.open(temp_path, 'wb') as wf:
-                    wf.setnchannels(self.channels)
-                    wf.setsampwidth(2)
-                    wf.setframerate(self.sample_rate)
-                    wf.writeframes(audio_data.tobytes())
-
-                # Transcribe
-                with open(temp_path, 'rb') as audio_file:
-                    transcript = self.client.audio.transcriptions.create(
-                        model="whisper-1",
-                        file=audio_file,
-                        response_format="text"
-                    )
-
-                os.remove(temp_path)
-
-                if transcript and transcript.strip():
-                    print(f"Caller: {transcript}")
-                    self.handle_input(transcript)
+            self.turns.put_nowait((time.perf_counter(), task))
+        except asyncio.QueueFull:
+            task.cancel()
+            self.dropped_utterances += 1
 
+    async def transcribe(self, start, end):
+        """Transcribe ring buffer samples [start, end) with Whisper, or None."""
+        audio_data = self.ring.view(start, end)
+        if len(audio_data) / self.sample_rate < self.min_audio_length:
+            return None
+        try:
+            with self.metrics.span('encode'):
+                filename, body, mime_type = encode_audio(audio_data, self.sample_rate, 1,
+                                                         self.upload_format)
+            if not self.ring.is_valid(start):
+                return None
+            with self.metrics.span('transcribe'):
+                transcript = await call_policy.acall('transcribe', lambda timeout: self.client.audio.transcriptions.create(
+                    model="whisper-1",
+                    file=(filename, body, mime_type),
+                    response_format="text",
+                    timeout=timeout
+                ), fallback=lambda: None)
+            if transcript and transcript.strip():
+                return transcript
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             print(f"Error processing recorded speech: {e}")
+        return None
+
+    async def dialogue_worker(self):
+        """Answer transcripts in the order they were spoken."""
+        while True:
+            ended, transcription = await self.turns.get()
+            transcript = await transcription
+            if transcript:
+                print(f"Caller: {transcript}")
+                await self.handle_input(transcript)
+                self.metrics.observe('turn', time.perf_counter() - ended)
+                self.emit_metrics()
+
+    async def handle_input(self, text):
+        """Fold the caller's words into the incident and stream the assistant's reply."""
+        self.emit('transcript_update', {
+            'role': 'caller',
+            'message': text,
+            'timestamp': time.strftime('%H:%M:%S')
+        })
+        self.caller_turns.append(text)
+        changed = self.incident.update(text)
+        address = self.address_tracker.update(text)
+        if address:
+            self.current_address = address
+            self.incident.location = address
+            self.incident.coordinates = None
+            changed = True
+            self.spawn(self.locate(address))
+        if changed:
+            self.publish_incident()
+            if self.incident.coordinates:
+                self.dispatch_units()
 
-    def text_to_speech(self, text):
-        """Convert text to speech using OpenAI's TTS."""
         try:
-            temp_path = os.path.join(self.temp_dir, f"response_{time.time()}.mp3")
-            
-            response = self.client.audio.speech.create(
-                model="tts-1",
-                voice="shimmer",
-                input=text
-            )
-            
-            response.stream_to_file(temp_path)
-            
-            if os.path.exists(temp_path):
-                if os.name == 'posix':
-                    os.system(f"afplay '{temp_path}'")
-                elif os.name == 'nt':
-                    os.system(f'start "" "{temp_path}"')
-                os.remove(temp_path)
-                
+            await self.record_interrupted_reply()
+            self.begin_reply()
+            with self.metrics.span('messages_create'):
+                await call_policy.acall('messages', lambda timeout: self.client.beta.threads.messages.create(
+                    thread_id=self.thread.id,
+                    role="user",
+                    content=text,
+                    timeout=timeout
+                ))
+            response = await self.stream_response()
+            if response:
+                print(f"Dispatcher: {response}")
+                self.emit('transcript_update', {
+                    'role': 'dispatcher',
+                    'message': response,
+                    'partial': False,
+                    'timestamp': time.strftime('%H:%M:%S')
+                })
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            print(f"Text-to-speech error: {e}")
+            print(f"Error handling input: {e}")
+            await self.speak(self.canned_reply())
 
-    def handle_input(self, text):
-        """Handle transcribed input and get AI response."""
-        if not text:
+    async def record_interrupted_reply(self):
+        """Replace an interrupted reply in the thread with what the caller actually heard
+        (see EmergencyDispatcher.record_interrupted_reply)."""
+        if not self.reply_interrupted:
             return
-
+        self.reply_interrupted = False
+        heard = ' '.join(self.spoken or []).strip()
         try:
-            message = self.client.beta.threads.messages.create(
-                thread_id=self.thread.id,
-                role="user",
-                content=text
-            )
-
-            run = self.client.beta.threads.runs.create(
-                thread_id=self.thread.id,
-                assistant_id=self.assistant_id
-            )
-
-            start_time = time.time()
-            while time.time() - start_time < 30:
-                run_status = self.client.beta.threads.runs.retrieve(
+            messages = await self.client.beta.threads.messages.list(thread_id=self.thread.id, limit=1)
+            if messages.data and messages.data[0].role == 'assistant':
+                await self.client.beta.threads.messages.delete(thread_id=self.thread.id,
+                                                               message_id=messages.data[0].id)
+            if heard:
+                await self.client.beta.threads.messages.create(
                     thread_id=self.thread.id,
-                    run_id=run.id
+                    role="assistant",
+                    content=f"{heard} [interrupted by the caller]"
                 )
-                if run_status.status == 'completed':
-                    messages = self.client.beta.threads.messages.list(
-                        thread_id=self.thread.id
-                    )
-                    
-                    for msg in messages.data:
-                        if msg.role == "assistant":
-                            response = msg.content[0].text.value
-                            print(f"Dispatcher: {response}")
-                            self.text_to_speech(response)
-                            return
-                time.sleep(0.5)
-
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            print(f"Error handling input: {e}")
-            self.text_to_speech("I'm experiencing technical difficulties. Please hold.")
+            print(f"Error recording interrupted reply: {e}")
 
-        address_patterns = [
-            r'at\s+([\d]+[\w\s,.-]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|Terr|Terrace)[\w\s,.-]+)',
-            r'on\s+([\d]+[\w\s,.-]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|Terr|Terrace)[\w\s,.-]+)',
-            r'(?:location|address|place) is\s+([\d]+[\w\s,.-]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|terr|terrace)[\w\s,.-]+)'
-        ]
-        
-        for pattern in address_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                self.current_address = match.group(1)
+    def begin_reply(self):
+        self.spoken = []
+        self.interrupted = False
+
+    async def stream_response(self):
+        options = self.run_options()
+        with self.metrics.span('run'):
+            async with call_policy.aguard('run') as timeout, self.client.beta.threads.runs.stream(
+                thread_id=self.thread.id,
+                assistant_id=self.assistant_id,
+                timeout=timeout,
+                **options
+            ) as stream:
+                if options:
+                    self.compactions += 1
+                response = await self.relay_deltas(stream.text_deltas)
+                if self.interrupted:
+                    await self.cancel_run(getattr(getattr(stream, 'current_run', None), 'id', None))
+                return response
+
+    async def relay_deltas(self, deltas):
+        """Batch each text delta to the dashboard and queue completed sentences for speech."""
+        splitter = SentenceSplitter()
+        parts = []
+        start = time.perf_counter()
+        async for delta in deltas:
+            if self.interrupted:
                 break
+            if not parts:
+                self.metrics.observe('first_token', time.perf_counter() - start)
+            parts.append(delta)
+            event_hub.coalesce(self.call_id, 'tokens', delta)
+            for sentence in splitter.feed(delta):
+                await self.speak(sentence)
+        remainder = splitter.flush()
+        if remainder and not self.interrupted:
+            await self.speak(remainder)
+        return ''.join(parts)
 
-    def run(self):
-        """Main method to run the dispatcher."""
+    async def cancel_run(self, run_id, timeout=2.0):
+        """Cancel a run and wait briefly for it to stop so the thread accepts new messages."""
+        if run_id is None:
+            return
         try:
-            # Initial greeting
-            self.text_to_speech("911, what's your emergency?")
-            
-            # Start recording and processing
-            self.record_and_process()
+            await self.client.beta.threads.runs.cancel(thread_id=self.thread.id, run_id=run_id)
+            deadline = time.time() + timeout
+            while time.time() < deadline:
+                run = await self.client.beta.threads.runs.retrieve(thread_id=self.thread.id,
+                                                                   run_id=run_id)
+                if run.status in ('cancelled', 'completed', 'failed', 'expired'):
+                    return
+                await asyncio.sleep(0.1)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass  # Usually already completed
 
-        except KeyboardInterrupt:
-            print("\nEmergency dispatcher shutting down...")
-        finally:
-            self.cleanup()
+    async def locate(self, address):
+        """Geocode off the loop (the geocoder blocks on SQLite and HTTP) and publish it."""
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(geocode_executor, lambda: get_geocoder().geocode(address))
+        if result is None or address != self.current_address:
+            return
+        self.incident.coordinates = [result['lat'], result['lon']]
+        self.emit('location_update', {
+            'address': address,
+            'lat': result['lat'],
+            'lon': result['lon'],
+        })
+        self.dispatch_units()
 
-    def cleanup(self):
-        """Clean up resources."""
-        self.call_in_progress = False
+    async def speak(self, text):
+        await self.tts_queue.put(text)
+
+    async def tts_worker(self):
+        """Speak queued sentences in order. A barge-in cancels the one being spoken."""
+        while True:
+            text = await self.tts_queue.get()
+            first_block = self.out_seq
+            self.speech = self.spawn(self.text_to_speech(text))
+            await asyncio.wait({self.speech})
+            fraction = 1.0
+            if self.speech.cancelled():
+                # Cut off by a barge-in; estimate how much was heard from the speaking rate
+                played = (self.out_seq - first_block) * PLAYBACK_BLOCK_BYTES
+                heard = played / (2 * TTS_SAMPLE_RATE) * SPOKEN_CHARS_PER_SECOND
+                fraction = min(heard / max(len(text), 1), 1.0)
+            self.speech = None
+            if self.spoken is not None and fraction > 0:
+                self.spoken.append(text if fraction >= 1 else heard_prefix(text, fraction))
+
+    async def text_to_speech(self, text):
+        cached = phrase_cache.get(self.tts_voice, text)
+        if cached is not None:
+            with self.metrics.span('playback'):
+                await self.play(cached)
+            return
+
+        chunks = []
         try:
-            for file in os.listdir(self.temp_dir):
-                os.remove(os.path.join(self.temp_dir, file))
-            os.rmdir(self.temp_dir)
+            start = time.perf_counter()
+            playback = 0.0
+            async with call_policy.aguard('tts') as timeout, self.client.audio.speech.with_streaming_response.create(
+                model="tts-1",
+                voice=self.tts_voice,
+                input=text,
+                response_format="pcm",
+                timeout=timeout
+            ) as response:
+                async for chunk in response.iter_bytes(TTS_CHUNK_BYTES):
+                    if not chunks:
+                        self.metrics.observe('tts_first_chunk', time.perf_counter() - start)
+                    chunks.append(chunk)
+                    play_start = time.perf_counter()
+                    await self.play(chunk)
+                    playback += time.perf_counter() - play_start
+            self.metrics.observe('tts_synthesis', time.perf_counter() - start - playback)
+            self.metrics.observe('playback', playback)
+            phrase_cache.put(self.tts_voice, text, b''.join(chunks))
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            print(f"Error cleaning up: {e}")
-    
-    def handle_input(self, text):
-        """Modified to emit updates to frontend"""
-        if not text:
-            return
+            print(f"Text-to-speech error: {e}")
+            hold = self.hold_phrase() if not chunks else None
+            if hold is not None:
+                await self.play(hold)
+
+    async def play(self, pcm):
+        """Send PCM to the caller in 20 ms blocks, paced to stay one block ahead of playback."""
+        block_seconds = PLAYBACK_BLOCK_BYTES / (2 * TTS_SAMPLE_RATE)
+        for offset in range(0, len(pcm) - len(pcm) % 2, PLAYBACK_BLOCK_BYTES):
+            block = pcm[offset:offset + PLAYBACK_BLOCK_BYTES]
+            self.next_time = max(self.next_time, time.perf_counter())
+            self.levels.append((self.next_time, level_db(np.frombuffer(block, np.int16))))
+            event_hub.emit(self.call_id, 'audio_out', {'seq': self.out_seq, 'sample_rate': TTS_SAMPLE_RATE,
+                                                       'pcm': bytes(block)}, supervisors=False)
+            self.out_seq += 1
+            self.next_time += len(block) / (2 * TTS_SAMPLE_RATE)
+            delay = self.next_time - time.perf_counter() - block_seconds
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    def reference_db(self, window=0.2):
+        """Loudest level the caller is hearing now, or None if nothing is playing."""
+        now = time.perf_counter()
+        recent = [db for t, db in self.levels if now - window <= t <= now]
+        return max(recent) if recent else None
+
+    def barge_in(self):
+        """The caller started talking over playback: stop it and drop queued sentences."""
+        self.interrupted = True
+        while not self.tts_queue.empty():
+            self.tts_queue.get_nowait()
+        if self.speech is not None:
+            self.speech.cancel()
+        self.levels.clear()
+        self.next_time = time.perf_counter()
+        event_hub.emit(self.call_id, 'audio_flush', {}, supervisors=False)
+        self.barge_ins += 1
+        if self.spoken is not None:
+            self.reply_interrupted = True
+        self.emit('barge_in', {'timestamp': time.strftime('%H:%M:%S')})
+
+    def pipeline_stats(self):
+        return {
+            'turns': self.turns.qsize(),
+            'tts': self.tts_queue.qsize(),
+            'tasks': len(self.tasks),
+            'dropped_utterances': self.dropped_utterances,
+            'barge_ins': self.barge_ins,
+            'compacted_runs': self.compactions,
+            'echo_gated_frames': self.echo_gate.gated,
+            'ingest': self.audio_source.stats(),
+            'latency': self.metrics.snapshot(),
+        }
+
+class AsyncCallManager:
+    """CallSessionManager for the event loop: a task per call instead of a thread.
+
+    All calls share one AsyncOpenAI client and its connection pool.
+    """
+
+    def __init__(self, max_sessions=ASYNC_MAX_CONCURRENT_CALLS, dispatcher_factory=None, client=None):
+        self.max_sessions = max_sessions
+        self.dispatcher_factory = dispatcher_factory or AsyncEmergencyDispatcher
+        self.client = client
+        self.sessions = {}
+        self.tasks = {}
+        self.calls_started = 0
+        self.calls_rejected = 0
+
+    def start_call(self, call_id):
+        """Admit a call and start its dispatcher on the running loop. Returns None if at capacity."""
+        if call_id in self.sessions:
+            return self.sessions[call_id]
+        if len(self.sessions) >= self.max_sessions:
+            self.calls_rejected += 1
+            return None
+        if self.client is None:
+            self.client = AsyncOpenAI(api_key=OPENAI_API_KEY, **OPENAI_CLIENT_OPTIONS)
+        dispatcher = self.dispatcher_factory(call_id=call_id, client=self.client)
+        self.sessions[call_id] = dispatcher
+        self.calls_started += 1
+        task = asyncio.get_running_loop().create_task(dispatcher.run())
+        self.tasks[call_id] = task
+        task.add_done_callback(lambda task: self._release(call_id, dispatcher, task))
+        return dispatcher
+
+    async def end_call(self, call_id):
+        """Cancel the call's task and wait for it to wind down. Returns False if unknown."""
+        task = self.tasks.get(call_id)
+        if task is None:
+            return False
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return True
+
+    def get(self, call_id):
+        return self.sessions.get(call_id)
+
+    def _release(self, call_id, dispatcher, task):
+        """Done callback of a call's task: log why it failed, if it did, and free its slot.
+
+        run() has already ended the call in its finally block, so the call's
+        stages are stopped whether it hung up or failed.
+        """
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Call {call_id} failed: {task.exception()!r}")
+        if self.sessions.get(call_id) is dispatcher:
+            del self.sessions[call_id]
+            del self.tasks[call_id]
 
+    def stats(self):
+        return {
+            'active_calls': len(self.sessions),
+            'max_calls': self.max_sessions,
+            'calls_started': self.calls_started,
+            'calls_rejected': self.calls_rejected,
+            'pipelines': {call_id: d.pipeline_stats() for call_id, d in self.sessions.items()},
+        }
+
+    async def shutdown(self):
+        await asyncio.gather(*(self.end_call(call_id) for call_id in list(self.tasks)))
+
+class AsyncEmitter:
+    """Lets the thread-based EventHub emit through the asyncio Socket.IO server."""
+
+    def __init__(self, server, loop):
+        self.server = server
+        self.loop = loop
+        self.sending = set()  # Keeps emit tasks referenced until they finish
+
+    def emit(self, event, data=None, to=None):
         try:
-            # Emit transcript update
-            socketio.emit('transcript_update', {
-                'role': 'caller',
-                'message': text,
-                'timestamp': time.strftime('%H:%M:%S')
-            })
+            on_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            on_loop = False
+        if on_loop:
+            task = self.loop.create_task(self.server.emit(event, data, to=to))
+            self.sending.add(task)
+            task.add_done_callback(self.sending.discard)
+        else:
+            asyncio.run_coroutine_threadsafe(self.server.emit(event, data, to=to), self.loop)
 
-            message = self.client.beta.threads.messages.create(
-                thread_id=self.thread.id,
-                role="user",
-                content=text
-            )
+session_pool = SessionPool()
+session_manager = CallSessionManager(dispatcher_factory=session_pool.acquire)
+unit_roster = build_roster()
+geocode_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="geocode")
 
-            run = self.client.beta.threads.runs.create(
-                thread_id=self.thread.id,
-                assistant_id=self.assistant_id
-            )
+# Dashboard stylesheet
+DASHBOARD_CSS = """
+/* Previous styles remain the same */
+body {
+    font-family: Arial, sans-serif;
+    margin: 20px;
+    max-width: 1200px;
+    margin: 0 auto;
+    padding: 20px;
+}
+.grid {
+    display: grid;
+    grid-template-columns: repeat(2, 1fr);
+    gap: 20px;
+    margin-top: 20px;
+}
+.section {
+    border: 1px solid #ccc;
+    padding: 15px;
+    border-radius: 5px;
+    background: white;
+}
+.transcript {
+    height: 300px;
+    overflow-y: auto;
+}
+.emergency-button {
+    background-color: #ff4444;
+    color: white;
+    padding: 15px 30px;
+    border: none;
+    border-radius: 5px;
+    font-size: 18px;
+    cursor: pointer;
+    display: block;
+    margin: 0 auto;
+    transition: background-color 0.3s;
+}
+.emergency-button:hover {
+    background-color: #cc0000;
+}
+.emergency-button.active {
+    background-color: #cc0000;
+}
+.message {
+    margin: 10px 0;
+    padding: 5px;
+}
+.timestamp {
+    color: #666;
+    font-size: 0.8em;
+}
+.dispatcher {
+    color: blue;
+}
+.caller {
+    color: green;
+}
+#map {
+    height: 300px;
+    width: 100%;
+    border-radius: 5px;
+}
+.status-emergency {
+    background-color: #ffebee;
+    color: #c62828;
+    padding: 10px;
+    border-radius: 5px;
+    font-weight: bold;
+    animation: pulse 2s infinite;
+}
+.status-active {
+    background-color: #e8f5e9;
+    color: #2e7d32;
+    padding: 10px;
+    border-radius: 5px;
+}
+.ai-summary {
+    background-color: #f5f5f5;
+    padding: 10px;
+    border-radius: 5px;
+    margin-top: 10px;
+}
+@keyframes pulse {
+    0% { background-color: #ffebee; }
+    50% { background-color: #ffcdd2; }
+    100% { background-color: #ffebee; }
+}
+"""
 
-            start_time = time.time()
-            while time.time() - start_time < 30:
-                run_status = self.client.beta.threads.runs.retrieve(
-                    thread_id=self.thread.id,
-                    run_id=run.id
-                )
-                if run_status.status == 'completed':
-                    messages = self.client.beta.threads.messages.list(
-                        thread_id=self.thread.id
-                    )
-                    
-                    for msg in messages.data:
-                        if msg.role == "assistant":
-                            response = msg.content[0].text.value
-                            print(f"Dispatcher: {response}")
-                            
-                            # Emit dispatcher response
-                            socketio.emit('transcript_update', {
-                                'role': 'dispatcher',
-                                'message': response,
-                                'timestamp': time.strftime('%H:%M:%S')
-                            })
-                            
-                            self.text_to_speech(response)
-                            return
-                time.sleep(0.5)
+# Dashboard script
+DASHBOARD_JS = """
+const socket = io();
+let callActive = false;
+let map;
+let marker;
+let dispatchedUnits = [];
+let emergencySummary = {
+    type: null,
+    location: null,
+    problem: null,
+    victim_status: null,
+    key_details: [],
+    units: []
+};
 
-        except Exception as e:
-            print(f"Error handling input: {e}")
-            self.text_to_speech("I'm experiencing technical difficulties. Please hold.")
+// Initialize map
+function initMap() {
+    map = L.map('map').setView([40.7128, -74.0060], 13);
+    L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+        attribution: '© OpenStreetMap contributors'
+    }).addTo(map);
+}
+
+// Show the server-geocoded emergency location
+function showLocation(address, latitude, longitude) {
+    // Update map view
+    map.setView([latitude, longitude], 18);  // Increased zoom level for better detail
+
+    // Remove existing marker if any
+    if (marker) {
+        marker.remove();
+    }
+
+    // Add new marker with pulse animation
+    const pulsingIcon = L.divIcon({
+        className: 'pulsing-marker',
+        html: '<div class="pulse"></div>',
+        iconSize: [20, 20]
+    });
+
+    marker = L.marker([latitude, longitude], {
+        icon: pulsingIcon
+    }).addTo(map);
+
+    // Add a circle to show approximate area
+    L.circle([latitude, longitude], {
+        color: 'red',
+        fillColor: '#f03',
+        fillOpacity: 0.2,
+        radius: 50
+    }).addTo(map);
+
+    // Add popup with address information
+    marker.bindPopup(`
+        <strong>Emergency Location</strong><br>
+        ${address}<br>
+        <small>Lat: ${latitude.toFixed(6)}<br>Long: ${longitude.toFixed(6)}</small>
+    `).openPopup();
+
+    // Update emergencySummary with precise location
+    emergencySummary.location = address;
+    emergencySummary.coordinates = `${latitude.toFixed(6)}, ${longitude.toFixed(6)}`;
+}
+
+// Other calls' events only reach supervisor consoles, which show just their transcripts
+function otherCall(data) {
+    return data.call_id && data.call_id !== socket.id;
+}
+
+socket.on('dispatch_update', function(data) {
+    if (otherCall(data)) return;
+    dispatchedUnits = data.units;
+    renderDispatchStatus();
+});
+
+socket.on('location_update', function(data) {
+    if (otherCall(data)) return;
+    showLocation(data.address, data.lat, data.lon);
+});
+
+// Add CSS for pulsing marker
+const style = document.createElement('style');
+style.textContent = `
+    .pulsing-marker {
+        position: relative;
+    }
+
+    .pulse {
+        display: block;
+        width: 20px;
+        height: 20px;
+        border-radius: 50%;
+        background: #ff3b30;
+        border: 2px solid #fff;
+        cursor: pointer;
+        box-shadow: 0 0 0 rgba(255, 59, 48, 0.4);
+        animation: pulse 2s infinite;
+    }
 
-# HTML template for the frontend
+    @keyframes pulse {
+        0% {
+            box-shadow: 0 0 0 0 rgba(255, 59, 48, 0.4);
+        }
+        70% {
+            box-shadow: 0 0 0 20px rgba(255, 59, 48, 0);
+        }
+        100% {
+            box-shadow: 0 0 0 0 rgba(255, 59, 48, 0);
+        }
+    }
+`;
+document.head.appendChild(style);
+
+// Render the server's incident summary
+function renderSummary() {
+    let summaryHTML = '<div class="ai-summary">';
+    if (emergencySummary.type) summaryHTML += `<strong>Type:</strong> ${emergencySummary.type}<br>`;
+    if (emergencySummary.problem) summaryHTML += `<strong>Problem:</strong> ${emergencySummary.problem}<br>`;
+    if (emergencySummary.location) summaryHTML += `<strong>Location:</strong> ${emergencySummary.location}<br>`;
+    if (emergencySummary.victim_status) summaryHTML += `<strong>Status:</strong> ${emergencySummary.victim_status}<br>`;
+
+    if (emergencySummary.key_details.length > 0) {
+        summaryHTML += '<strong>Key Details:</strong><ul>';
+        emergencySummary.key_details.forEach(detail => {
+            summaryHTML += `<li>${detail}</li>`;
+        });
+        summaryHTML += '</ul>';
+    }
+    summaryHTML += '</div>';
+
+    document.getElementById('aiSummary').innerHTML = summaryHTML;
+}
+
+// Update dispatch status
+function renderDispatchStatus() {
+    if (!emergencySummary.type) return;
+
+    // Real roster units once the location is known, requested unit types until then
+    const units = dispatchedUnits.length
+        ? dispatchedUnits.map(unit => `${unit.label} (${unit.distance_km} km, ETA ${unit.eta_min} min)`)
+        : emergencySummary.units;
+    const statusHTML = `
+        <div class="status-emergency">
+            <span style="font-size: 1.2em">🚨 ${emergencySummary.type} EMERGENCY IN PROGRESS 🚨</span><br>
+            <strong>Dispatched Units:</strong><br>
+            ${units.map(unit => `• ${unit}`).join('<br>')}
+            ${emergencySummary.location ? `<br><strong>Location:</strong> ${emergencySummary.location}` : ''}
+        </div>
+    `;
+    document.getElementById('dispatchStatus').innerHTML = statusHTML;
+}
+
+// Incident updates carry only the fields that changed
+function applyIncident(delta) {
+    delete delta.coordinates;  // The marker is placed by location_update
+    Object.assign(emergencySummary, delta);
+    renderSummary();
+    renderDispatchStatus();
+}
+
+// Socket event handlers
+let partialMessage = null;
+
+function appendMessage(data) {
+    const transcript = document.getElementById('transcript');
+    const message = document.createElement('div');
+    message.className = 'message';
+    message.innerHTML = `
+        <span class="timestamp">${data.timestamp}</span>
+        <br>
+        <span class="${data.role}">${data.role}: <span class="text"></span></span>
+    `;
+    message.querySelector('.text').textContent = data.message;
+    transcript.appendChild(message);
+    transcript.scrollTop = transcript.scrollHeight;
+    return message;
+}
+
+// Streamed tokens are appended to the in-progress dispatcher message
+function appendPartial(text) {
+    if (!partialMessage) {
+        partialMessage = appendMessage({role: 'dispatcher', message: '',
+                                        timestamp: new Date().toLocaleTimeString('en-GB')});
+    }
+    partialMessage.querySelector('.text').textContent += text;
+    const transcript = document.getElementById('transcript');
+    transcript.scrollTop = transcript.scrollHeight;
+}
+
+// High-frequency updates arrive batched, one frame per call every 100 ms
+socket.on('frame', function(frame) {
+    if (otherCall(frame)) return;
+    if (frame.tokens) appendPartial(frame.tokens);
+    if (frame.incident) applyIncident(frame.incident);
+    if (frame.level !== undefined) document.getElementById('callerLevel').value = frame.level;
+});
+
+socket.on('transcript_update', function(data) {
+    if (otherCall(data)) {
+        appendMessage({...data, message: `[call ${data.call_id.slice(0, 6)}] ${data.message}`});
+        return;
+    }
+
+    // Update transcript
+    if (partialMessage && data.role === 'dispatcher') {
+        partialMessage.querySelector('.text').textContent = data.message;
+        partialMessage = null;
+    } else {
+        appendMessage(data);
+    }
+});
+
+socket.on('barge_in', function(data) {
+    if (otherCall(data)) return;
+    // Mark the reply the caller talked over
+    const replies = document.querySelectorAll('.dispatcher .text');
+    if (replies.length) {
+        replies[replies.length - 1].textContent += ' (interrupted)';
+    }
+    partialMessage = null;
+});
+
+socket.on('metrics_update', function(data) {
+    if (otherCall(data)) return;
+    const ms = seconds => seconds === null ? '-' : `${Math.round(seconds * 1000)} ms`;
+    let html = '<table><tr><th>Stage</th><th>p50</th><th>p95</th><th>n</th></tr>';
+    for (const [stage, h] of Object.entries(data.stages)) {
+        html += `<tr><td>${stage}</td><td>${ms(h.p50)}</td><td>${ms(h.p95)}</td><td>${h.count}</td></tr>`;
+    }
+    document.getElementById('latency').innerHTML = html + '</table>';
+});
+
+socket.on('call_rejected', function(data) {
+    callActive = false;
+    stopBrowserAudio();
+    const button = document.getElementById('emergencyButton');
+    button.textContent = 'Start Emergency Call';
+    button.classList.remove('active');
+    document.getElementById('dispatchStatus').innerHTML = `<div class="status-emergency">${data.reason}</div>`;
+});
+
+// Browser audio: microphone frames up as binary int16, dispatcher voice down
+let audioContext = null;
+let micStream = null;
+let micProcessor = null;
+let playbackTime = 0;
+let playbackSources = [];
+
+async function startBrowserAudio() {
+    audioContext = new AudioContext();
+    micStream = await navigator.mediaDevices.getUserMedia({
+        audio: {echoCancellation: true, noiseSuppression: true, channelCount: 1}
+    });
+    const input = audioContext.createMediaStreamSource(micStream);
+    micProcessor = audioContext.createScriptProcessor(1024, 1, 1);
+    let seq = 0;
+    micProcessor.onaudioprocess = function(event) {
+        const samples = event.inputBuffer.getChannelData(0);
+        const pcm = new Int16Array(samples.length);
+        for (let i = 0; i < samples.length; i++) {
+            pcm[i] = Math.max(-1, Math.min(1, samples[i])) * 0x7fff;
+        }
+        socket.emit('audio_frame', {seq: seq++, sample_rate: audioContext.sampleRate, pcm: pcm.buffer});
+    };
+    input.connect(micProcessor);
+    micProcessor.connect(audioContext.destination);
+    playbackTime = 0;
+}
+
+function stopBrowserAudio() {
+    if (micProcessor) micProcessor.disconnect();
+    if (micStream) micStream.getTracks().forEach(track => track.stop());
+    if (audioContext) audioContext.close();
+    audioContext = micStream = micProcessor = null;
+}
+
+socket.on('audio_out', function(data) {
+    if (!audioContext) return;
+    const pcm = new Int16Array(data.pcm);
+    const buffer = audioContext.createBuffer(1, pcm.length, data.sample_rate);
+    const channel = buffer.getChannelData(0);
+    for (let i = 0; i < pcm.length; i++) channel[i] = pcm[i] / 0x8000;
+    const source = audioContext.createBufferSource();
+    source.buffer = buffer;
+    source.connect(audioContext.destination);
+    playbackTime = Math.max(playbackTime, audioContext.currentTime + 0.05);
+    source.start(playbackTime);
+    playbackTime += buffer.duration;
+    playbackSources.push(source);
+    source.onended = () => playbackSources.splice(playbackSources.indexOf(source), 1);
+});
+
+socket.on('audio_flush', function() {
+    // Barge-in: drop everything already scheduled
+    playbackSources.forEach(source => source.stop());
+    playbackSources = [];
+    playbackTime = 0;
+});
+
+// Initialize everything when page loads
+window.onload = function() {
+    initMap();
+};
+
+// Emergency button handler
+document.getElementById('supervise').addEventListener('change', function() {
+    socket.emit('supervise', {enabled: this.checked});
+});
+
+document.getElementById('emergencyButton').addEventListener('click', function() {
+    callActive = !callActive;
+    this.textContent = callActive ? 'End Emergency Call' : 'Start Emergency Call';
+    this.classList.toggle('active');
+
+    if (callActive) {
+        if (document.getElementById('browserAudio').checked) {
+            startBrowserAudio().then(() => socket.emit('start_call', {audio: 'network'}));
+        } else {
+            socket.emit('start_call');
+        }
+        document.getElementById('dispatchStatus').innerHTML = '<div class="status-active">Call Active - Awaiting Details</div>';
+        // Reset all tracking variables
+        dispatchedUnits = [];
+        emergencySummary = {
+            type: null,
+            location: null,
+            problem: null,
+            victim_status: null,
+            key_details: [],
+            units: []
+        };
+        if (marker) marker.remove();
+        map.setView([40.7128, -74.0060], 13);
+    } else {
+        socket.emit('end_call');
+        stopBrowserAudio();
+        document.getElementById('dispatchStatus').innerHTML = '<div class="status-active">Call Ended</div>';
+    }
+});
+"""
+
+# Dashboard page; the stylesheet and script are served as separate hashed assets
 HTML_TEMPLATE = """
 <!DOCTYPE html>
 <html>
@@ -291,98 +4996,15 @@ HTML_TEMPLATE = """
     <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.0.1/socket.io.js"></script>
     <link rel="stylesheet" href="https://unpkg.com/leaflet@1.7.1/dist/leaflet.css" />
     <script src="https://unpkg.com/leaflet@1.7.1/dist/leaflet.js"></script>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/axios/0.21.1/axios.min.js"></script>
-    <style>
-        /* Previous styles remain the same */
-        body {
-            font-family: Arial, sans-serif;
-            margin: 20px;
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 20px;
-        }
-        .grid {
-            display: grid;
-            grid-template-columns: repeat(2, 1fr);
-            gap: 20px;
-            margin-top: 20px;
-        }
-        .section {
-            border: 1px solid #ccc;
-            padding: 15px;
-            border-radius: 5px;
-            background: white;
-        }
-        .transcript {
-            height: 300px;
-            overflow-y: auto;
-        }
-        .emergency-button {
-            background-color: #ff4444;
-            color: white;
-            padding: 15px 30px;
-            border: none;
-            border-radius: 5px;
-            font-size: 18px;
-            cursor: pointer;
-            display: block;
-            margin: 0 auto;
-            transition: background-color 0.3s;
-        }
-        .emergency-button:hover {
-            background-color: #cc0000;
-        }
-        .emergency-button.active {
-            background-color: #cc0000;
-        }
-        .message {
-            margin: 10px 0;
-            padding: 5px;
-        }
-        .timestamp {
-            color: #666;
-            font-size: 0.8em;
-        }
-        .dispatcher {
-            color: blue;
-        }
-        .caller {
-            color: green;
-        }
-        #map {
-            height: 300px;
-            width: 100%;
-            border-radius: 5px;
-        }
-        .status-emergency {
-            background-color: #ffebee;
-            color: #c62828;
-            padding: 10px;
-            border-radius: 5px;
-            font-weight: bold;
-            animation: pulse 2s infinite;
-        }
-        .status-active {
-            background-color: #e8f5e9;
-            color: #2e7d32;
-            padding: 10px;
-            border-radius: 5px;
-        }
-        .ai-summary {
-            background-color: #f5f5f5;
-            padding: 10px;
-            border-radius: 5px;
-            margin-top: 10px;
-        }
-        @keyframes pulse {
-            0% { background-color: #ffebee; }
-            50% { background-color: #ffcdd2; }
-            100% { background-color: #ffebee; }
-        }
-    </style>
+    <link rel="stylesheet" href="{stylesheet}" />
 </head>
 <body>
     <button id="emergencyButton" class="emergency-button">Start Emergency Call</button>
+    <p style="text-align: center">
+        <label><input type="checkbox" id="browserAudio" checked> Talk through this browser</label>
+        <label><input type="checkbox" id="supervise"> Supervise all calls</label>
+        <label>Caller level <meter id="callerLevel" min="0" max="90" value="0"></meter></label>
+    </p>
     
     <div class="grid">
         <div class="section">
@@ -404,409 +5026,343 @@ HTML_TEMPLATE = """
             <h2>Dispatch Status</h2>
             <div id="dispatchStatus" class="status-active">Standby</div>
         </div>
+
+        <div class="section">
+            <h2>Latency</h2>
+            <div id="latency" class="ai-summary">No turns yet</div>
+        </div>
     </div>
 
-    <script>
-        const socket = io();
-        let callActive = false;
-        let map;
-        let marker;
-        let emergencyType = null;
-        let dispatchedUnits = new Set();
-        let emergencySummary = {
-            type: null,
-            location: null,
-            problem: null,
-            victim_status: null,
-            key_details: new Set()
-        };
-        
-        // Initialize map
-        function initMap() {
-            map = L.map('map').setView([40.7128, -74.0060], 13);
-            L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
-                attribution: '© OpenStreetMap contributors'
-            }).addTo(map);
-        }
+    <script src="{script}"></script>
+</body>
+</html>
+"""
 
-        // Address detection
-        function findAddress(text) {
-            // More comprehensive address patterns
-            const addressPatterns = [
-                // Standard street address with city/state
-                /(?:at|on|near)\s+(\d+[\w\s]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|terrace|terr)[\w\s,.-]*(?:,\s*[\w\s]+,\s*[A-Z]{2})?)/i,
-                
-                // Location/address is format
-                /(?:location|address|place)\s+(?:is|at)\s+(\d+[\w\s]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|terrace|terr)[\w\s,.-]*(?:,\s*[\w\s]+,\s*[A-Z]{2})?)/i,
-                
-                // Direct address mention
-                /(\d+[\w\s]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|terrace|terr)[\w\s,.-]*(?:,\s*[\w\s]+,\s*[A-Z]{2})?)/i
-            ];
-
-            let fullAddress = null;
-            
-            // Try to find the address
-            for (let pattern of addressPatterns) {
-                const match = text.match(pattern);
-                if (match) {
-                    fullAddress = match[1].trim();
-                    break;
-                }
-            }
+class StaticAsset:
+    """One built asset: the body plus its precompressed variants, each with a strong ETag."""
 
-            // If we found an address, try to extract city and state
-            if (fullAddress) {
-                // Try to find city and state if not already included
-                const cityStatePattern = /(?:in|at)\s+([\w\s]+),\s*([A-Z]{2})/i;
-                const cityStateMatch = text.match(cityStatePattern);
-                
-                if (cityStateMatch && !fullAddress.includes(cityStateMatch[1])) {
-                    // Append city and state if they're not already in the address
-                    fullAddress += `, ${cityStateMatch[1]}, ${cityStateMatch[2]}`;
-                } else if (!fullAddress.includes(',')) {
-                    // If no city/state found and not in address, append default (New York, NY)
-                    fullAddress += ', New York, NY';
-                }
-            }
+    def __init__(self, body, content_type, digest):
+        self.content_type = content_type
+        self.variants = {'identity': body, 'gzip': gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body, quality=11)
+        # Keep a compressed variant only if it is actually smaller
+        self.variants = {coding: data for coding, data in self.variants.items()
+                         if coding == 'identity' or len(data) < len(body)}
+        self.digest = digest
 
-            return fullAddress;
-        }
+    def negotiate(self, accept_encodings):
+        """Best encoding the client accepts: Brotli, then gzip, then none."""
+        for coding in ('br', 'gzip'):
+            if coding in self.variants and accept_encodings[coding]:
+                return coding
+        return 'identity'
 
-        // Improved geocoding function
-        async function updateMapWithAddress(address) {
-            try {
-                // First try with the full address
-                let response = await axios.get(`https://nominatim.openstreetmap.org/search`, {
-                    params: {
-                        q: address,
-                        format: 'json',
-                        limit: 1,
-                        addressdetails: 1
-                    },
-                    headers: {
-                        'User-Agent': 'Emergency Dispatch System'
-                    }
-                });
-
-                if (!response.data.length) {
-                    // If no results, try with just the street address part
-                    const streetAddress = address.split(',')[0];
-                    response = await axios.get(`https://nominatim.openstreetmap.org/search`, {
-                        params: {
-                            q: streetAddress + ', New York, NY',  // Append New York by default
-                            format: 'json',
-                            limit: 1,
-                            addressdetails: 1
-                        },
-                        headers: {
-                            'User-Agent': 'Emergency Dispatch System'
-                        }
-                    });
-                }
-
-                if (response.data && response.data.length > 0) {
-                    const { lat, lon } = response.data[0];
-                    
-                    // Convert to numbers and check if they're valid
-                    const latitude = parseFloat(lat);
-                    const longitude = parseFloat(lon);
-                    
-                    if (!isNaN(latitude) && !isNaN(longitude)) {
-                        // Update map view
-                        map.setView([latitude, longitude], 18);  // Increased zoom level for better detail
-                        
-                        // Remove existing marker if any
-                        if (marker) {
-                            marker.remove();
-                        }
-                        
-                        // Add new marker with pulse animation
-                        const pulsingIcon = L.divIcon({
-                            className: 'pulsing-marker',
-                            html: '<div class="pulse"></div>',
-                            iconSize: [20, 20]
-                        });
-                        
-                        marker = L.marker([latitude, longitude], {
-                            icon: pulsingIcon
-                        }).addTo(map);
-                        
-                        // Add a circle to show approximate area
-                        L.circle([latitude, longitude], {
-                            color: 'red',
-                            fillColor: '#f03',
-                            fillOpacity: 0.2,
-                            radius: 50
-                        }).addTo(map);
-                        
-                        // Add popup with address information
-                        marker.bindPopup(`
-                            <strong>Emergency Location</strong><br>
-                            ${address}<br>
-                            <small>Lat: ${latitude.toFixed(6)}<br>Long: ${longitude.toFixed(6)}</small>
-                        `).openPopup();
-                        
-                        // Update emergencySummary with precise location
-                        emergencySummary.location = address;
-                        emergencySummary.coordinates = `${latitude.toFixed(6)}, ${longitude.toFixed(6)}`;
-                    }
-                }
-            } catch (error) {
-                console.error('Error geocoding address:', error);
-            }
-        }
+class AssetBundle:
+    """Dashboard assets, built and compressed once instead of rendered per request.
 
-        // Add CSS for pulsing marker
-        const style = document.createElement('style');
-        style.textContent = `
-            .pulsing-marker {
-                position: relative;
-            }
-            
-            .pulse {
-                display: block;
-                width: 20px;
-                height: 20px;
-                border-radius: 50%;
-                background: #ff3b30;
-                border: 2px solid #fff;
-                cursor: pointer;
-                box-shadow: 0 0 0 rgba(255, 59, 48, 0.4);
-                animation: pulse 2s infinite;
-            }
-            
-            @keyframes pulse {
-                0% {
-                    box-shadow: 0 0 0 0 rgba(255, 59, 48, 0.4);
-                }
-                70% {
-                    box-shadow: 0 0 0 20px rgba(255, 59, 48, 0);
-                }
-                100% {
-                    box-shadow: 0 0 0 0 rgba(255, 59, 48, 0);
-                }
-            }
-        `;
-        document.head.appendChild(style);
-
-        // Emergency type detection with problem identification
-        function detectEmergencyType(text) {
-            const emergencyPatterns = {
-                'MEDICAL': {
-                    pattern: /(heart attack|breathing|unconscious|bleeding|injury|injured|fell|fallen|seizure|stroke|choking|allergic|accident|overdose|pain|medical)/i,
-                    problems: {
-                        'CHOKING': /choking/i,
-                        'HEART_ATTACK': /heart attack/i,
-                        'BREATHING': /(?:difficulty |trouble |can't |not |heavy )breathing/i,
-                        'UNCONSCIOUS': /unconscious|passed out/i,
-                        'BLEEDING': /bleeding/i,
-                        'INJURY': /injury|injured|fell|fallen/i
-                    }
-                },
-                'FIRE': {
-                    pattern: /(fire|smoke|burning|flames|gas leak|explosion)/i,
-                    problems: {
-                        'STRUCTURE_FIRE': /building|house|apartment|structure|room on fire/i,
-                        'GAS_LEAK': /gas leak/i,
-                        'EXPLOSION': /explosion/i
-                    }
-                },
-                'POLICE': {
-                    pattern: /(break(-| )?in|robbery|theft|assault|weapon|gunshot|fight|domestic|violence|suspicious|burglary|stolen)/i,
-                    problems: {
-                        'BREAK_IN': /break(-| )?in|burglary/i,
-                        'ASSAULT': /assault|fight|violence/i,
-                        'WEAPON': /weapon|gunshot|gun|knife/i
-                    }
-                }
-            };
-
-            for (let [type, data] of Object.entries(emergencyPatterns)) {
-                if (data.pattern.test(text)) {
-                    // Check for specific problems
-                    for (let [problem, pattern] of Object.entries(data.problems)) {
-                        if (pattern.test(text)) {
-                            emergencySummary.problem = problem.replace(/_/g, ' ');
-                            return type;
-                        }
-                    }
-                    return type;
-                }
-            }
-            return null;
-        }
+    The stylesheet and script get content-hash filenames, so they can be cached
+    forever: a change produces a new name, and the page links to it. The page
+    itself is revalidated on every load, which costs a 304 when nothing changed.
+    """
 
-        // Update AI summary
-        function updateAISummary(data) {
-            const type = detectEmergencyType(data.message);
-            if (type) emergencySummary.type = type;
-            
-            const address = findAddress(data.message);
-            if (address) emergencySummary.location = address;
+    IMMUTABLE = 'public, max-age=31536000, immutable'
 
-            // Victim status detection
-            const victimStatusMatch = data.message.match(/(conscious|unconscious|breathing|not breathing|responsive|unresponsive|bleeding|stable|critical|awake|alert|confused|dizzy)/i);
-            if (victimStatusMatch) {
-                emergencySummary.victim_status = victimStatusMatch[0];
-            }
+    def __init__(self, html, assets, prefix='/assets/'):
+        self.assets = {}
+        links = {}
+        for key, (filename, content_type, text) in assets.items():
+            body = text.encode('utf-8')
+            digest = hashlib.sha256(body).hexdigest()[:16]
+            stem, ext = os.path.splitext(filename)
+            name = f"{stem}.{digest}{ext}"
+            self.assets[name] = StaticAsset(body, content_type, digest)
+            links[key] = prefix + name
+        page = html.format(**links).encode('utf-8')
+        self.page = StaticAsset(page, 'text/html; charset=utf-8',
+                                hashlib.sha256(page).hexdigest()[:16])
 
-            // Key details detection
-            const keyDetailPatterns = [
-                /multiple victims/i,
-                /weapon present/i,
-                /children involved/i,
-                /elderly person/i,
-                /heavy smoke/i,
-                /spreading quickly/i
-            ];
-
-            keyDetailPatterns.forEach(pattern => {
-                const match = data.message.match(pattern);
-                if (match) {
-                    emergencySummary.key_details.add(match[0]);
-                }
-            });
-
-            // Generate summary HTML
-            let summaryHTML = '<div class="ai-summary">';
-            if (emergencySummary.type) summaryHTML += `<strong>Type:</strong> ${emergencySummary.type}<br>`;
-            if (emergencySummary.problem) summaryHTML += `<strong>Problem:</strong> ${emergencySummary.problem}<br>`;
-            if (emergencySummary.location) summaryHTML += `<strong>Location:</strong> ${emergencySummary.location}<br>`;
-            if (emergencySummary.victim_status) summaryHTML += `<strong>Status:</strong> ${emergencySummary.victim_status}<br>`;
-            
-            if (emergencySummary.key_details.size > 0) {
-                summaryHTML += '<strong>Key Details:</strong><ul>';
-                emergencySummary.key_details.forEach(detail => {
-                    summaryHTML += `<li>${detail}</li>`;
-                });
-                summaryHTML += '</ul>';
-            }
-            summaryHTML += '</div>';
+    def resolve(self, name, accept_encoding=None, if_none_match=None):
+        """(status, headers, body) for the page (name None) or a named asset.
 
-            document.getElementById('aiSummary').innerHTML = summaryHTML;
-        }
+        Picks the best variant the client accepts, or answers 304 if its copy is current.
+        """
+        asset = self.page if name is None else self.assets.get(name)
+        if asset is None:
+            return 404, [('Content-Type', 'text/plain')], b"Not found"
+        coding = asset.negotiate(parse_accept_header(accept_encoding))
+        etag = f"{asset.digest}-{coding}"
+        headers = [('Vary', 'Accept-Encoding'), ('ETag', f'"{etag}"'),
+                   ('Cache-Control', 'no-cache' if name is None else self.IMMUTABLE)]
+        if parse_etags(if_none_match).contains(etag):
+            return 304, headers, b''
+        headers.append(('Content-Type', asset.content_type))
+        if coding != 'identity':
+            headers.append(('Content-Encoding', coding))
+        return 200, headers, asset.variants[coding]
 
-        // Update dispatch status
-        function updateDispatchStatus(text) {
-            const type = detectEmergencyType(text);
-            if (type && !emergencyType) {
-                emergencyType = type;
-            }
+    def response(self, name):
+        status, headers, body = self.resolve(name, request.headers.get('Accept-Encoding'),
+                                             request.headers.get('If-None-Match'))
+        return Response(body, status=status, headers=headers)
 
-            if (emergencyType) {
-                switch (emergencyType) {
-                    case 'MEDICAL':
-                        dispatchedUnits.add('🚑 Ambulance');
-                        if (text.match(/critical|severe|unconscious|not breathing/i)) {
-                            dispatchedUnits.add('🚁 Medical Helicopter');
-                        }
-                        break;
-                    case 'FIRE':
-                        dispatchedUnits.add('🚒 Fire Engine');
-                        dispatchedUnits.add('🚑 Ambulance (Standby)');
-                        if (text.match(/large|spreading|building|structure/i)) {
-                            dispatchedUnits.add('🚒 Additional Fire Units');
-                        }
-                        break;
-                    case 'POLICE':
-                        dispatchedUnits.add('🚓 Police Units');
-                        if (text.match(/weapon|gun|knife|violent|assault/i)) {
-                            dispatchedUnits.add('🚨 SWAT Team');
-                        }
-                        break;
-                }
-
-                const statusHTML = `
-                    <div class="status-emergency">
-                        <span style="font-size: 1.2em">🚨 ${emergencyType} EMERGENCY IN PROGRESS 🚨</span><br>
-                        <strong>Dispatched Units:</strong><br>
-                        ${Array.from(dispatchedUnits).map(unit => `• ${unit}`).join('<br>')}
-                        ${emergencySummary.location ? `<br><strong>Location:</strong> ${emergencySummary.location}` : ''}
-                    </div>
-                `;
-                document.getElementById('dispatchStatus').innerHTML = statusHTML;
-            }
-        }
+dashboard = AssetBundle(HTML_TEMPLATE, {
+    'stylesheet': ('dashboard.css', 'text/css; charset=utf-8', DASHBOARD_CSS),
+    'script': ('dashboard.js', 'text/javascript; charset=utf-8', DASHBOARD_JS),
+})
 
-        // Socket event handlers
-        socket.on('transcript_update', function(data) {
-            // Update transcript
-            const transcript = document.getElementById('transcript');
-            const message = document.createElement('div');
-            message.className = 'message';
-            message.innerHTML = `
-                <span class="timestamp">${data.timestamp}</span>
-                <br>
-                <span class="${data.role}">${data.role}: ${data.message}</span>
-            `;
-            transcript.appendChild(message);
-            transcript.scrollTop = transcript.scrollHeight;
-            
-            // Check for address
-            const address = findAddress(data.message);
-            if (address) {
-                emergencySummary.location = address;
-                updateMapWithAddress(address);
-            }
-            
-            // Update other components
-            updateDispatchStatus(data.message);
-            updateAISummary(data);
-        });
+# Flask routes
+def calls_stats(manager):
+    """Everything /calls reports, for either call manager."""
+    stats = manager.stats()
+    stats['pool'] = session_pool.stats()
+    stats['endpoints'] = call_policy.stats()
+    stats['scheduler'] = scheduler.stats()
+    stats['events'] = event_hub.stats()
+    stats['archive'] = call_archive.stats()
+    stats['search'] = transcript_index.stats()
+    return stats
 
-        // Initialize everything when page loads
-        window.onload = function() {
-            initMap();
-        };
+def metrics_text(stats):
+    """Stage latency histograms and call counters in the Prometheus text format."""
+    body = stage_metrics.prometheus() + call_policy.prometheus() + scheduler.prometheus()
+    body += "# TYPE dispatcher_active_calls gauge\n"
+    body += f"dispatcher_active_calls {stats['active_calls']}\n"
+    body += "# TYPE dispatcher_calls_started_total counter\n"
+    body += f"dispatcher_calls_started_total {stats['calls_started']}\n"
+    body += "# TYPE dispatcher_calls_rejected_total counter\n"
+    body += f"dispatcher_calls_rejected_total {stats['calls_rejected']}\n"
+    events = event_hub.stats()
+    body += "# TYPE dispatcher_emitted_messages_total counter\n"
+    body += "".join(f'dispatcher_emitted_messages_total{{event="{event}"}} {e["messages"]}\n'
+                    for event, e in sorted(events['by_event'].items()))
+    body += "# TYPE dispatcher_emitted_bytes_total counter\n"
+    body += "".join(f'dispatcher_emitted_bytes_total{{event="{event}"}} {e["bytes"]}\n'
+                    for event, e in sorted(events['by_event'].items()))
+    return body
 
-        // Emergency button handler
-        document.getElementById('emergencyButton').addEventListener('click', function() {
-            callActive = !callActive;
-            this.textContent = callActive ? 'End Emergency Call' : 'Start Emergency Call';
-            this.classList.toggle('active');
-            
-            if (callActive) {
-                socket.emit('start_call');
-                document.getElementById('dispatchStatus').innerHTML = '<div class="status-active">Call Active - Awaiting Details</div>';
-                // Reset all tracking variables
-                emergencyType = null;
-                dispatchedUnits.clear();
-                emergencySummary = {
-                    type: null,
-                    location: null,
-                    problem: null,
-                    victim_status: null,
-                    key_details: new Set()
-                };
-                if (marker) marker.remove();
-                map.setView([40.7128, -74.0060], 13);
-            } else {
-                socket.emit('end_call');
-                document.getElementById('dispatchStatus').innerHTML = '<div class="status-active">Call Ended</div>';
-            }
-        });
-    </script>
-</body>
-</html>
-"""
+def archive_range(args):
+    """The ?since=&until= Unix time range of an archive request; malformed bounds are ignored."""
+    bounds = []
+    for name in ('since', 'until'):
+        try:
+            bounds.append(float(args[name]))
+        except (KeyError, ValueError):
+            bounds.append(None)
+    return tuple(bounds)
+
+def json_resource(data, status=200):
+    return json.dumps(data, default=str).encode('utf-8'), status, [('Content-Type', 'application/json')]
+
+def archive_resource(path, args):
+    """(body, status, headers) for /archive, /archive/<call_id> and /archive/<call_id>/audio,
+    for either server."""
+    since, until = archive_range(args)
+    if path == '/archive':
+        return json_resource(call_archive.calls(since, until))
+    call_id = path[len('/archive/'):]
+    if call_id.endswith('/audio'):
+        audio = call_archive.audio(call_id[:-len('/audio')], since, until)
+        return encode_wav(audio, 16000), 200, [('Content-Type', 'audio/wav')]
+    return json_resource(call_archive.events(call_id, since, until))
+
+def search_resource(args):
+    """(body, status, headers) for /search: archived calls matching ?q= (words and
+    "quoted phrases"), optionally filtered by ?type=, ?role=, ?since= and ?until=."""
+    role = args.get('role')
+    if role not in (None, *SEARCH_ROLES):
+        return json_resource({'error': f"role must be one of: {', '.join(SEARCH_ROLES)}"}, 400)
+    try:
+        limit = int(args.get('limit', 20))
+    except ValueError:
+        limit = 20
+    return json_resource(transcript_index.search(args.get('q', ''), *archive_range(args),
+                                                 emergency_type=args.get('type'), role=role,
+                                                 limit=limit))
 
-# Flask routes
 @app.route('/')
 def home():
-    return render_template_string(HTML_TEMPLATE)
+    return dashboard.response(None)
+
+@app.route('/assets/<name>')
+def assets(name):
+    return dashboard.response(name)
+
+@app.route('/calls')
+def calls():
+    return jsonify(calls_stats(session_manager))
+
+@app.route('/units')
+def units():
+    return jsonify(unit_roster.stats())
+
+@app.route('/metrics')
+def metrics():
+    return Response(metrics_text(session_manager.stats()), mimetype='text/plain; version=0.0.4')
+
+@app.route('/archive')
+def archived_calls():
+    return Response(*archive_resource(request.path, request.args))
+
+@app.route('/archive/<call_id>')
+def archived_call(call_id):
+    return Response(*archive_resource(request.path, request.args))
+
+@app.route('/archive/<call_id>/audio')
+def archived_audio(call_id):
+    return Response(*archive_resource(request.path, request.args))
+
+@app.route('/search')
+def search_calls():
+    return Response(*search_resource(request.args))
+
+@socketio.on('unit_status')
+def handle_unit_status(data):
+    """Status or position report from a unit (or a CAD feed standing in for one)."""
+    try:
+        unit_roster.update(data['unit_id'], status=data.get('status'),
+                           lat=data.get('lat'), lon=data.get('lon'))
+    except KeyError:
+        socketio.emit('unit_status_error', {'unit_id': data.get('unit_id')}, to=request.sid)
 
 @socketio.on('start_call')
-def handle_start_call():
-    global dispatcher
-    dispatcher = EmergencyDispatcher()
-    thread = threading.Thread(target=dispatcher.run)
-    thread.daemon = True
-    thread.start()
+def handle_start_call(data=None):
+    """Start a call. With `{'audio': 'network'}` the caller's audio arrives as audio_frame events;
+    otherwise the server's microphone is used."""
+    options = {}
+    if (data or {}).get('audio') == 'network':
+        options['audio_source'] = NetworkAudioSource()
+    if session_manager.start_call(request.sid, **options) is None:
+        socketio.emit('call_rejected', {
+            'reason': 'Dispatcher at capacity, please retry',
+            'timestamp': time.strftime('%H:%M:%S')
+        }, to=request.sid)
+
+@socketio.on('audio_frame')
+def handle_audio_frame(data):
+    """Binary int16 mono PCM from a remote caller: {'seq', 'sample_rate', 'pcm'}."""
+    source = getattr(session_manager.get(request.sid), 'audio_source', None)
+    if isinstance(source, NetworkAudioSource):
+        source.push(data['seq'], data['pcm'], data.get('sample_rate', 16000))
+
+@socketio.on('supervise')
+def handle_supervise(data=None):
+    """Opt this console in to (or out of) every call's events."""
+    if (data or {}).get('enabled', True):
+        join_room(SUPERVISOR_ROOM)
+    else:
+        leave_room(SUPERVISOR_ROOM)
 
 @socketio.on('end_call')
 def handle_end_call():
-    if hasattr(dispatcher, 'cleanup'):
-        dispatcher.cleanup()
+    session_manager.end_call(request.sid)
+
+@socketio.on('disconnect')
+def handle_disconnect(reason=None):
+    session_manager.end_call(request.sid)
+
+# Async server mode: the same dashboard and events, with every call on one event loop
+async_sio = AsyncServer(async_mode='asgi')
+async_manager = AsyncCallManager()
+
+@async_sio.on('start_call')
+async def async_handle_start_call(sid, data=None):
+    """Start a call. In async mode the caller's audio always arrives as audio_frame events."""
+    if async_manager.start_call(sid) is None:
+        await async_sio.emit('call_rejected', {
+            'reason': 'Dispatcher at capacity, please retry',
+            'timestamp': time.strftime('%H:%M:%S')
+        }, to=sid)
+
+@async_sio.on('audio_frame')
+async def async_handle_audio_frame(sid, data):
+    dispatcher = async_manager.get(sid)
+    if dispatcher is not None:
+        dispatcher.audio_source.push(data['seq'], data['pcm'], data.get('sample_rate', 16000))
+
+@async_sio.on('unit_status')
+async def async_handle_unit_status(sid, data):
+    try:
+        unit_roster.update(data['unit_id'], status=data.get('status'),
+                           lat=data.get('lat'), lon=data.get('lon'))
+    except KeyError:
+        await async_sio.emit('unit_status_error', {'unit_id': data.get('unit_id')}, to=sid)
+
+@async_sio.on('supervise')
+async def async_handle_supervise(sid, data=None):
+    if (data or {}).get('enabled', True):
+        await async_sio.enter_room(sid, SUPERVISOR_ROOM)
+    else:
+        await async_sio.leave_room(sid, SUPERVISOR_ROOM)
+
+@async_sio.on('end_call')
+async def async_handle_end_call(sid):
+    await async_manager.end_call(sid)
+
+@async_sio.on('disconnect')
+async def async_handle_disconnect(sid, reason=None):
+    await async_manager.end_call(sid)
+
+async def async_http_app(scope, receive, send):
+    """The dashboard, its assets, /calls, /metrics, /units, /archive and /search for async mode."""
+    if scope['type'] != 'http':
+        return
+    args = dict(urllib.parse.parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+    headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+               for name, value in scope['headers']}
+    path = scope['path']
+    if path == '/' or path.startswith('/assets/'):
+        name = None if path == '/' else path[len('/assets/'):]
+        status, response_headers, body = dashboard.resolve(name, headers.get('accept-encoding'),
+                                                           headers.get('if-none-match'))
+    elif path in ('/calls', '/units'):
+        stats = calls_stats(async_manager) if path == '/calls' else unit_roster.stats()
+        status, response_headers = 200, [('Content-Type', 'application/json')]
+        body = json.dumps(stats, default=str).encode('utf-8')
+    elif path == '/metrics':
+        status, response_headers = 200, [('Content-Type', 'text/plain; version=0.0.4')]
+        body = metrics_text(async_manager.stats()).encode('utf-8')
+    elif path == '/archive' or path.startswith('/archive/'):
+        # Reads from disk, so off the loop
+        body, status, response_headers = await asyncio.get_running_loop().run_in_executor(
+            None, archive_resource, path, args)
+    elif path == '/search':
+        body, status, response_headers = await asyncio.get_running_loop().run_in_executor(
+            None, search_resource, args)
+    else:
+        status, response_headers, body = 404, [('Content-Type', 'text/plain')], b"Not found"
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(k.encode('latin-1'), v.encode('latin-1')) for k, v in response_headers]})
+    await send({'type': 'http.response.body', 'body': body})
+
+def bind_async_events():
+    """Route EventHub emits through the async server once its loop is running."""
+    event_hub.server = AsyncEmitter(async_sio, asyncio.get_running_loop())
+
+asgi_app = ASGIApp(async_sio, other_asgi_app=async_http_app, on_startup=bind_async_events)
 
 if __name__ == "__main__":
-    socketio.run(app, debug=True)
+    parser = argparse.ArgumentParser(description="Emergency AI 911 dispatcher")
+    parser.add_argument('--async', dest='async_mode', action='store_true',
+                        help="Hold every call on one asyncio event loop (requires uvicorn)")
+    parser.add_argument('--debug', action='store_true',
+                        help="Run Flask's debugger and reloader (never on a reachable host)")
+    args = parser.parse_args()
+    try:
+        if args.async_mode:
+            import uvicorn  # Optional, only needed for async mode
+            call_archive.open()
+            transcript_index.open()
+            uvicorn.run(asgi_app, host='127.0.0.1', port=5000)
+        else:
+            debug = args.debug
+            if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+                # The debug reloader also runs this in its watcher process; only the server
+                # writes the archive and index or pre-builds sessions
+                call_archive.open()
+                transcript_index.open()
+                session_pool.start()
+            socketio.run(app, debug=debug)
+    finally:
+        transcript_index.close()
+        call_archive.close()
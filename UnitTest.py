@@ -1,11 +1,28 @@
 import pytest
 import numpy as np
-from Main import EmergencyDispatcher
+from Main import (EmergencyDispatcher, CallSessionManager, SentenceSplitter, StageQueue,
+                  AudioRingBuffer, encode_wav, AdaptiveVAD, PhraseCache, IncidentState,
+                  incident_classifier, address_parser, Geocoder, GeocodeCache,
+                  GazetteerProvider, UnitRoster, Unit, demo_roster, WavReplaySource,
+                  StageMetrics, NULL_SPAN, AudioPlayer, EchoGate,
+                  heard_prefix, JitterBuffer, Resampler, NetworkAudioSource, SessionPool,
+                  CallPolicy, EndpointPolicy, CircuitBreaker, CircuitOpenError,
+                  PriorityScheduler, EndpointBudget, SchedulerTimeout, AsyncCallManager)
+import Main
+import io
 import re
+import gzip
+import wave
 import sounddevice as sd
-import tempfile
 import os
-from unittest.mock import Mock, patch
+import threading
+import asyncio
+import contextlib
+import time
+import json
+import openai
+from unittest.mock import AsyncMock, Mock, patch
+from types import SimpleNamespace
 
 @pytest.fixture(autouse=True)
 def mock_flask_app():
@@ -15,6 +32,18 @@ def mock_flask_app():
          patch('Main.OpenAI'):
         yield
 
+@pytest.fixture(autouse=True)
+def offline_geocoder():
+    """Geocode against an empty in-memory gazetteer: no network, no cache file"""
+    with patch('Main.geocoder', Geocoder([], GeocodeCache())):
+        yield
+
+def framed(mock_socketio, kind):
+    """Every coalesced `kind` update sent in a frame, after flushing pending frames."""
+    Main.event_hub.flush()
+    return [call.args[1][kind] for call in mock_socketio.emit.call_args_list
+            if call.args[0] == 'frame' and kind in call.args[1]]
+
 class TestEmergencyDispatcher:
     @pytest.fixture
     def dispatcher(self):
@@ -44,20 +73,26 @@ class TestEmergencyDispatcher:
     ])
     def test_emergency_classification(self, text, expected_type):
         """Test emergency type detection from text"""
-        emergency_patterns = {
-            'MEDICAL': r'(heart attack|breathing|unconscious|bleeding|injury|injured|fell|fallen|seizure|stroke|choking|allergic|accident|overdose|pain|medical)',
-            'FIRE': r'(fire|smoke|burning|flames|gas leak|explosion)',
-            'POLICE': r'(break(-| )?in|robbery|theft|assault|weapon|gunshot|fight|domestic|violence|suspicious|burglary|stolen)'
-        }
-
-        detected_type = None
-        for type_, pattern in emergency_patterns.items():
-            if re.search(pattern, text, re.IGNORECASE):
-                detected_type = type_
-                break
-
+        detected_type = incident_classifier.classify(text)['type']
         assert detected_type == expected_type, f"Emergency type detection failed for: {text}"
 
+    def test_incident_update_emitted_per_utterance(self, dispatcher):
+        """Test caller utterances build up a structured incident summary on the server"""
+        with patch('Main.socketio') as mock_socketio, patch.object(dispatcher, 'speak'):
+            dispatcher.handle_input("My father is not breathing, he's unconscious")
+            dispatcher.handle_input("There's also an elderly person here, she fell")
+            updates = framed(mock_socketio, 'incident')
+
+        assert len(updates) == 2
+        assert updates[0]['type'] == 'MEDICAL'
+        assert updates[0]['problem'] == 'BREATHING'
+        assert updates[0]['victim_status'] == 'not breathing'
+        assert updates[0]['units'] == ['🚑 Ambulance', '🚁 Medical Helicopter']
+        assert updates[0]['severity'] == 'critical'
+        assert updates[1]['problem'] == 'INJURY'
+        assert updates[1]['key_details'] == ['elderly person']
+        assert 'type' not in updates[1], "Only changed fields are sent"
+
     @pytest.mark.parametrize("text,expected_address", [
         ("I'm at 123 Main Street, New York", "123 Main Street"),
         ("The location is 456 Park Avenue, Brooklyn", "456 Park Avenue"),
@@ -66,46 +101,49 @@ class TestEmergencyDispatcher:
     ])
     def test_address_extraction(self, text, expected_address):
         """Test address extraction from text"""
-        address_patterns = [
-            r'at\s+([\d]+[\w\s,.-]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|Terr|Terrace)[\w\s,.-]+)',
-            r'on\s+([\d]+[\w\s,.-]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|Terr|Terrace)[\w\s,.-]+)',
-            r'(?:location|address|place) is\s+([\d]+[\w\s,.-]+(?:street|st|avenue|ave|road|rd|boulevard|blvd|lane|ln|drive|dr|circle|cir|court|ct|way|parkway|pkwy|terr|terrace)[\w\s,.-]+)'
-        ]
-
-        found_address = None
-        for pattern in address_patterns:
-            match = re.search(pattern, text, re.IGNORECASE)
-            if match:
-                found_address = match.group(1).strip()
-                break
+        address = address_parser.parse(text)
+        found_address = address_parser.format(address) if address and address['number'] else None
 
         if expected_address:
             assert found_address and expected_address in found_address, f"Address extraction failed for: {text}"
         else:
             assert found_address is None, f"False positive address detection in: {text}"
 
+    def test_address_tracked_across_utterances(self, dispatcher):
+        """Test a house number and street said in separate utterances become current_address"""
+        with patch('Main.socketio') as mock_socketio, patch.object(dispatcher, 'speak'):
+            dispatcher.handle_input("Please hurry, I'm at 42")
+            assert dispatcher.current_address is None
+            dispatcher.handle_input("It's on Elm Street, Queens")
+            updates = framed(mock_socketio, 'incident')
+
+        assert dispatcher.current_address == "42 Elm Street, Queens"
+        assert updates[-1]['location'] == "42 Elm Street, Queens"
+
+    def test_locate_emits_location_update(self, dispatcher):
+        """Test geocoded coordinates are pushed to the frontend for the current address"""
+        dispatcher.current_address = "42 Elm Street"
+        with patch('Main.geocoder') as mock_geocoder, patch('Main.socketio') as mock_socketio:
+            mock_geocoder.geocode.return_value = {'lat': 40.7, 'lon': -73.8}
+            dispatcher.locate("42 Elm Street")
+
+        event, data = mock_socketio.emit.call_args.args
+        assert event == 'location_update'
+        assert (data['lat'], data['lon']) == (40.7, -73.8)
+        assert dispatcher.incident.coordinates == [40.7, -73.8]
+
     def test_cleanup(self, dispatcher):
         """Test cleanup process"""
-        # Create some temporary files
-        temp_files = []
-        for i in range(3):
-            fd, path = tempfile.mkstemp(dir=dispatcher.temp_dir)
-            os.close(fd)
-            temp_files.append(path)
-
-        # Run cleanup
         dispatcher.cleanup()
 
-        # Verify cleanup
-        assert not os.path.exists(dispatcher.temp_dir), "Temporary directory should be removed"
-        for path in temp_files:
-            assert not os.path.exists(path), f"Temporary file {path} should be removed"
+        assert not dispatcher.call_in_progress
+        assert dispatcher.tts_queue.closed and dispatcher.frame_queue.closed, "Pipeline stages should be closed"
 
     def test_audio_recording_state(self, dispatcher, mock_audio_data):
         """Test audio recording state management"""
         # Test initial state
         assert not dispatcher.is_recording
-        assert len(dispatcher.speech_frames) == 0
+        assert dispatcher.current_utterance() is None
 
         # Simulate speech detection
         dispatcher.detect_speech(mock_audio_data)
@@ -122,12 +160,1081 @@ class TestEmergencyDispatcher:
         test_audio = np.random.rand(samples).astype(np.int16)
         
         with patch.object(dispatcher, 'handle_input') as mock_handle_input:
-            dispatcher.speech_frames = [test_audio]
+            dispatcher.ring.write(test_audio)
+            dispatcher.is_recording = True
+            dispatcher.utterance_start = 0
             dispatcher.process_recorded_speech()
             
             # Check if handle_input was called based on expected_process
             assert mock_handle_input.called == expected_process, \
                 f"Audio processing for length {audio_length}s should {'not ' if not expected_process else ''}trigger handling"
 
+    def test_streamed_response(self, dispatcher):
+        """Test streamed tokens are emitted as partials and spoken sentence by sentence"""
+        stream = dispatcher.client.beta.threads.runs.stream.return_value.__enter__.return_value
+        stream.text_deltas = ["Help is ", "on the way. Stay ", "on the line."]
+
+        with patch('Main.socketio') as mock_socketio, \
+             patch.object(dispatcher, 'text_to_speech') as mock_tts:
+            dispatcher.handle_input("There's a fire!")
+
+        spoken = [call.args[0] for call in mock_tts.call_args_list]
+        assert spoken == ["Help is on the way.", "Stay on the line."]
+        events = [call.args for call in mock_socketio.emit.call_args_list]
+        # Streamed tokens are batched into frames, all sent before the final message
+        tokens = [data['tokens'] for event, data in events[:-1] if event == 'frame' and 'tokens' in data]
+        assert ''.join(tokens) == "Help is on the way. Stay on the line." and len(tokens) < 3
+        events = [data for _, data in events]
+        assert events[-1]['message'] == "Help is on the way. Stay on the line."
+        assert not dispatcher.client.beta.threads.runs.retrieve.called
+
+    def test_audio_callback_only_enqueues(self, dispatcher):
+        """Test the real-time callback never does transcription work itself"""
+        loud = np.full((dispatcher.chunk_samples, 1), 2000, dtype=np.int16)
+        with patch.object(dispatcher, 'transcribe') as mock_transcribe:
+            for _ in range(5):
+                dispatcher.audio_callback(loud, dispatcher.chunk_samples, None, None)
+        assert not mock_transcribe.called
+        assert dispatcher.frame_queue.stats()['depth'] == 5
+
+    def test_pipeline_processes_utterances_in_order(self, dispatcher):
+        """Test utterances flow through segmenter, transcription and dialogue stages"""
+        loud = np.full((dispatcher.chunk_samples, 1), 2000, dtype=np.int16)
+        quiet = np.zeros((dispatcher.chunk_samples, 1), dtype=np.int16)
+        silence_chunks = int(dispatcher.silence_duration / dispatcher.chunk_duration)
+        transcripts = iter(["first", "second"])
+
+        with patch.object(dispatcher, 'transcribe', side_effect=lambda audio, since=None: next(transcripts)), \
+             patch.object(dispatcher, 'handle_input') as mock_handle_input, \
+             patch.object(dispatcher, 'text_to_speech'):
+            dispatcher.start_pipeline()
+            for _ in range(2):
+                for chunk in [loud] * 4 + [quiet] * silence_chunks:
+                    dispatcher.audio_callback(chunk, dispatcher.chunk_samples, None, None)
+            deadline = time.time() + 2
+            while mock_handle_input.call_count < 2 and time.time() < deadline:
+                time.sleep(0.01)
+            dispatcher.cleanup()
+
+        assert [call.args[0] for call in mock_handle_input.call_args_list] == ["first", "second"]
+
+    def test_long_speech_is_force_segmented(self, dispatcher):
+        """Test continuous noise is cut at the maximum utterance length with pre-roll kept"""
+        dispatcher.max_utterance_duration = 1.0
+        loud = np.full((dispatcher.chunk_samples, 1), 2000, dtype=np.int16)
+        quiet = np.zeros((dispatcher.chunk_samples, 1), dtype=np.int16)
+        segments = []
+
+        with patch.object(dispatcher, 'transcribe', side_effect=lambda audio, since=None: segments.append(audio.copy())), \
+             patch.object(dispatcher, 'handle_input'):
+            dispatcher.start_pipeline()
+            for chunk in [quiet] * 10 + [loud] * 50:
+                dispatcher.audio_callback(chunk, dispatcher.chunk_samples, None, None)
+            deadline = time.time() + 2
+            while len(segments) < 2 and time.time() < deadline:
+                time.sleep(0.01)
+            dispatcher.cleanup()
+
+        preroll = int(dispatcher.preroll_duration * dispatcher.sample_rate)
+        assert [len(s) for s in segments[:2]] == [dispatcher.sample_rate] * 2
+        assert not segments[0][:preroll].any(), "Pre-roll should hold the audio before onset"
+        assert segments[0][preroll:].all()
+
+    def test_transcription_upload_stays_in_memory(self, dispatcher, mock_audio_data):
+        """Test utterances are uploaded as an in-memory WAV without touching disk"""
+        transcriptions = dispatcher.client.audio.transcriptions
+        transcriptions.create.return_value = "Help"
+
+        assert dispatcher.transcribe(mock_audio_data) == "Help"
+
+        filename, body, mime_type = transcriptions.create.call_args.kwargs['file']
+        assert (filename, mime_type) == ('speech.wav', 'audio/wav')
+        with wave.open(io.BytesIO(body)) as wf:
+            assert wf.getframerate() == dispatcher.sample_rate
+            assert np.array_equal(np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16),
+                                  mock_audio_data)
+
+    def test_tts_streams_and_caches_phrases(self, dispatcher):
+        """Test TTS audio is played chunk by chunk and repeated phrases skip the API"""
+        speech = dispatcher.client.audio.speech.with_streaming_response.create
+        speech.return_value.__enter__.return_value.iter_bytes.return_value = [b"\x01\x00\x02", b"\x00"]
+
+        with patch.object(Main, 'phrase_cache', PhraseCache()), \
+             patch.object(dispatcher, 'player') as mock_player:
+            mock_player.interrupted.is_set.return_value = False
+            mock_player.write.side_effect = len
+            dispatcher.text_to_speech("Stay on the line.")
+            dispatcher.text_to_speech("Stay on the line.")
+
+        assert speech.call_count == 1
+        assert speech.call_args.kwargs['response_format'] == 'pcm'
+        writes = [call.args[0] for call in mock_player.write.call_args_list]
+        assert writes == [b"\x01\x00\x02", b"\x00", b"\x01\x00\x02\x00"]
+
+@pytest.mark.parametrize("text,problem", [
+    ("He's choking on something", "CHOKING"),
+    ("There's a gas leak in the kitchen", "GAS LEAK"),
+    ("Someone broke in, I heard a gunshot", "WEAPON"),
+    ("There was a break-in next door", "BREAK IN"),
+    ("The apartment is on fire", "STRUCTURE FIRE"),
+])
+def test_incident_problem_classification(text, problem):
+    """Test problem detection within the detected emergency type"""
+    assert incident_classifier.classify(text)['problem'] == problem
+
+def test_incident_classifier_word_boundaries():
+    """Test keywords only match whole words ("painting" is not "pain")"""
+    assert incident_classifier.classify("I was painting the fellowship hall")['type'] is None
+
+@pytest.mark.parametrize("text,expected", [
+    ("12 Oak St., Springfield, IL please", "12 Oak Street, Springfield, IL"),
+    ("I have 2 kids on the way, we're at 9 West 42nd Street", "9 West 42nd Street"),
+    ("send someone to 5th Avenue", "5th Avenue"),
+])
+def test_address_parser_formats(text, expected):
+    """Test suffix normalisation, city/state pickup and streets without numbers"""
+    assert address_parser.format(address_parser.parse(text)) == expected
+
+def test_address_parser_is_linear_on_run_on_text():
+    """Test a long transcript without an address parses quickly"""
+    text = " ".join(["at 123 then on 45 and"] * 4000)
+    start = time.perf_counter()
+    assert address_parser.parse(text)['street'] is None
+    assert time.perf_counter() - start < 0.5
+
+def test_gazetteer_resolves_prefixes_offline(tmp_path):
+    """Test the offline gazetteer matches normalised addresses and their completions"""
+    path = tmp_path / "gazetteer.csv"
+    path.write_text("address,lat,lon\n"
+                    "42 Elm Street, Queens, NY,40.7,-73.8\n"
+                    "42 Elm Street West, Queens, NY,40.8,-73.9\n")
+    gazetteer = GazetteerProvider(str(path))
+    assert gazetteer.size == 2
+    assert gazetteer.geocode("42 Elm St")['lat'] == 40.7
+    assert gazetteer.geocode("42 Oak Street") is None
+
+def test_geocoder_caches_hits_and_misses(tmp_path):
+    """Test repeated lookups are served from cache, persist to disk and survive a dead network"""
+    provider = Mock()
+    provider.geocode.side_effect = lambda address: {'lat': 1.0, 'lon': 2.0} if 'Elm' in address else None
+    cache_path = str(tmp_path / "cache.sqlite3")
+    geocoder = Geocoder([provider], GeocodeCache(cache_path))
+
+    assert geocoder.geocode("42 Elm Street")['lat'] == 1.0
+    start = time.perf_counter()
+    assert geocoder.geocode("42 elm st")['lat'] == 1.0
+    assert time.perf_counter() - start < 0.001
+    assert geocoder.geocode("1 Nowhere Road") is None
+    assert geocoder.geocode("1 Nowhere Road") is None
+    assert provider.geocode.call_count == 3  # hit once, miss with and without the default region
+
+    offline = Mock()
+    offline.geocode.side_effect = OSError("network unreachable")
+    restarted = Geocoder([offline], GeocodeCache(cache_path))
+    assert restarted.geocode("42 Elm Street")['lon'] == 2.0
+    assert not offline.geocode.called
+
+def test_roster_nearest_matches_brute_force():
+    """Test the grid index returns the same nearest units as a full scan, through status churn"""
+    roster = demo_roster(seed=1)
+    rng = np.random.default_rng(2)
+    ambulances = [u for u in roster.units.values() if u.unit_type == 'AMBULANCE']
+    for unit in ambulances[::3]:
+        roster.update(unit.unit_id, status='DISPATCHED')
+
+    for _ in range(20):
+        lat, lon = 40.55 + rng.random() * 0.35, -74.15 + rng.random() * 0.4
+        result = [u.unit_id for _, u in roster.nearest('AMBULANCE', lat, lon, k=3)]
+        available = [u for u in ambulances if u.status == 'AVAILABLE']
+        expected = sorted(available, key=lambda u: np.hypot((u.lat - lat) * roster.km_per_lat,
+                                                            (u.lon - lon) * roster.km_per_lon))
+        assert result == [u.unit_id for u in expected[:3]]
+
+def test_roster_recommend_assigns_and_releases():
+    """Test recommendations reserve units per call and escalation adds units"""
+    roster = UnitRoster()
+    roster.add(Unit("A-1", "AMBULANCE", 40.70, -74.00))
+    roster.add(Unit("A-2", "AMBULANCE", 40.80, -74.00))
+    roster.add(Unit("H-1", "HELICOPTER", 40.75, -73.90))
+    incident = {'type': 'MEDICAL', 'severity': 'urgent', 'coordinates': [40.71, -74.00]}
+
+    first = roster.recommend(incident, call_id="call-1")
+    assert [u['unit_id'] for u in first] == ["A-1"]
+    assert [u['unit_id'] for u in roster.recommend(incident, call_id="call-2")] == ["A-2"]
+
+    incident['severity'] = 'critical'
+    assert [u['unit_id'] for u in roster.recommend(incident, call_id="call-1")] == ["A-1", "H-1"]
+    roster.release("call-1")
+    assert roster.units["A-1"].status == 'AVAILABLE'
+    assert roster.units["A-2"].status == 'DISPATCHED'
+
+def test_incident_type_is_sticky():
+    """Test the first emergency type detected stays for the rest of the call"""
+    incident = IncidentState()
+    incident.update("There's smoke coming from the building")
+    incident.update("Someone is injured")
+    assert incident.type == 'FIRE'
+    assert '🚒 Additional Fire Units' in incident.units
+
+def test_phrase_cache_evicts_least_recently_used():
+    """Test the phrase cache stays within its byte budget, evicting the oldest phrase"""
+    cache = PhraseCache(max_bytes=10, max_phrase_length=20)
+    cache.put("shimmer", "greeting", b"12345")
+    cache.put("shimmer", "hold", b"1234")
+    assert cache.get("shimmer", "greeting") == b"12345"
+    cache.put("shimmer", "breathing", b"123")
+    assert cache.get("shimmer", "hold") is None
+    assert cache.get("shimmer", "greeting") is not None
+    cache.put("shimmer", "a very long one-off dispatcher answer", b"1")
+    assert cache.stats()['phrases'] == 2
+
+def test_encode_wav_matches_wave_module():
+    """Test the in-memory WAV header is byte-identical to the wave module's"""
+    audio = (np.arange(1600) % 500).astype(np.int16)
+    expected = io.BytesIO()
+    with wave.open(expected, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(16000)
+        wf.writeframes(audio.tobytes())
+    assert encode_wav(audio, 16000) == expected.getvalue()
+
+def voiced_frame(amplitude, samples=800, sample_rate=16000):
+    """A 50 ms vowel-like frame: a few harmonics of 150 Hz"""
+    t = np.arange(samples) / sample_rate
+    tone = sum(np.sin(2 * np.pi * 150 * k * t) / k for k in range(1, 5))
+    return (amplitude * tone).astype(np.int16)
+
+def test_adaptive_vad_tracks_noise_floor():
+    """Test loud stationary noise is absorbed into the floor while speech still registers"""
+    vad = AdaptiveVAD(16000, 0.05)
+    rng = np.random.default_rng(0)
+    noise = [rng.normal(0, 1500, 800).astype(np.int16) for _ in range(60)]
+
+    decisions = [vad.is_speech(frame) for frame in noise]
+    assert not any(decisions[-20:]), "Steady noise should stop counting as speech"
+    assert vad.noise_floor_db > 55
+    assert vad.is_speech(voiced_frame(12000) + noise[0])
+
+def test_adaptive_vad_endpoint_learns_pauses():
+    """Test the turn-end timeout shrinks below silence_duration for a quick talker"""
+    vad = AdaptiveVAD(16000, 0.05, silence_duration=1.5)
+    speech, silence = voiced_frame(8000), np.zeros(800, dtype=np.int16)
+    assert vad.update(speech) is None
+    assert vad.update(speech) == 'onset'
+    for _ in range(4):
+        for frame in [silence] * 6 + [speech] * 4:  # 300 ms pauses between phrases
+            assert vad.update(frame) != 'end'
+
+    assert vad.endpoint_duration() < 1.0
+    events = [vad.update(silence) for _ in range(30)]
+    waited = (events.index('end') + 1) * 0.05
+    assert waited == pytest.approx(vad.endpoint_duration(), abs=0.051)
+
+def test_ring_buffer_views_wrap_without_copying():
+    """Test ring buffer windows stay contiguous across the wrap point"""
+    ring = AudioRingBuffer(10)
+    ring.write(np.arange(8, dtype=np.int16))
+    ring.write(np.arange(8, 14, dtype=np.int16))
+    view = ring.view(6, 14)
+    assert view.tolist() == list(range(6, 14))
+    assert np.shares_memory(view, ring.data)
+    assert not ring.is_valid(3)
+    with pytest.raises(ValueError):
+        ring.view(2, 8)
+
+def test_stage_queue_counts_overflow():
+    """Test a full stage queue drops frames and counts them instead of blocking"""
+    stage = StageQueue('frames', maxsize=2)
+    assert stage.put_nowait(1) and stage.put_nowait(2)
+    assert not stage.put_nowait(3)
+    stats = stage.stats()
+    assert stats['dropped'] == 1
+    assert stats['high_water'] == 2
+
+def test_sentence_splitter_keeps_abbreviations():
+    """Test street abbreviations, and "No." before a number, do not split a sentence"""
+    splitter = SentenceSplitter()
+    assert splitter.feed("Units are headed to 12 Oak St. now. Is he") == ["Units are headed to 12 Oak St. now."]
+    assert splitter.feed(" breathing? ") == ["Is he breathing?"]
+    assert splitter.flush() == ""
+    assert splitter.feed("Go to Gate No. 5 now. No. ") == ["Go to Gate No. 5 now."]
+    assert splitter.feed("Stay on the line.") == ["No."]
+    assert splitter.flush() == "Stay on the line."
+
+def test_replay_source_drives_a_call_end_to_end():
+    """Test a replayed recording is segmented, transcribed and answered faster than real time"""
+    rng = np.random.default_rng(0)
+    t = np.arange(16000) / 16000
+    speech = (8000 * np.sin(2 * np.pi * 220 * t)).astype(np.int16)
+    quiet = rng.normal(0, 30, 32000).astype(np.int16)
+    audio = np.concatenate([quiet, speech, quiet, speech])
+
+    dispatcher = EmergencyDispatcher(call_id="replay", client=Mock(),
+                                     audio_source=WavReplaySource(audio, speed=20.0, drain_timeout=5))
+    dispatcher.client.audio.transcriptions.create.return_value = "Help"
+    with patch.object(dispatcher, 'handle_input') as handle_input:
+        dispatcher.start_pipeline()
+        start = time.time()
+        dispatcher.record_and_process()
+        dispatcher.cleanup()
+
+    assert time.time() - start < len(audio) / 16000
+    assert handle_input.call_count == 2
+    assert dispatcher.pipeline_idle()
+
+def speculative_dispatcher(audio):
+    """Dispatcher replaying `audio` against a mocked assistant that streams one reply."""
+    dispatcher = EmergencyDispatcher(call_id="speculative", client=Mock(),
+                                     audio_source=WavReplaySource(audio, speed=10.0, drain_timeout=5))
+    dispatcher.client.audio.transcriptions.create.return_value = "Help"
+    stream = Mock(text_deltas=iter(["Help is ", "on the way."]))
+    dispatcher.client.beta.threads.runs.stream.return_value.__enter__ = Mock(return_value=stream)
+    dispatcher.client.beta.threads.runs.stream.return_value.__exit__ = Mock(return_value=False)
+    dispatcher.text_to_speech = Mock(return_value=1.0)
+    return dispatcher
+
+def tone(seconds):
+    t = np.arange(int(seconds * 16000)) / 16000
+    return (8000 * np.sin(2 * np.pi * 220 * t)).astype(np.int16)
+
+def test_speculative_turn_is_committed_at_turn_end():
+    """Test the reply started during the pause is used when the caller stays quiet"""
+    quiet = np.zeros(32000, dtype=np.int16)
+    dispatcher = speculative_dispatcher(np.concatenate([quiet, tone(1.0), quiet]))
+    dispatcher.start_pipeline()
+    dispatcher.record_and_process()
+    dispatcher.cleanup()
+
+    threads = dispatcher.client.beta.threads
+    assert dispatcher.speculations == {'started': 1, 'committed': 1}
+    assert dispatcher.client.audio.transcriptions.create.call_count == 1
+    threads.messages.create.assert_called_once()
+    threads.messages.delete.assert_not_called()
+    dispatcher.text_to_speech.assert_called_with("Help is on the way.")
+
+def test_speculative_turn_is_cancelled_when_caller_resumes():
+    """Test speech after the speculative pause removes the speculative message and its reply"""
+    quiet = np.zeros(32000, dtype=np.int16)
+    pause = np.zeros(int(0.6 * 16000), dtype=np.int16)
+    dispatcher = speculative_dispatcher(np.concatenate([quiet, tone(1.0), pause, tone(1.0), quiet]))
+    dispatcher.vad.default_endpoint = 1.0
+    threads = dispatcher.client.beta.threads
+    threads.messages.create.return_value = SimpleNamespace(id='question')
+    threads.messages.list.return_value = SimpleNamespace(data=[SimpleNamespace(id='answer', role='assistant')])
+    dispatcher.start_pipeline()
+    dispatcher.record_and_process()
+    dispatcher.cleanup()
+
+    assert dispatcher.speculations['cancelled'] == 1
+    assert dispatcher.speculations['committed'] == 1
+    assert threads.messages.list.call_args.kwargs['run_id'] is not None  # Only the speculative run's reply
+    deleted = [c.kwargs['message_id'] for c in threads.messages.delete.call_args_list]
+    assert deleted == ['answer', 'question']
+    assert threads.messages.create.call_count == 2
+
+def test_echo_gate_learns_echo_loss():
+    """Test playback echo is gated and the caller talking over it is not"""
+    gate = EchoGate(margin_db=6.0, echo_loss_db=10.0)
+    for _ in range(100):
+        assert not gate.passes(mic_db=50.0, reference_db=70.0)  # 20 dB of echo loss
+    assert gate.echo_loss_db == pytest.approx(20.0, abs=0.2)
+    assert gate.passes(mic_db=57.0, reference_db=70.0)
+    assert gate.passes(mic_db=40.0, reference_db=None)
+
+def test_player_stops_within_a_block():
+    """Test stop() cuts a long write short and drops the device queue"""
+    class SlowStream:
+        stopped = True
+        def start(self): self.stopped = False
+        def write(self, block): time.sleep(len(block) / (2 * 24000))
+        abort = Mock()
+
+    stream = SlowStream()
+    with patch('Main.sd.RawOutputStream', return_value=stream):
+        player = AudioPlayer(24000)
+        threading.Timer(0.1, player.stop).start()
+        start = time.perf_counter()
+        played = player.write(bytes(2 * 24000))  # 1 s of audio
+
+    assert time.perf_counter() - start < 0.15
+    assert 0 < played < 2 * 24000 * 0.15
+    stream.abort.assert_called_once()
+    assert player.write(b"\x00\x00") == 0
+    player.resume()
+    assert player.write(b"\x00\x00") == 2
+
+def test_interrupted_reply_is_recorded_as_heard():
+    """Test a barged-in reply is replaced in the thread by the part the caller heard"""
+    dispatcher = EmergencyDispatcher(call_id="barge", client=Mock())
+    threads = dispatcher.client.beta.threads
+    threads.messages.list.return_value = Mock(data=[Mock(role='assistant', id='msg_full')])
+    dispatcher.begin_reply()
+    dispatcher.spoken.append("Help is on the way.")
+    dispatcher.spoken.append(heard_prefix("Is anyone else inside the building?", 0.5))
+    with patch('Main.socketio'):
+        dispatcher.barge_in()
+    assert dispatcher.player.interrupted.is_set()
+
+    dispatcher.record_interrupted_reply()
+    threads.messages.delete.assert_called_once_with(thread_id=dispatcher.thread.id,
+                                                    message_id='msg_full')
+    content = threads.messages.create.call_args.kwargs['content']
+    assert content == "Help is on the way. Is anyone else... [interrupted by the caller]"
+    assert threads.messages.create.call_args.kwargs['role'] == 'assistant'
+    dispatcher.cleanup()
+
+def test_resampler_streams_48k_to_16k():
+    """Test chunked resampling matches one-shot resampling and keeps the pitch"""
+    t = np.arange(48000) / 48000
+    audio = (10000 * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+
+    whole = Resampler(48000, 16000).process(audio)
+    streaming = Resampler(48000, 16000)
+    pieces = np.concatenate([streaming.process(audio[i:i + 1000]) for i in range(0, 48000, 1000)])
+
+    assert abs(len(whole) - 16000) <= 1
+    assert np.array_equal(whole, pieces)
+    spectrum = np.abs(np.fft.rfft(whole[:16000]))
+    assert abs(np.argmax(spectrum) - 440) <= 1
+
+def test_jitter_buffer_reorders_and_reports_loss():
+    """Test packets come out in order, gaps become LOST, late and duplicate packets are dropped"""
+    jitter = JitterBuffer(delay_packets=2, max_wait=0.05)
+    for seq in (0, 2, 1, 1, 4, 5):
+        jitter.put(seq, seq)
+    out = [jitter.get(timeout=0.1) for _ in range(6)]
+    assert out == [0, 1, 2, JitterBuffer.LOST, 4, 5]
+    jitter.put(3, 3)
+    assert jitter.get(timeout=0.01) is None
+    assert jitter.stats() == {'received': 7, 'buffered': 0, 'late': 1, 'duplicates': 1,
+                              'lost': 1, 'overflows': 0, 'resyncs': 0}
+
+def test_jitter_buffer_conceals_gaps_on_overflow_and_resyncs():
+    """Test a full buffer gives up on the missing packet, not a buffered one, and a restarted sender is followed"""
+    jitter = JitterBuffer(delay_packets=10, max_wait=5, max_packets=3)
+    jitter.put(0, 0)
+    assert jitter.get(timeout=0.01) == 0
+    for seq in (2, 3, 4, 5):  # 1 never arrives and the consumer is not keeping up
+        jitter.put(seq, seq)
+    assert [jitter.get(timeout=0.01) for _ in range(5)] == [JitterBuffer.LOST, 2, 3, 4, 5]
+
+    for seq in (0, 1):  # The sender restarted its sequence numbers
+        jitter.put(seq, f"new-{seq}")
+    assert [jitter.get(timeout=0.01) for _ in range(2)] == ['new-0', 'new-1']
+    assert jitter.stats() == {'received': 7, 'buffered': 0, 'late': 0, 'duplicates': 0,
+                              'lost': 1, 'overflows': 1, 'resyncs': 1}
+
+def test_network_source_feeds_ordered_16k_frames():
+    """Test remote 48 kHz packets reach the dispatcher in order as 50 ms frames at 16 kHz"""
+    source = NetworkAudioSource(jitter_packets=2, max_wait=0.05)
+    frames = []
+    dispatcher = Mock(call_in_progress=True, chunk_samples=800, sample_rate=16000)
+    dispatcher.audio_callback.side_effect = lambda frame, *args: frames.append(frame.copy())
+
+    packets = [np.full(960, seq, dtype='<i2').tobytes() for seq in range(10)]  # 20 ms each
+    for seq in (1, 0, 3, 2, 5, 4, 6, 7, 8, 9):
+        source.push(seq, packets[seq], 48000)
+    threading.Timer(0.3, source.close).start()
+    source.run(dispatcher)
+
+    audio = np.concatenate(frames).reshape(-1)
+    assert all(frame.shape == (800, 1) for frame in frames)
+    assert len(audio) == 2400  # 200 ms in; the low-pass holds back a few samples of the 4th frame
+    levels = audio[20::320]  # One sample per packet, past the filter's ramp-up
+    assert list(levels[:-1]) == sorted(levels[:-1])
+
+def test_run_messages_are_read_incrementally():
+    """Test polling reads only the completed run's messages, forward from a cursor"""
+    dispatcher = EmergencyDispatcher(call_id="cursor", client=Mock())
+    messages = dispatcher.client.beta.threads.messages
+    reply = Mock(id='msg_2', role='assistant', content=[Mock(type='text', text=Mock(value="Stay calm."))])
+    messages.list.return_value = Mock(data=[reply])
+
+    assert dispatcher.fetch_run_messages('run_1') == ["Stay calm."]
+    assert messages.list.call_args.kwargs == {'thread_id': dispatcher.thread.id,
+                                              'run_id': 'run_1', 'order': 'asc'}
+    messages.list.return_value = Mock(data=[])
+    dispatcher.fetch_run_messages('run_2')
+    assert messages.list.call_args.kwargs['after'] == 'msg_2'
+    dispatcher.cleanup()
+
+def test_long_calls_compact_context_into_incident_summary():
+    """Test runs past compact_after_turns send the latest messages plus a structured summary"""
+    dispatcher = EmergencyDispatcher(call_id="compact", client=Mock())
+    dispatcher.compact_after_turns = 2
+    dispatcher.caller_turns = ["There's a fire", "At 42 Elm Street"]
+    assert dispatcher.run_options() == {}
+
+    dispatcher.caller_turns.append("Everyone is out")
+    dispatcher.incident.update("Someone is unconscious")
+    options = dispatcher.run_options()
+    assert options['truncation_strategy'] == {'type': 'last_messages',
+                                              'last_messages': dispatcher.context_messages}
+    assert "- Emergency type: MEDICAL" in options['additional_instructions']
+    assert "- Victim status: unconscious" in options['additional_instructions']
+    assert dispatcher.compactions == 0  # Counted when a run starts, not when its options are built
+
+    dispatcher.context_messages = 3  # One caller turn still in context
+    assert dispatcher.incident_summary().endswith("Caller said earlier: There's a fire / At 42 Elm Street")
+    dispatcher.context_messages = 1  # None in context
+    assert dispatcher.incident_summary().endswith("There's a fire / At 42 Elm Street / Everyone is out")
+    dispatcher.cleanup()
+
+def test_stage_metrics_export_prometheus_histograms():
+    """Test spans land in the call's and the process histograms and render as Prometheus text"""
+    process = StageMetrics(enabled=True)
+    call = StageMetrics(enabled=True, parent=process)
+    for seconds in (0.02, 0.03, 0.2, 3.0):
+        call.observe('transcribe', seconds)
+    with call.span('encode'):
+        pass
+
+    snapshot = call.snapshot()
+    assert snapshot['transcribe']['count'] == 4
+    assert 0.025 <= snapshot['transcribe']['p50'] <= 0.1
+    assert process.snapshot()['encode']['count'] == 1
+
+    text = process.prometheus()
+    assert '# TYPE dispatcher_stage_latency_seconds histogram' in text
+    assert 'dispatcher_stage_latency_seconds_bucket{stage="transcribe",le="0.05"} 2' in text
+    assert 'dispatcher_stage_latency_seconds_bucket{stage="transcribe",le="+Inf"} 4' in text
+    assert 'dispatcher_stage_latency_seconds_count{stage="transcribe"} 4' in text
+
+def test_disabled_stage_metrics_are_no_ops():
+    """Test disabled metrics hand out the shared null span and record nothing"""
+    metrics = StageMetrics(enabled=False)
+    assert metrics.span('vad') is NULL_SPAN
+    metrics.observe('vad', 0.1)
+    assert metrics.snapshot() == {}
+
+def test_session_pool_hands_out_warm_dispatchers():
+    """Test calls get pre-built sessions bound to their id, and the pool refills itself"""
+    pool = SessionPool(size=2, client=Mock(), keepalive_interval=0.05)
+    pool.start()
+    deadline = time.time() + 2
+    while pool.stats()['idle'] < 2 and time.time() < deadline:
+        time.sleep(0.01)
+
+    start = time.perf_counter()
+    dispatcher = pool.acquire("sid-1")
+    assert time.perf_counter() - start < 0.05
+    assert dispatcher.call_id == "sid-1"
+    assert dispatcher.client is pool.client
+    assert pool.stats()['hits'] == 1
+
+    while pool.stats()['idle'] < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    assert pool.stats()['idle'] == 2
+    pool.client.beta.assistants.retrieve.assert_called()
+    pool.shutdown()
+    dispatcher.cleanup()
+
+def test_call_policy_hedges_slow_requests():
+    """Test a duplicate request is raced against one slower than the hedge delay"""
+    policy = CallPolicy([EndpointPolicy('stt', timeout=2.0, hedge=True, min_hedge_delay=0.05)])
+    for _ in range(20):
+        policy.endpoints['stt'].latency.observe(0.04)  # Usual tail: p95 under 50 ms
+    delays = iter([1.0, 0.0])
+    def request(timeout):
+        time.sleep(next(delays))
+        return "Help"
+
+    start = time.perf_counter()
+    assert policy.call('stt', request) == "Help"
+    assert time.perf_counter() - start < 0.5
+    stats = policy.stats()['stt']
+    assert stats['hedges'] == 1 and stats['hedge_wins'] == 1
+
+def test_call_policy_retries_then_breaks_circuit():
+    """Test retryable errors are retried, and repeated failures open the breaker"""
+    policy = CallPolicy([EndpointPolicy('stt', timeout=1.0, max_attempts=3, backoff=0.001,
+                                        breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))])
+    attempts = iter([ConnectionError(), "Help"])
+    def flaky(timeout):
+        result = next(attempts)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    assert policy.call('stt', flaky) == "Help"
+    assert policy.stats()['stt']['retries'] == 1
+
+    failing = Mock(side_effect=ConnectionError())
+    for _ in range(2):
+        assert policy.call('stt', failing, fallback=lambda: "canned") == "canned"
+    calls = failing.call_count
+    assert policy.call('stt', failing, fallback=lambda: "canned") == "canned"
+    assert failing.call_count == calls, "Open breaker should not call the endpoint"
+    assert policy.stats()['stt']['breaker'] == 'open'
+    with pytest.raises(CircuitOpenError):
+        policy.call('stt', failing)
+
+def test_call_policy_enforces_deadline_without_retrying_unsafe_calls():
+    """Test a non-idempotent call is cut off at its deadline and not resent"""
+    policy = CallPolicy([EndpointPolicy('messages', timeout=0.1, idempotent=False)])
+    slow = Mock(side_effect=lambda timeout: time.sleep(0.5))
+    with pytest.raises(TimeoutError):
+        policy.call('messages', slow)
+    assert slow.call_count == 1
+    assert 0 < slow.call_args.args[0] <= 0.1, "The attempt is given the time left as its timeout"
+    assert policy.stats()['messages']['timeouts'] == 1
+
+def test_call_policy_ignores_rejected_requests_and_bounds_streams():
+    """Test 4xx rejections don't open the breaker, and streams get a per-read timeout"""
+    policy = CallPolicy([EndpointPolicy('stt', breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60)),
+                         EndpointPolicy('tts', timeout=5.0)])
+    response = SimpleNamespace(status_code=400, headers={}, request=None)
+    rejected = Mock(side_effect=openai.BadRequestError("Invalid file format", response=response, body=None))
+    for _ in range(3):
+        assert policy.call('stt', rejected, fallback=lambda: None) is None
+    stats = policy.stats()['stt']
+    assert rejected.call_count == 3 and stats['breaker'] == 'closed' and stats['rejected'] == 3
+    with policy.guard('tts') as timeout:
+        assert timeout == 5.0
+
+def test_tts_outage_plays_the_cached_hold_phrase():
+    """Test a failing or short-circuited TTS endpoint falls back to the pre-rendered hold phrase"""
+    hold = bytes(4800)
+    policy = CallPolicy([EndpointPolicy('tts', breaker=CircuitBreaker(failure_threshold=1, reset_timeout=60))])
+    with patch('Main.call_policy', policy), patch('Main.phrase_cache', PhraseCache()) as cache:
+        dispatcher = EmergencyDispatcher(call_id="tts-down", client=Mock())
+        dispatcher.client.audio.speech.with_streaming_response.create.side_effect = ConnectionError()
+        dispatcher.player = Mock(interrupted=threading.Event())
+        cache.put(dispatcher.tts_voice, Main.TECHNICAL_DIFFICULTIES, hold)
+        dispatcher.text_to_speech("Units are on the way.")
+        dispatcher.text_to_speech("Stay on the line.")  # Breaker now open; the hold isn't repeated
+        dispatcher.cleanup()
+    assert policy.stats()['tts']['short_circuited'] == 1
+    dispatcher.player.write.assert_called_once_with(hold)
+
+def test_incident_priority_follows_severity():
+    """Test critical signs outrank the incident type when scheduling"""
+    incident = IncidentState()
+    assert incident.priority() == 'routine'
+    incident.update("My neighbor fell down the stairs")
+    assert incident.priority() == 'urgent'
+    incident.update("He is not breathing")
+    assert incident.priority() == 'critical'
+
+def test_scheduler_serves_critical_calls_first_without_starving_others():
+    """Test queued requests are granted by priority, and a long wait overtakes a higher class"""
+    scheduler = PriorityScheduler([EndpointBudget('stt', concurrency=1)])
+    budget = scheduler.budgets['stt']
+    order = []
+    now = time.perf_counter()
+    with scheduler.slot('stt', 'critical'):
+        threads = []
+        for name, priority, since in [("routine", 'routine', now), ("urgent", 'urgent', now),
+                                      ("critical", 'critical', now), ("starved", 'routine', now - 10)]:
+            def request(name=name, priority=priority, since=since):
+                with scheduler.slot('stt', priority, since):
+                    order.append(name)
+            threads.append(threading.Thread(target=request))
+            threads[-1].start()
+            while budget.stats()['classes'].get(priority, {}).get('queued', 0) < 1:
+                time.sleep(0.001)  # Wait until it is queued so the test is deterministic
+        assert sum(c['queued'] for c in budget.stats()['classes'].values()) == 4
+    for thread in threads:
+        thread.join(timeout=2)
+    assert order == ["starved", "critical", "urgent", "routine"]
+    assert budget.stats()['classes']['routine']['granted'] == 2
+
+def test_scheduler_enforces_rate_budget_and_max_wait():
+    """Test the token bucket spaces out requests and a slot that never frees times out"""
+    scheduler = PriorityScheduler([EndpointBudget('tts', concurrency=4, rate=20.0, burst=1)])
+    start = time.perf_counter()
+    for _ in range(3):
+        with scheduler.slot('tts', 'urgent'):
+            pass
+    assert time.perf_counter() - start >= 0.09  # Two waits of 50 ms for a token
+
+    scheduler.max_wait = 0.05
+    scheduler.budgets['tts'].in_flight = 4
+    with pytest.raises(SchedulerTimeout):
+        with scheduler.slot('tts', 'critical'):
+            pass
+    assert scheduler.stats()['tts']['classes']['critical']['timeouts'] == 1
+    assert 'dispatcher_scheduler_queue_depth{endpoint="tts",priority="critical"} 0' in scheduler.prometheus()
+
+def test_dashboard_assets_are_hashed_compressed_and_revalidated():
+    """Test the page links content-hashed assets served precompressed with strong ETags"""
+    client = Main.app.test_client()
+    page = client.get('/')
+    assert page.headers['Cache-Control'] == 'no-cache'
+    assert client.get('/', headers={'If-None-Match': page.headers['ETag']}).status_code == 304
+
+    script = re.search(r'/assets/dashboard\.[0-9a-f]{16}\.js', page.get_data(as_text=True)).group(0)
+    response = client.get(script, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'immutable' in response.headers['Cache-Control']
+    assert gzip.decompress(response.data).decode() == Main.DASHBOARD_JS
+    cached = client.get(script, headers={'Accept-Encoding': 'gzip',
+                                         'If-None-Match': response.headers['ETag']})
+    assert cached.status_code == 304 and not cached.data
+    assert client.get('/assets/dashboard.0000000000000000.js').status_code == 404
+
+def test_event_hub_scopes_events_to_call_rooms_and_batches_frames():
+    """Test updates go to the call's room and supervisors, batched and flushed before other events"""
+    hub = Main.EventHub(interval=60)
+    with patch('Main.socketio') as mock_socketio:
+        for token in ["Help ", "is ", "coming."]:
+            hub.coalesce('call-1', 'tokens', token)
+        hub.coalesce('call-1', 'incident', {'type': 'FIRE'})
+        hub.coalesce('call-1', 'level', 40)
+        hub.coalesce('call-1', 'level', 42)
+        update = {'role': 'dispatcher', 'message': "Help is coming."}
+        hub.emit('call-1', 'transcript_update', update)
+        hub.emit('call-1', 'audio_flush', {}, supervisors=False)
+    assert update == {'role': 'dispatcher', 'message': "Help is coming."}  # The caller's dict is not changed
+
+    (event, frame), kwargs = mock_socketio.emit.call_args_list[0]
+    assert event == 'frame' and kwargs['to'] == ['call-1', Main.SUPERVISOR_ROOM]
+    assert frame == {'tokens': "Help is coming.", 'incident': {'type': 'FIRE'}, 'level': 42,
+                     'call_id': 'call-1'}
+    assert mock_socketio.emit.call_args_list[1].args[0] == 'transcript_update'
+    assert mock_socketio.emit.call_args_list[2].kwargs['to'] == 'call-1'
+    stats = hub.stats()
+    assert stats['messages'] == 3 and stats['coalesced_updates'] == 6
+    assert stats['bytes'] == sum(e['bytes'] for e in stats['by_event'].values()) > 0
+    assert stats['messages_per_second'] > 0
+
+    hub = Main.EventHub(interval=60)
+    ready = threading.Barrier(8)
+    callers = [threading.Thread(target=lambda: (ready.wait(), hub.coalesce('call-1', 'level', 1)))
+               for _ in range(8)]
+    with patch('Main.threading.Thread', wraps=threading.Thread) as make_thread:
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+    assert make_thread.call_count == 1  # One flusher however many calls race to start it
+
+def test_call_archive_appends_and_reads_calls_by_id_and_time(tmp_path):
+    """Test records are appended across segments, found through the mapped index and recovered"""
+    archive = Main.CallArchive(str(tmp_path), segment_bytes=2048, flush_interval=60).open()
+    speech = np.arange(1600, dtype=np.int16)
+    archive.record_event('call-1', 'call_start', {}, timestamp=100.0)
+    archive.record_audio('call-1', speech, 100.0, 100.1)
+    archive.record_event('call-2', 'call_start', {}, timestamp=150.0)
+    archive.record_event('call-1', 'transcript_update', {'role': 'caller', 'message': "Fire!"},
+                         timestamp=101.0)
+    assert len(archive.entries()) == 0  # Nothing is written until the flush
+    archive.flush()
+
+    assert archive.stats()['segment'] == 3  # Records that don't fit start a new segment
+    np.testing.assert_array_equal(archive.audio('call-1'), speech)
+    assert [e['event'] for e in archive.events('call-1')] == ['call_start', 'transcript_update']
+    assert archive.events('call-1', since=100.5)[0]['message'] == "Fire!"
+    assert [c['call_id'] for c in archive.calls()] == ['call-1', 'call-2']
+    assert [c['call_id'] for c in archive.calls(since=120)] == ['call-2']
+    archive.close()
+    assert not archive.readers and archive.map is None
+
+    # A record that reached its segment but not the index is recovered on open
+    index = tmp_path / 'index.bin'
+    index.write_bytes(index.read_bytes()[:-Main.CallArchive.ENTRY.size - 5])
+    reopened = Main.CallArchive(str(tmp_path), flush_interval=60).open()
+    assert reopened.events('call-1')[-1]['message'] == "Fire!"
+    reopened.record_event('call-1', 'call_end', {}, timestamp=102.0)
+    reopened.flush()
+    assert [e['event'] for e in reopened.events('call-1')][-1] == 'call_end'
+    reopened.close()
+
+def test_dispatcher_archives_utterances_and_events(tmp_path):
+    """Test a call's utterance audio, transcript and incident changes reach the archive"""
+    archive = Main.CallArchive(str(tmp_path), flush_interval=60).open()
+    with patch('Main.call_archive', archive), patch('Main.socketio'):
+        dispatcher = EmergencyDispatcher(call_id='call-7', client=Mock())
+        dispatcher.ring.write(np.full(8000, 500, dtype=np.int16))
+        dispatcher.utterance_start = 0
+        dispatcher.queue_utterance(8000)
+        dispatcher.emit('transcript_update', {'role': 'caller', 'message': "My house is on fire"})
+        dispatcher.incident.update("My house is on fire")
+        dispatcher.publish_incident()
+        dispatcher.emit('metrics_update', {'stages': {}})
+        dispatcher.cleanup()
+    archive.flush()
+    assert len(archive.audio('call-7')) == 8000
+    assert [e['event'] for e in archive.events('call-7')] == ['transcript_update', 'incident_update',
+                                                              'call_end']
+    archive.close()
+
+def asgi_get(path, query=b''):
+    """Status, headers and body of a GET served by the async-mode ASGI app"""
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query, 'headers': []}
+    asyncio.run(Main.asgi_app(scope, receive, send))
+    return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+def test_async_server_serves_the_archive(tmp_path):
+    """Test /archive, /archive/<call_id> and its audio are served in async mode"""
+    archive = Main.CallArchive(str(tmp_path), flush_interval=60).open()
+    archive.record_event('call-5', 'call_start', {}, timestamp=100.0)
+    archive.record_audio('call-5', np.full(1600, 7, dtype=np.int16), 100.0, 100.1)
+    archive.record_event('call-5', 'transcript_update', {'role': 'caller', 'message': "Help"},
+                         timestamp=101.0)
+    archive.flush()
+    with patch('Main.call_archive', archive):
+        status, headers, body = asgi_get('/archive')
+        assert status == 200 and headers[b'Content-Type'] == b'application/json'
+        assert [c['call_id'] for c in json.loads(body)] == ['call-5']
+        status, _, body = asgi_get('/archive/call-5', b'since=100.5')
+        assert [e['event'] for e in json.loads(body)] == ['transcript_update']
+        status, headers, body = asgi_get('/archive/call-5/audio')
+        assert headers[b'Content-Type'] == b'audio/wav'
+        with wave.open(io.BytesIO(body)) as wav:
+            assert wav.getnframes() == 1600
+    archive.close()
+
+def test_ended_call_is_cleaned_up_once(tmp_path):
+    """Test end_call and run()'s own cleanup leave a single call_end record"""
+    archive = Main.CallArchive(str(tmp_path), flush_interval=60).open()
+    manager = CallSessionManager(dispatcher_factory=lambda call_id: EmergencyDispatcher(
+        call_id=call_id, client=Mock(), audio_source=NetworkAudioSource()))
+    with patch('Main.call_archive', archive), patch('Main.socketio'):
+        dispatcher = manager.start_call('call-9')
+        time.sleep(0.2)
+        assert manager.end_call('call-9')
+        deadline = time.time() + 5
+        while manager.get('call-9') is not None and time.time() < deadline:
+            time.sleep(0.01)
+        dispatcher.cleanup()
+    manager.shutdown()
+    archive.flush()
+    assert manager.get('call-9') is None
+    assert [e['event'] for e in archive.events('call-9')].count('call_end') == 1
+    archive.close()
+
+def test_transcript_index_finds_phrases_with_filters_and_merges(tmp_path):
+    """Test archived utterances are indexed incrementally, searched by phrase and filter, and reloaded"""
+    archive = Main.CallArchive(str(tmp_path / 'archive'), flush_interval=60).open()
+    index = Main.TranscriptIndex(archive, str(tmp_path / 'search'), merge_factor=2)
+    turns = [('call-1', 'caller', "There's a gas leak on Park Avenue", 'FIRE'),
+             ('call-2', 'caller', "I smell gas near the park", 'FIRE'),
+             ('call-3', 'caller', "My father collapsed on Park Ave", 'MEDICAL'),
+             ('call-1', 'dispatcher', "Leave the building, the gas company is on the way", None)]
+    for t, (call_id, role, message, emergency_type) in enumerate(turns):
+        archive.record_event(call_id, 'transcript_update', {'role': role, 'message': message},
+                             timestamp=1000.0 + t)
+        if emergency_type:
+            archive.record_event(call_id, 'incident_update', {'type': emergency_type},
+                                 timestamp=1000.0 + t)
+        archive.flush()
+        assert index.update() == 1
+    assert index.merge() and index.stats()['segments'] == 1
+
+    def calls(query, **filters):
+        return [call['call_id'] for call in index.search(query, **filters)['calls']]
+
+    assert calls('"gas leak"') == ['call-1']
+    assert calls('"leak gas"') == []
+    assert calls('park') == ['call-3', 'call-2', 'call-1']  # Newest match first
+    assert calls('"park avenue"') == ['call-3', 'call-1']  # "Park Ave" too
+    assert calls('"park ave"') == ['call-3', 'call-1']
+    assert Main.TranscriptIndex.tokens("There's smoke, Mr. Lee's on Elm St") == [
+        'theres', 'smoke', 'mr', 'lees', 'on', 'elm', 'street']
+    assert calls('park', emergency_type='fire') == ['call-2', 'call-1']
+    assert calls('gas', role='dispatcher') == ['call-1']
+    assert calls('park', since=1001.5) == ['call-3']
+    result = index.search('gas')
+    assert result['total_matches'] == 3 and result['calls'][0]['type'] == 'FIRE'
+    assert [m['role'] for m in result['calls'][0]['matches']] == ['dispatcher', 'caller']
+
+    index.save()
+    reloaded = Main.TranscriptIndex(archive, str(tmp_path / 'search'))
+    reloaded.open()
+    assert reloaded.stats()['archive_position'] == index.position
+    assert [c['call_id'] for c in reloaded.search('park', emergency_type='MEDICAL')['calls']] == ['call-3']
+    archive.record_event('call-4', 'transcript_update', {'role': 'caller', 'message': "Car crash on Oak Rd"})
+    archive.flush()
+    reloaded.close()  # Saves what was indexed since the last merge
+    restarted = Main.TranscriptIndex(archive, str(tmp_path / 'search')).open()
+    assert [c['call_id'] for c in restarted.search('"oak road"')['calls']] == ['call-4']
+
+    with patch('Main.transcript_index', reloaded):
+        status, _, body = asgi_get('/search', b'q=%22gas+leak%22&type=fire')
+        assert status == 200 and [c['call_id'] for c in json.loads(body)['calls']] == ['call-1']
+        assert asgi_get('/search', b'q=gas&role=supervisor')[0] == 400
+    archive.close()
+
+class FakeAsyncOpenAI:
+    """Just enough of AsyncOpenAI for a call: transcripts, one streamed reply and silent speech."""
+
+    def __init__(self, transcript="There's a fire at 42 Elm Street", reply=("Help is ", "on the way.")):
+        async def create(**kwargs):
+            return SimpleNamespace(id="thread")
+
+        async def transcribe(**kwargs):
+            return transcript
+
+        @contextlib.asynccontextmanager
+        async def run_stream(**kwargs):
+            async def deltas():
+                for delta in reply:
+                    yield delta
+            yield SimpleNamespace(text_deltas=deltas(), current_run=None)
+
+        @contextlib.asynccontextmanager
+        async def speech(**kwargs):
+            async def iter_bytes(size):
+                yield bytes(size)
+            yield SimpleNamespace(iter_bytes=iter_bytes)
+
+        self.beta = SimpleNamespace(threads=SimpleNamespace(
+            create=create, messages=SimpleNamespace(create=create),
+            runs=SimpleNamespace(stream=run_stream)))
+        self.audio = SimpleNamespace(
+            transcriptions=SimpleNamespace(create=transcribe),
+            speech=SimpleNamespace(with_streaming_response=SimpleNamespace(create=speech)))
+
+def test_async_dispatcher_answers_a_call_and_cancels_on_end():
+    """Test a network call is transcribed, answered and spoken on the event loop, then torn down"""
+    async def call():
+        manager = AsyncCallManager(client=FakeAsyncOpenAI())
+        dispatcher = manager.start_call('async-call')
+        audio = np.concatenate([tone(1.0), np.zeros(32000, dtype=np.int16)])
+        for seq, offset in enumerate(range(0, len(audio), 320)):
+            dispatcher.audio_source.push(seq, audio[offset:offset + 320].tobytes(), 16000)
+        for _ in range(300):
+            if dispatcher.caller_turns and not dispatcher.tts_queue.qsize() and dispatcher.speech is None:
+                break
+            await asyncio.sleep(0.01)
+        tasks = list(dispatcher.tasks)
+        assert await manager.end_call('async-call')
+        return dispatcher, tasks, manager
+
+    with patch('Main.socketio') as mock_socketio, patch('Main.geocoder') as mock_geocoder:
+        mock_geocoder.geocode.return_value = None
+        dispatcher, tasks, manager = asyncio.run(call())
+        Main.event_hub.flush()
+
+    assert dispatcher.caller_turns == ["There's a fire at 42 Elm Street"]
+    assert dispatcher.incident.type == 'FIRE' and dispatcher.incident.location
+    events = [call.args for call in mock_socketio.emit.call_args_list]
+    assert ('transcript_update', 'Help is on the way.') in [(e, d.get('message')) for e, d in events]
+    assert any(e == 'audio_out' for e, _ in events)
+    assert tasks and all(task.done() for task in tasks)
+    assert not dispatcher.call_in_progress and manager.stats()['active_calls'] == 0
+
+def test_async_calls_hold_no_threads_while_idle():
+    """Test hundreds of idle calls share one event loop without starting threads"""
+    async def calls():
+        manager = AsyncCallManager(client=FakeAsyncOpenAI())
+        threads = threading.active_count()
+        for i in range(200):
+            manager.start_call(f"idle-{i}")
+        await asyncio.sleep(0.2)
+        assert manager.stats()['active_calls'] == 200
+        assert threading.active_count() - threads <= 2  # The event hub's flusher at most
+        await manager.shutdown()
+        assert manager.stats()['active_calls'] == 0
+
+    with patch('Main.socketio'), patch.object(Main.phrase_cache, 'get', return_value=b''):
+        asyncio.run(calls())
+
+def test_async_barge_in_records_what_the_caller_heard(capsys):
+    """Test an interrupted async reply is replaced in the thread, and a failed call is logged and freed"""
+    client = FakeAsyncOpenAI()
+    client.beta.threads.messages.list = AsyncMock(return_value=SimpleNamespace(
+        data=[SimpleNamespace(id='msg-1', role='assistant')]))
+    client.beta.threads.messages.delete = AsyncMock()
+    client.beta.threads.messages.create = AsyncMock()
+    audio = {"Stay calm.": bytes(4800), "Go to the front door and wait outside for them.": bytes(96000)}
+
+    async def call():
+        dispatcher = Main.AsyncEmergencyDispatcher(call_id='barge', client=client)
+        dispatcher.thread = SimpleNamespace(id='thread')
+        dispatcher.begin_reply()
+        dispatcher.spawn(dispatcher.tts_worker())
+        for sentence in audio:
+            await dispatcher.speak(sentence)
+        await asyncio.sleep(0.6)
+        dispatcher.barge_in()
+        await asyncio.sleep(0.05)
+        await dispatcher.record_interrupted_reply()
+        await dispatcher.end()
+
+        failing = AsyncCallManager(client=FakeAsyncOpenAI())
+        failing.client.beta.threads.create = AsyncMock(side_effect=RuntimeError('no thread'))
+        failed = failing.start_call('failed-call')
+        await asyncio.sleep(0.05)
+        assert not failed.call_in_progress and failing.stats()['active_calls'] == 0
+
+    with patch('Main.socketio'), patch.object(Main.phrase_cache, 'get', side_effect=lambda v, text: audio[text]):
+        asyncio.run(call())
+
+    client.beta.threads.messages.delete.assert_awaited_once_with(thread_id='thread', message_id='msg-1')
+    content = client.beta.threads.messages.create.call_args.kwargs['content']
+    assert content.startswith("Stay calm. Go to") and content.endswith("... [interrupted by the caller]")
+    assert "wait outside" not in content
+    assert "Call failed-call failed: RuntimeError('no thread')" in capsys.readouterr().out
+
+class TestCallSessionManager:
+    @pytest.fixture
+    def manager(self):
+        """Fixture to create a session manager with stub dispatchers"""
+        def factory(call_id):
+            dispatcher = Mock()
+            dispatcher.call_id = call_id
+            dispatcher.stopped = threading.Event()
+            dispatcher.run.side_effect = lambda: dispatcher.stopped.wait(5)
+            dispatcher.cleanup.side_effect = dispatcher.stopped.set
+            return dispatcher
+
+        manager = CallSessionManager(max_sessions=2, dispatcher_factory=factory)
+        yield manager
+        manager.shutdown()
+
+    def test_sessions_are_keyed_by_call(self, manager):
+        """Test each call gets its own dispatcher and end_call routes to it"""
+        first = manager.start_call("sid-1")
+        second = manager.start_call("sid-2")
+        assert first is not second
+        assert manager.get("sid-1") is first
+
+        assert manager.end_call("sid-2")
+        second.cleanup.assert_called_once()
+        first.cleanup.assert_not_called()
+        assert not manager.end_call("unknown")
+
+    def test_admission_control(self, manager):
+        """Test calls beyond capacity are rejected until a slot frees up"""
+        manager.start_call("sid-1")
+        manager.start_call("sid-2")
+        assert manager.start_call("sid-3") is None
+        assert manager.stats()['calls_rejected'] == 1
+
+        manager.end_call("sid-1")
+        deadline = time.time() + 2
+        while manager.get("sid-1") is not None and time.time() < deadline:
+            time.sleep(0.01)
+        assert manager.start_call("sid-3") is not None
+
+    def test_call_ended_while_its_dispatcher_is_built_never_runs(self, manager):
+        """Test a hang-up during slow dispatcher construction cleans the dispatcher up and frees the slot"""
+        build = manager.dispatcher_factory
+        ended = []
+
+        def slow_factory(call_id):
+            ended.append(manager.end_call(call_id))  # The caller hangs up mid-construction
+            return build(call_id)
+
+        manager.dispatcher_factory = slow_factory
+        dispatcher = manager.start_call("sid-1")
+        assert ended == [True]
+        dispatcher.cleanup.assert_called_once()
+        dispatcher.run.assert_not_called()
+        assert manager.get("sid-1") is None and manager.stats()['active_calls'] == 0
+
+        manager.dispatcher_factory = build
+        assert manager.start_call("sid-1") is manager.get("sid-1") is not None  # The id is free again
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
\ No newline at end of file